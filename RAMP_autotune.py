@@ -0,0 +1,334 @@
+# ========================================
+# RAMPS - Autotune
+# Resection Automated Mask in Pre-operative Space
+#
+# How many cases to run at once and how many threads to give each depends on the machine. This runs the bundled
+# benchmarks (on the RAMP_n4.py phantom, on the fake orig grid at --spacing mm) at every workers x threads
+# configuration that fills the machine, and writes a profile that RAMP_scheduler.py and RAMP_service.py use for the
+# settings they are not given
+#
+#   python RAMP_autotune.py [--spacing 2] [--threads 1,2,4,8] [--benchmarks n4,synthseg,registration,atropos]
+#
+# The benchmarks, each standing for the slow part of a stage
+# - n4 : N4 bias correction with the default preset (preparation)
+# - synthseg : SynthSeg --parc with --threads, only when SynthSeg is in Place_SynthSeg_here (preparation)
+# - registration : antsRegistrationSyN[br] of the phantom to a shifted copy (registration)
+# - atropos : the 2 class KMeans Atropos of the cavity stage, with its default parameters (cavity)
+# For each configuration, workers copies of a benchmark are started as their own processes (ITK only reads its number of
+# threads when a process starts), set up, and then started together, and the throughput is workers / wall time. The
+# best configuration of each RAMP_scheduler.py stage is the one with the most throughput over its benchmarks (the one
+# with fewer workers when they are within Autotune_tolerance), the RAMP_service.py one is the best over all of them
+# A configuration is left out when its workers would not fit in the memory of the machine at 1 mm (what a worker used
+# once set up, plus what the benchmark used on top of that scaled by spacing ^ 3)
+#
+# The profile is RAMPS_autotune/<host name>.json next to this script (or $RAMPS_AUTOTUNE_PROFILE), so machines that
+# share the code each keep their own, and a profile is not used on a machine with a different number of CPUs
+# ========================================
+
+### Imports ---
+
+import argparse
+import json
+import os
+import os.path
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+Location_of_script = os.path.dirname(os.path.abspath(__file__))
+
+blank_orig_file = os.path.join(Location_of_script, "fakesurfer_orig.nii.gz")
+mri_synthseg = os.path.join(Location_of_script, "Place_SynthSeg_here", "SynthSeg", "scripts", "commands", "SynthSeg_predict.py")
+
+Autotune_benchmarks = ["n4", "synthseg", "registration", "atropos"]
+
+# The benchmarks of each RAMP_scheduler.py stage
+Autotune_stages = {"preparation": ["n4", "synthseg"], "registration": ["registration"], "cavity": ["atropos"]}
+
+Default_spacing = 2.0
+
+# Throughputs within this fraction of the best count as the same
+Autotune_tolerance = 0.05
+
+# ========================================
+### Profile ---
+
+def Default_profile_file():
+
+    return os.environ.get("RAMPS_AUTOTUNE_PROFILE") or os.path.join(Location_of_script, "RAMPS_autotune", socket.gethostname() + ".json")
+
+# The profile of this machine, None if there is none (or it was made on a machine with a different number of CPUs)
+def Load_autotune_profile(Profile_file=None):
+
+    Profile_file = Profile_file or Default_profile_file()
+
+    try:
+        with open(Profile_file) as f:
+            The_profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if The_profile.get("cpus") != os.cpu_count():
+        print("> The autotune profile " + Profile_file + " was made with " + str(The_profile.get("cpus")) + " CPUs, this machine has " + str(os.cpu_count()) + ", not used")
+        return None
+
+    print("> Autotune profile --> " + Profile_file)
+
+    return The_profile
+
+def Machine_memory_mb():
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 2
+    except (ValueError, OSError, AttributeError):
+        return None
+
+# Every thread count up to cpus that is a power of 2, and cpus itself, each with as many workers as fill the machine
+def Configurations(cpus, The_threads=None):
+
+    if The_threads is None:
+        The_threads = []
+        threads = 1
+        while threads < cpus:
+            The_threads.append(threads)
+            threads *= 2
+        The_threads.append(cpus)
+
+    return [(max(1, cpus // threads), threads) for threads in sorted(set(The_threads))]
+
+# ========================================
+### Benchmark workers ---
+
+# Set up one benchmark in Work_folder, returns the function that runs it
+def Prepare_benchmark(benchmark, Grid_file, Work_folder, threads, seed=0):
+
+    import ants
+    import numpy as np
+    from RAMP_n4 import Make_phantom, Make_n4_settings, Run_n4
+
+    The_phantom, The_bias, The_labels = Make_phantom(Grid_file, seed=seed)
+
+    if benchmark == "n4":
+        N4_settings = Make_n4_settings("default")
+        return lambda: Run_n4(The_phantom, N4_settings)
+
+    if benchmark == "registration":
+        The_moving, _, _ = Make_phantom(Grid_file, seed=seed + 1)
+        The_moving = The_moving.new_image_like(np.roll(The_moving.numpy(), (2, -1, 1), axis=(0, 1, 2)))
+        return lambda: ants.registration(fixed=The_phantom, moving=The_moving, type_of_transform='antsRegistrationSyN[br]', outprefix=Work_folder + "/reg_")
+
+    if benchmark == "atropos":
+        from RAMP_cavity import Default_cavity_parameters
+        The_mask = The_phantom.new_image_like((The_labels > 1).astype(np.float32))
+        return lambda: ants.atropos(d=3, a=The_phantom, i='KMeans[2]', m=Default_cavity_parameters["atropos_m"], c=Default_cavity_parameters["atropos_c"], x=The_mask)
+
+    if benchmark == "synthseg":
+        from RAMP_tools import Run_tool
+        The_phantom.image_write(Work_folder + "/phantom.nii.gz", ri=True)
+        The_command = ['python', mri_synthseg, '--i', Work_folder + "/phantom.nii.gz", '--o', Work_folder + "/phantom_Sseg.nii.gz", '--parc', '--threads', str(threads)]
+        return lambda: Run_tool("SynthSeg", The_command, Work_folder + "/SynthSeg.log", Outputs=[Work_folder + "/phantom_Sseg.nii.gz"], threads=threads)
+
+    raise ValueError("Unknown benchmark " + benchmark)
+
+# One worker: set up, say ready, then for each go on stdin run the benchmark once and print the times
+# Anything else (stop, or the end of stdin when Run_configuration has gone) is checked before each run and ends the worker
+def Benchmark_worker(benchmark, Grid_file, threads, seed):
+
+    import resource
+
+    with tempfile.TemporaryDirectory(prefix="RAMPS_autotune_") as Work_folder:
+
+        run = Prepare_benchmark(benchmark, Grid_file, Work_folder, threads, seed)
+
+        # The memory of the libraries and the inputs, before the benchmark itself
+        The_base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        print("ready", flush=True)
+
+        while sys.stdin.readline().strip() == "go":
+
+            start = time.time()
+            run()
+            end = time.time()
+
+            The_memory = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+            print(json.dumps({"start": start, "end": end, "base_mb": The_base, "memory_mb": The_memory}), flush=True)
+
+# ========================================
+### Configurations ---
+
+# Run workers copies of benchmark with threads each, all started together, returns a row of the results
+def Run_configuration(benchmark, workers, threads, Grid_file, Log_folder):
+
+    The_environment = dict(os.environ, ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS=str(threads), OMP_NUM_THREADS=str(threads))
+
+    The_row = {"Benchmark": benchmark, "Workers": workers, "Threads": threads, "Wall_SEC": None, "Case_SEC": None, "Cases_per_hour": None, "Base_MB": None, "Memory_MB": None, "Error": ""}
+
+    The_processes = []
+    for worker in range(workers):
+        log = open(os.path.join(Log_folder, benchmark + "_" + str(workers) + "x" + str(threads) + "_" + str(worker) + ".log"), "w")
+        The_processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", benchmark, "--grid", Grid_file, "--threads", str(threads), "--seed", str(worker)], env=The_environment, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log, text=True))
+        log.close()
+
+    # All set up before any starts, so they run side by side
+    ready = all(The_process.stdout.readline().strip() == "ready" for The_process in The_processes)
+
+    # One run each, a worker that is sent stop straight away (one of them did not set up) runs nothing
+    for The_process in The_processes:
+        try:
+            The_process.stdin.write(("go\n" if ready else "") + "stop\n")
+            The_process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    The_times = []
+    for The_process in The_processes:
+        output = The_process.stdout.read()
+        The_process.wait()
+        if The_process.returncode == 0 and output.strip():
+            The_times.append(json.loads(output.strip().splitlines()[-1]))
+
+    if not ready or len(The_times) < workers:
+        The_row["Error"] = "a worker failed, see " + Log_folder
+        return The_row
+
+    The_row["Wall_SEC"] = max(The_time["end"] for The_time in The_times) - min(The_time["start"] for The_time in The_times)
+    The_row["Case_SEC"] = sum(The_time["end"] - The_time["start"] for The_time in The_times) / workers
+    The_row["Cases_per_hour"] = 3600.0 * workers / max(The_row["Wall_SEC"], 1e-6)
+    The_row["Base_MB"] = max(The_time["base_mb"] for The_time in The_times)
+    The_row["Memory_MB"] = max(The_time["memory_mb"] for The_time in The_times)
+
+    return The_row
+
+# The best workers x threads for The_benchmarks, from the rows of every configuration
+def Best_configuration(The_rows, The_benchmarks):
+
+    The_throughputs = {}
+    for workers, threads in sorted(set((The_row["Workers"], The_row["Threads"]) for The_row in The_rows)):
+
+        The_walls = [The_row["Wall_SEC"] for The_row in The_rows if The_row["Benchmark"] in The_benchmarks and (The_row["Workers"], The_row["Threads"]) == (workers, threads)]
+        The_fits = all(The_row["Fits_memory"] for The_row in The_rows if The_row["Benchmark"] in The_benchmarks and (The_row["Workers"], The_row["Threads"]) == (workers, threads))
+
+        if The_walls and None not in The_walls and The_fits:
+            The_throughputs[(workers, threads)] = 3600.0 * workers / max(sum(The_walls), 1e-6)
+
+    if not The_throughputs:
+        return None
+
+    best = max(The_throughputs.values())
+    workers, threads = min([configuration for configuration, throughput in The_throughputs.items() if throughput >= (1 - Autotune_tolerance) * best])
+
+    return {"workers": workers, "threads": threads, "cases_per_hour": round(The_throughputs[(workers, threads)], 3)}
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="RAMP_autotune.py", description="Find the best workers x threads for RAMPS on this machine and write a profile for RAMP_scheduler.py and RAMP_service.py")
+    parser.add_argument("--spacing", type=float, default=Default_spacing, help="voxel size (mm) of the benchmark phantom, 1 is the real grid and slow (default " + str(Default_spacing) + ")")
+    parser.add_argument("--threads", default=None, help="comma separated thread counts to try (default powers of 2 up to the number of CPUs)")
+    parser.add_argument("--benchmarks", default=",".join(Autotune_benchmarks), help="comma separated benchmarks to run (default " + ",".join(Autotune_benchmarks) + ", synthseg only if SynthSeg is there)")
+    parser.add_argument("--profile", default=None, help="where to write the profile (default " + Default_profile_file() + ")")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--grid", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--seed", type=int, default=0, help=argparse.SUPPRESS)
+
+    RAMPS_arguments = parser.parse_args()
+
+    if RAMPS_arguments.worker is not None:
+        Benchmark_worker(RAMPS_arguments.worker, RAMPS_arguments.grid, int(RAMPS_arguments.threads), RAMPS_arguments.seed)
+        sys.exit(0)
+
+    cpus = os.cpu_count() or 1
+
+    try:
+        The_threads = None if RAMPS_arguments.threads is None else [int(threads) for threads in RAMPS_arguments.threads.split(",") if threads.strip()]
+    except ValueError:
+        print("Error - --threads must be comma separated numbers, e.g. 1,2,4")
+        sys.exit(1)
+
+    if The_threads is not None and (not The_threads or min(The_threads) < 1):
+        print("Error - --threads must be comma separated numbers of at least 1, e.g. 1,2,4")
+        sys.exit(1)
+
+    The_benchmarks = [benchmark.strip() for benchmark in RAMPS_arguments.benchmarks.split(",") if benchmark.strip()]
+    for benchmark in The_benchmarks:
+        if benchmark not in Autotune_benchmarks:
+            print("Error - Unknown benchmark " + benchmark + ", must be any of " + ", ".join(Autotune_benchmarks))
+            sys.exit(1)
+
+    if "synthseg" in The_benchmarks and not os.path.isfile(mri_synthseg):
+        print("> SynthSeg is not in Place_SynthSeg_here, the synthseg benchmark is left out")
+        The_benchmarks.remove("synthseg")
+
+    Profile_file = RAMPS_arguments.profile or Default_profile_file()
+
+    import pandas as pd
+    from RAMP_preview import Make_preview_grid
+
+    The_configurations = Configurations(cpus, The_threads)
+    Memory_mb = Machine_memory_mb()
+
+    print("> RAMPS autotune --> " + str(cpus) + " CPUs, " + ("unknown memory" if Memory_mb is None else str(round(Memory_mb / 1024, 1)) + " GB") + ", " + ", ".join(str(workers) + "x" + str(threads) for workers, threads in The_configurations) + " (workers x threads), phantom at " + str(RAMPS_arguments.spacing) + " mm")
+
+    start = time.time()
+
+    with tempfile.TemporaryDirectory(prefix="RAMPS_autotune_") as Autotune_folder:
+
+        Grid_file = os.path.join(Autotune_folder, "grid.nii.gz")
+        Make_preview_grid(blank_orig_file, RAMPS_arguments.spacing).image_write(Grid_file, ri=True)
+
+        Log_folder = os.path.join(os.path.dirname(os.path.abspath(Profile_file)), "logs")
+        os.makedirs(Log_folder, exist_ok=True)
+
+        The_rows = []
+        for benchmark in The_benchmarks:
+            for workers, threads in The_configurations:
+
+                The_row = Run_configuration(benchmark, workers, threads, Grid_file, Log_folder)
+
+                # The memory of all the workers at once at 1 mm, what the benchmark itself used grows with the voxels
+                The_row["Fits_memory"] = not The_row["Error"] and (Memory_mb is None or workers * (The_row["Base_MB"] + (The_row["Memory_MB"] - The_row["Base_MB"]) * RAMPS_arguments.spacing ** 3) <= 0.9 * Memory_mb)
+                The_rows.append(The_row)
+
+                if The_row["Error"]:
+                    print("> " + benchmark + " " + str(workers) + "x" + str(threads) + " --> " + The_row["Error"], flush=True)
+                else:
+                    print("> " + benchmark + " " + str(workers) + "x" + str(threads) + " --> " + str(round(The_row["Wall_SEC"], 1)) + " sec, " + str(round(The_row["Cases_per_hour"], 1)) + " per hour" + ("" if The_row["Fits_memory"] else " (too much memory at 1 mm)"), flush=True)
+
+    The_profile = {
+        "host": socket.gethostname(),
+        "cpus": cpus,
+        "memory_mb": Memory_mb,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "spacing": RAMPS_arguments.spacing,
+        "stages": {},
+        "service": None,
+        "results": The_rows,
+    }
+
+    for stage, The_stage_benchmarks in Autotune_stages.items():
+        The_best = Best_configuration(The_rows, [benchmark for benchmark in The_stage_benchmarks if benchmark in The_benchmarks])
+        if The_best is not None:
+            The_profile["stages"][stage] = The_best
+
+    The_profile["service"] = Best_configuration(The_rows, The_benchmarks)
+    if The_profile["service"] is not None:
+        The_profile["service"] = {"jobs": The_profile["service"]["workers"], "threads": The_profile["service"]["threads"]}
+
+    os.makedirs(os.path.dirname(os.path.abspath(Profile_file)), exist_ok=True)
+    with open(Profile_file, "w") as f:
+        json.dump(The_profile, f, indent=1)
+
+    print("")
+    print(pd.DataFrame(The_rows).to_string(index=False))
+    print("")
+    for stage, The_best in The_profile["stages"].items():
+        print("> " + stage + " --> " + str(The_best["workers"]) + " workers x " + str(The_best["threads"]) + " threads")
+    if The_profile["service"] is not None:
+        print("> service --> " + str(The_profile["service"]["jobs"]) + " jobs x " + str(The_profile["service"]["threads"]) + " threads")
+    print("> RAMPS autotune completed in " + str(round(time.time() - start)) + " sec --> " + Profile_file)
@@ -0,0 +1,636 @@
+# ========================================
+# RAMPS - Cavity classification
+# Resection Automated Mask in Pre-operative Space
+#
+# Steps 7 to 14 of RAMPS (the mask CREATION). These steps only need what the PREPARING and REGISTRATION steps of
+# RAMP.py have already written into the output folder, so they live here where they can be re-run on a cached
+# registration with different settings (see RAMP_sweep.py)
+# ========================================
+
+### Imports ---
+
+import os.path
+import ants
+import nibabel as nib
+import numpy as np
+from scipy import ndimage as nd
+
+from RAMP_events import Emit_event, Atropos_with_events
+from RAMP_writer import Write_image, Wait_for_writes
+from RAMP_strategies import Registration_folder
+
+# ========================================
+### Parameters ---
+
+# The knobs of the cavity stage, the defaults are the values RAMPS has always used
+Default_cavity_parameters = {
+    # Atropos smoothing factor (m) and convergence [iterations,threshold] (c) used in steps 8, 9 and 11
+    "atropos_m": "[0.25]",
+    "atropos_c": "[50,0.01]",
+    # Step 9 - how the post-op cavity is split into CSF and damaged tissue, in NumPy (see Numpy_csf_split) with gaussian
+    # (two Gaussians, as Atropos fits) or kmeans (the best two class threshold), or with atropos (Atropos KMeans[2], what
+    # RAMPS used to run)
+    "csf_split": "gaussian",
+    # Step 9 - also run Atropos and report how well the two splits agree (a csf_split event and a printed Dice)
+    "csf_split_check": False,
+    # Step 12 - stop dilating once an iteration adds this many voxels or fewer
+    "loop_stop": 100,
+    # Step 12 - clusters of expanded voxels smaller than this are classed as poor alignment
+    "min_cluster_size": 30,
+    # Step 13 - how close (in voxels) the mask has to be to the CSF border to dilate to it
+    "boundary_distance": 3,
+    # Morphology radii
+    "ventricle_radius": 1,
+    "brain_mask_erode_radius": 1,
+    "cavity_erode_radius": 1,
+    "close_radius": 1,
+}
+
+# Fill in any parameters that are not given with the defaults
+def Get_cavity_parameters(Cavity_parameters=None):
+
+    The_parameters = dict(Default_cavity_parameters)
+
+    if Cavity_parameters is None:
+        return The_parameters
+
+    for key in Cavity_parameters:
+        if key not in Default_cavity_parameters:
+            raise ValueError("Unknown cavity parameter : " + str(key) + " (expected one of " + ", ".join(Default_cavity_parameters) + ")")
+
+    The_parameters.update(Cavity_parameters)
+
+    return The_parameters
+
+# ========================================
+### Step 9 - CSF split ---
+
+Csf_splits = ["gaussian", "kmeans", "atropos"]
+Csf_split_iterations = 50
+
+# The exact two class split of 1-D values: every cut between two different sorted values is tried and the one with the
+# smallest sum of squares within the two classes is kept (the global optimum of 2-means, which in 1-D is a threshold)
+# Returns the threshold, the low class is the values below it, or None if the values cannot be split
+def Two_class_threshold(The_values):
+
+    The_sorted = np.sort(np.asarray(The_values, dtype=np.float64).ravel())
+    n = len(The_sorted)
+
+    if n < 2 or The_sorted[0] == The_sorted[-1]:
+        return None
+
+    # Centred so the sums of squares do not lose precision
+    The_sorted_centred = The_sorted - The_sorted.mean()
+    The_sums = np.cumsum(The_sorted_centred)
+    The_squares = np.cumsum(The_sorted_centred ** 2)
+
+    # k values in the low class, n - k in the high class
+    k = np.arange(1, n)
+    Low_sse = The_squares[k - 1] - The_sums[k - 1] ** 2 / k
+    High_sse = (The_squares[-1] - The_squares[k - 1]) - (The_sums[-1] - The_sums[k - 1]) ** 2 / (n - k)
+
+    The_sse = Low_sse + High_sse
+    The_sse[The_sorted[k] == The_sorted[k - 1]] = np.inf
+
+    cut = int(np.argmin(The_sse))
+
+    return (The_sorted[cut] + The_sorted[cut + 1]) / 2
+
+# Atropos KMeans[2] only starts from the two means, it then fits a mixture of two Gaussians (each with its own variance)
+# by EM. This does the same in 1-D, from the exact two class split, and returns the probability of the high class
+def Two_class_gaussian(The_values, threshold, iterations=Csf_split_iterations, tolerance=1e-6):
+
+    The_values = np.asarray(The_values, dtype=np.float64)
+    The_high = (The_values >= threshold).astype(np.float64)
+
+    The_means = [0, 1]
+    previous = None
+    for iteration in range(iterations):
+
+        The_weights = np.stack([1 - The_high, The_high], axis=1)
+        The_counts = The_weights.sum(axis=0)
+        if np.any(The_counts <= 0):
+            break
+
+        The_means = (The_weights * The_values[:, None]).sum(axis=0) / The_counts
+        The_variances = np.maximum((The_weights * (The_values[:, None] - The_means) ** 2).sum(axis=0) / The_counts, 1e-12)
+
+        The_log_likelihoods = np.log(The_counts / len(The_values)) - 0.5 * np.log(The_variances) - 0.5 * (The_values[:, None] - The_means) ** 2 / The_variances
+        The_largest = The_log_likelihoods.max(axis=1, keepdims=True)
+        The_likelihoods = np.exp(The_log_likelihoods - The_largest)
+        The_totals = The_likelihoods.sum(axis=1)
+
+        The_high = The_likelihoods[:, 1] / The_totals
+
+        log_likelihood = float(np.mean(np.log(The_totals) + The_largest[:, 0]))
+        if previous is not None and abs(log_likelihood - previous) < tolerance:
+            break
+        previous = log_likelihood
+
+    # EM can swap the two classes around
+    if The_means[0] > The_means[1]:
+        return 1 - The_high
+
+    return The_high
+
+# The CSF of the post-op cavity, the darker of the two intensity classes in the cavity (bool arrays)
+# kmeans is the exact two class split, gaussian goes on from it to the two Gaussian fit. A cavity that cannot be split
+# (one intensity) is all CSF. Voxels at 0 are left out, as ants.get_mask did
+def Numpy_csf_split(The_post_op, The_cavity, method="gaussian"):
+
+    The_values = The_post_op[The_cavity]
+    threshold = Two_class_threshold(The_values)
+
+    The_csf = The_cavity.copy()
+    if threshold is not None:
+        if method == "kmeans":
+            The_csf[The_cavity] = The_values < threshold
+        else:
+            The_csf[The_cavity] = Two_class_gaussian(The_values, threshold) < 0.5
+
+    return The_csf & (The_post_op >= 1e-15)
+
+# Step 9 as RAMPS used to run it, Atropos KMeans[2] in the cavity and the class with the lower median intensity is the CSF
+def Atropos_csf_split(PostOP_rescale, Post_op_resection_cavity, atropos_m, atropos_c):
+
+    The_atropos = Atropos_with_events('post_op_sag', d=3,a=PostOP_rescale, i ='KMeans[2]',  m=atropos_m, c=atropos_c, x=Post_op_resection_cavity)
+
+    The_segmentation = The_atropos['segmentation'].numpy()
+    The_post_op = PostOP_rescale.numpy()
+
+    The_classes = [(The_segmentation == label) & (The_post_op >= 1e-15) for label in [1, 2]]
+    The_medians = [np.median(The_post_op[The_class]) if The_class.any() else np.nan for The_class in The_classes]
+
+    return The_classes[1] if The_medians[0] > The_medians[1] else The_classes[0]
+
+# ========================================
+### Step 13 - Boundary dilation ---
+
+# Step 13 boundary dilation (full volume version)
+# For every voxel find its nearest CSF border voxel, if that border voxel is within Max_distance of the resection mask
+# (and further away from the mask than the voxel itself) keep the border voxel distance, otherwise 0
+# This is the original full volume approach and is kept so the narrow band version can be checked against it (see
+# tests/test_border_dilation.py and --validate_narrow_band)
+def Full_volume_border_dilation(The_base_data, The_border_data, Max_distance=3):
+
+    The_distance = nd.distance_transform_edt(The_base_data == 0)
+    The_border_distance = The_distance * (The_border_data != 0)
+
+    The_distance_to_border,indices = nd.distance_transform_edt(The_border_data == 0, return_indices=True)
+
+    the_value = The_border_distance[tuple(indices)]
+
+    return np.where((the_value > The_distance) & (the_value < Max_distance), the_value, 0)
+
+# Step 13 boundary dilation (narrow band version)
+# Only voxels closer than Max_distance to the mask can be kept, so only they are needed, in a box around the mask. The
+# distances to the mask are exact in the box (all the mask is in it) but the nearest border voxel of a voxel may be
+# outside the box, and then a farther one inside it would be used. So the box is only used once every voxel that could
+# be kept is nearer to its border voxel in the box than to the edge of the box (where it meets the rest of the volume),
+# otherwise the margin is doubled until it is (at worst the box is the full volume)
+def Narrow_band_border_dilation(The_base_data, The_border_data, Max_distance=3):
+
+    The_border_data_BLANK = np.zeros(The_base_data.shape)
+
+    The_base_mask = The_base_data != 0
+    The_border_mask = The_border_data != 0
+
+    if not The_base_mask.any() or not The_border_mask.any():
+        return The_border_data_BLANK
+
+    the_coords = np.nonzero(The_base_mask)
+    Margin = 3 * int(np.ceil(Max_distance))
+
+    while True:
+
+        # Bounding box of the mask plus the margin
+        The_band = tuple(slice(max(int(c.min()) - Margin, 0), min(int(c.max()) + Margin + 1, n)) for c, n in zip(the_coords, The_base_mask.shape))
+
+        if all(band.start == 0 and band.stop == n for band, n in zip(The_band, The_base_mask.shape)):
+            return Full_volume_border_dilation(The_base_mask, The_border_mask, Max_distance)
+
+        The_border_band = The_border_mask[The_band]
+
+        if The_border_band.any():
+
+            The_distance = nd.distance_transform_edt(The_base_mask[The_band] == 0)
+            The_distance_to_border,indices = nd.distance_transform_edt(The_border_band == 0, return_indices=True)
+
+            # How far each voxel is from the first voxel outside the box, along the axes where the box stops short of the volume
+            The_edge_distance = np.full(The_distance.shape, np.inf)
+            for axis, (band, n) in enumerate(zip(The_band, The_base_mask.shape)):
+                the_index = np.arange(band.stop - band.start, dtype=float)
+                the_edge = np.minimum(the_index + 1 if band.start > 0 else np.inf, band.stop - band.start - the_index if band.stop < n else np.inf)
+                The_edge_distance = np.minimum(The_edge_distance, the_edge.reshape([-1 if i == axis else 1 for i in range(3)]))
+
+            The_candidates = The_distance < Max_distance
+
+            if np.all(The_distance_to_border[The_candidates] < The_edge_distance[The_candidates]):
+
+                the_value = (The_distance * The_border_band)[tuple(indices)]
+
+                The_border_data_BLANK[The_band] = np.where((the_value > The_distance) & (the_value < Max_distance), the_value, 0)
+
+                return The_border_data_BLANK
+
+        Margin *= 2
+
+# ========================================
+### Load the outputs of the PREPARING and REGISTRATION steps ---
+
+# Everything the cavity stage needs from the output folder, read once
+# The post-op images are moved into the pre-op space here as that does not depend on any of the cavity parameters
+def Load_cavity_inputs(Output_Folder):
+
+    RemoveHyper=os.path.join(Output_Folder, "S8_RemoveHyper")
+    Lobe_of_resection=os.path.join(Output_Folder, "S6_Lobe_of_resection")
+    Get_ventricles=os.path.join(Output_Folder, "S7_Get_ventricles")
+
+    reg_br=Registration_folder(Output_Folder)
+
+    mri_synthseg_folder=os.path.join(Output_Folder, "S3_mri_synthseg")
+    PreOP_mri_synthseg_folder=os.path.join(mri_synthseg_folder,'Pre_op')
+    PostOP_mri_synthseg_folder=os.path.join(mri_synthseg_folder,'Post_op')
+
+    Cavity_inputs = {}
+    Cavity_inputs["PreOP_mri_synthseg_folder"] = PreOP_mri_synthseg_folder
+
+    PreOP_RemoveHyper = ants.image_read(RemoveHyper+"/Pre_Final_skullstriped_image_Manual_remove_hyper.nii.gz")
+    Cavity_inputs["PreOP_RemoveHyper"] = PreOP_RemoveHyper
+
+    # Images used for the rescale (step 7)
+    Cavity_inputs["Pre_Op_for_rescale"] = nib.load(RemoveHyper+"/Pre_Final_skullstriped_image_Manual_remove_hyper.nii.gz")
+    Cavity_inputs["Post_Op_for_rescale"] = nib.load(reg_br+"/warpedmovout.nii.gz")
+
+    PostOP_Sseg_MASK = ants.image_read(PostOP_mri_synthseg_folder+"/PreOP_Sseg_MASK.nii.gz")
+    PostOP_Sseg_MASK_24 = ants.image_read(PostOP_mri_synthseg_folder+"/PostOP_Sseg_area_24.nii.gz")
+
+    Cavity_inputs["PreOP_Sseg_MASK"] = ants.image_read(PreOP_mri_synthseg_folder+"/PreOP_Sseg_MASK.nii.gz")
+    Cavity_inputs["PreOP_ventricles"] = ants.image_read(Get_ventricles+"/PreOP_ventricles.nii.gz")
+    PostOP_ventricles = ants.image_read(Get_ventricles+"/PostOP_ventricles.nii.gz")
+
+    antsRegistrationSyN_br_transformlist = [reg_br+"/br_1Warp.nii.gz" , reg_br+"/br_0GenericAffine.mat"]
+    Cavity_inputs["antsRegistrationSyN_br_transformlist"] = antsRegistrationSyN_br_transformlist
+
+    # Move the post op images into the pre-op
+    Cavity_inputs["post_op_VENTS_moving"] = ants.apply_transforms(fixed=PreOP_RemoveHyper, moving=PostOP_ventricles, transformlist=antsRegistrationSyN_br_transformlist, interpolator='multiLabel')
+    Cavity_inputs["PostOP_Sseg_MASK_moving"] = ants.apply_transforms(fixed=PreOP_RemoveHyper, moving=PostOP_Sseg_MASK, transformlist=antsRegistrationSyN_br_transformlist, interpolator='multiLabel')
+    Cavity_inputs["PostOP_Sseg_MASK_24_moving"] = ants.apply_transforms(fixed=PreOP_RemoveHyper, moving=PostOP_Sseg_MASK_24, transformlist=antsRegistrationSyN_br_transformlist, interpolator='multiLabel')
+
+    Set_lobe_of_resection(Cavity_inputs,
+        ants.image_read(Lobe_of_resection+"/PreOP_feildResection.nii.gz"),
+        ants.image_read(Lobe_of_resection+"/PostOP_feildResection.nii.gz"),
+        ants.image_read(Lobe_of_resection+"/PreOP_NONE_feildResection.nii.gz"),
+        ants.image_read(Lobe_of_resection+"/PostOP_NONE_feildResection.nii.gz"))
+
+    return Cavity_inputs
+
+# The inputs that depend on the Hemisphere and Lobe (the section 3.5 feild maps, see Make_resection_field_maps in
+# RAMP_stages.py), kept apart so other lobes of resection can be tried without loading everything again
+def Set_lobe_of_resection(Cavity_inputs, Pre_OP_feild_map_Resected_area, Post_OP_feild_map_Resected_area, PRE_the_none_resected_lobe, POST_the_none_resected_lobe):
+
+    PreOP_RemoveHyper = Cavity_inputs["PreOP_RemoveHyper"]
+    antsRegistrationSyN_br_transformlist = Cavity_inputs["antsRegistrationSyN_br_transformlist"]
+
+    Cavity_inputs["PRE_the_none_resected_lobe"] = PRE_the_none_resected_lobe
+    Cavity_inputs["Pre_OP_feild_map_Resected_area"] = Pre_OP_feild_map_Resected_area
+
+    # Move the post op images into the pre-op
+    Cavity_inputs["POST_the_none_resected_lobe_moving"] = ants.apply_transforms(fixed=PreOP_RemoveHyper, moving=POST_the_none_resected_lobe, transformlist=antsRegistrationSyN_br_transformlist, interpolator='multiLabel')
+    Cavity_inputs["POST_the_resected_lobe_moving"] = ants.apply_transforms(fixed=PreOP_RemoveHyper, moving=Post_OP_feild_map_Resected_area, transformlist=antsRegistrationSyN_br_transformlist, interpolator='multiLabel')
+
+    return Cavity_inputs
+
+# Only look for the resection inside Roi, a mask on the orig grid (e.g. the dilated preview mask, see RAMP_preview.py)
+# The feild maps of the lobe of resection are cut down to it, the rest of the brain still takes part in the Atropos
+# classifications as the tissue that was not resected
+def Restrict_to_roi(Cavity_inputs, Roi):
+
+    Cavity_inputs["Pre_OP_feild_map_Resected_area"] = Cavity_inputs["Pre_OP_feild_map_Resected_area"] * Roi
+    Cavity_inputs["POST_the_resected_lobe_moving"] = Cavity_inputs["POST_the_resected_lobe_moving"] * Roi
+
+    return Cavity_inputs
+
+# ========================================
+### Make the resection mask ---
+
+# Run steps 7 to 14 with the given parameters, every intermediate image is written into Do_Resection_Mask_br
+# Returns the final resection mask in the orig space
+def Make_resection_mask(Cavity_inputs, Do_Resection_Mask_br, Cavity_parameters=None, Validate_narrow_band=False):
+
+    The_parameters = Get_cavity_parameters(Cavity_parameters)
+
+    atropos_m = The_parameters["atropos_m"]
+    atropos_c = The_parameters["atropos_c"]
+
+    if not os.path.exists(Do_Resection_Mask_br):
+        os.makedirs(Do_Resection_Mask_br)
+
+    PreOP_Sseg_MASK = Cavity_inputs["PreOP_Sseg_MASK"]
+    PRE_the_none_resected_lobe = Cavity_inputs["PRE_the_none_resected_lobe"]
+    Pre_OP_feild_map_Resected_area = Cavity_inputs["Pre_OP_feild_map_Resected_area"]
+    PreOP_ventricles = Cavity_inputs["PreOP_ventricles"]
+    PreOP_mri_synthseg_folder = Cavity_inputs["PreOP_mri_synthseg_folder"]
+
+    # ===========================================
+    # Resection_Mask br
+    # ===========================================
+
+    ## Rescale the images between 0 and 1 - as we want to take one image away from the other so its easy if both images are
+    Pre_Op_for_rescale = Cavity_inputs["Pre_Op_for_rescale"]
+    Post_Op_for_rescale = Cavity_inputs["Post_Op_for_rescale"]
+
+    Pre_Op_for_rescale_fdata = Pre_Op_for_rescale.get_fdata()
+    Post_Op_for_rescale_fdata = Post_Op_for_rescale.get_fdata()
+
+    Pre_Op_for_rescale_fdata = (Pre_Op_for_rescale_fdata - np.min(Pre_Op_for_rescale_fdata))/np.ptp(Pre_Op_for_rescale_fdata)
+    Post_Op_for_rescale_fdata = (Post_Op_for_rescale_fdata - np.min(Post_Op_for_rescale_fdata))/np.ptp(Post_Op_for_rescale_fdata)
+
+    PRE_save = nib.Nifti1Image(Pre_Op_for_rescale_fdata,Pre_Op_for_rescale.affine,Pre_Op_for_rescale.header)
+    Write_image(PRE_save, Do_Resection_Mask_br+"/PreOP_rescale.nii.gz")
+
+    PostOP_save = nib.Nifti1Image(Post_Op_for_rescale_fdata,Post_Op_for_rescale.affine,Post_Op_for_rescale.header)
+    Write_image(PostOP_save, Do_Resection_Mask_br+"/PostOP_rescale.nii.gz")
+
+    Wait_for_writes(Do_Resection_Mask_br+"/PreOP_rescale.nii.gz")
+    PreOP_rescale = ants.image_read(Do_Resection_Mask_br+"/PreOP_rescale.nii.gz")
+    Wait_for_writes(Do_Resection_Mask_br+"/PostOP_rescale.nii.gz")
+    PostOP_rescale = ants.image_read(Do_Resection_Mask_br+"/PostOP_rescale.nii.gz")
+
+    PreOP_rescale_mask = ants.get_mask(PreOP_rescale,low_thresh=0.000000000000001,cleanup=0)
+    PostOP_rescale_mask = ants.get_mask(PostOP_rescale,low_thresh=0.000000000000001,cleanup=0)
+
+    # Work out the parts of the masks that dont align
+    difference_in_mask = PreOP_rescale_mask - PostOP_rescale_mask
+    difference_in_mask = ants.threshold_image( difference_in_mask, 1, 1 )
+    Write_image(difference_in_mask, Do_Resection_Mask_br+"/difference_in_mask.nii.gz")
+
+    # ===========================================
+    # Move the post op vents into the pre-op
+    # ===========================================
+
+    POST_the_none_resected_lobe_moving = Cavity_inputs["POST_the_none_resected_lobe_moving"]
+    POST_the_resected_lobe_moving = Cavity_inputs["POST_the_resected_lobe_moving"]
+
+    post_op_VENTS_moving = Cavity_inputs["post_op_VENTS_moving"]
+    post_op_VENTS_moving_errode = ants.morphology( post_op_VENTS_moving, operation='erode', radius=The_parameters["ventricle_radius"], mtype='binary')
+    post_op_VENTS_moving_Dilate = ants.morphology( post_op_VENTS_moving, operation='dilate', radius=The_parameters["ventricle_radius"], mtype='binary')
+
+    PostOP_Sseg_MASK_moving = Cavity_inputs["PostOP_Sseg_MASK_moving"]
+    PostOP_Sseg_MASK_24_moving = Cavity_inputs["PostOP_Sseg_MASK_24_moving"]
+
+    PostOP_Sseg_FULL_MASK = PostOP_Sseg_MASK_moving + PostOP_Sseg_MASK_24_moving
+    PostOP_Sseg_FULL_MASK = ants.get_mask(PostOP_Sseg_FULL_MASK,low_thresh=1,cleanup=0)
+    Write_image(PostOP_Sseg_FULL_MASK, Do_Resection_Mask_br+"/PostOP_Sseg_FULL_MASK.nii.gz")
+
+    PostOP_Sseg_MASK_moving = ants.morphology( PostOP_Sseg_MASK_moving, operation='erode', radius=The_parameters["brain_mask_erode_radius"], mtype='binary')
+    Write_image(PostOP_Sseg_MASK_moving, Do_Resection_Mask_br+"/move_PostOP_Sseg_MASK.nii.gz")
+    Write_image(PostOP_Sseg_MASK_24_moving, Do_Resection_Mask_br+"/move_PostOP_Sseg_MASK_24.nii.gz")
+
+    Write_image(post_op_VENTS_moving, Do_Resection_Mask_br+"/move_PostOP_vents_to_PreOP.nii.gz")
+    Write_image(post_op_VENTS_moving_errode, Do_Resection_Mask_br+"/move_PostOP_vents_to_PreOP_errode.nii.gz")
+
+    Write_image(POST_the_none_resected_lobe_moving, Do_Resection_Mask_br+"/move_POST_the_none_resected_lobe_moving.nii.gz")
+
+    POST_the_none_resected_lobe_moving = POST_the_none_resected_lobe_moving - post_op_VENTS_moving
+    post_op_VENTS_moving_errode = post_op_VENTS_moving_errode * 2
+
+    Postop_find_csv_priorimage = post_op_VENTS_moving_errode + POST_the_none_resected_lobe_moving
+    Write_image(Postop_find_csv_priorimage, Do_Resection_Mask_br+"/Postop_find_csv_priorimage.nii.gz")
+
+    # Atropos reads its prior from disk
+    Wait_for_writes(Do_Resection_Mask_br+"/Postop_find_csv_priorimage.nii.gz")
+    Postop_find_csv_atropos = Atropos_with_events('post_op_cavity', d=3,a=PostOP_rescale, i ='PriorLabelImage[2,'+Do_Resection_Mask_br+'/Postop_find_csv_priorimage.nii.gz,0]',  m=atropos_m, c=atropos_c, x=PostOP_Sseg_MASK_moving)
+    Post_op_resection_cavity_The_atropos = ants.threshold_image( Postop_find_csv_atropos['segmentation'], 2, 2)
+
+    Post_op_resection_cavity_The_atropos = Post_op_resection_cavity_The_atropos * POST_the_resected_lobe_moving
+    Post_op_resection_cavity_The_atropos = ants.iMath(Post_op_resection_cavity_The_atropos, 'GetLargestComponent')
+
+    Post_op_resection_cavity_The_atropos_OVERLAP = Post_op_resection_cavity_The_atropos * post_op_VENTS_moving_Dilate
+
+    Post_op_resection_cavity_The_atropos = Post_op_resection_cavity_The_atropos - Post_op_resection_cavity_The_atropos_OVERLAP
+
+    Write_image(Post_op_resection_cavity_The_atropos, Do_Resection_Mask_br+"/Post_op_resection_cavity.nii.gz")
+
+    # ===========================================
+    # Split the post-op cavity into CSF and damaged tissue
+    # ===========================================
+
+    # The cavity is small, so its intensities are split here rather than with another Atropos run
+    The_cavity = Post_op_resection_cavity_The_atropos.numpy() > 0
+    The_post_op = PostOP_rescale.numpy()
+
+    if The_parameters["csf_split"] not in Csf_splits:
+        raise ValueError("Unknown csf_split " + str(The_parameters["csf_split"]) + ", must be one of " + ", ".join(Csf_splits))
+
+    if The_parameters["csf_split"] != "atropos":
+        The_csf = Numpy_csf_split(The_post_op, The_cavity, The_parameters["csf_split"])
+
+    if The_parameters["csf_split"] == "atropos" or The_parameters["csf_split_check"]:
+        The_atropos_csf = Atropos_csf_split(PostOP_rescale, Post_op_resection_cavity_The_atropos, atropos_m, atropos_c)
+
+    if The_parameters["csf_split"] == "atropos":
+        The_csf = The_atropos_csf
+
+    elif The_parameters["csf_split_check"]:
+        overlap = int((The_csf & The_atropos_csf).sum())
+        dice = 2 * overlap / max(int(The_csf.sum()) + int(The_atropos_csf.sum()), 1)
+        print("> Step 9 CSF split --> " + The_parameters["csf_split"] + " " + str(int(The_csf.sum())) + " voxels, Atropos " + str(int(The_atropos_csf.sum())) + " voxels, Dice " + str(round(dice, 4)))
+        Emit_event("csf_split", method=The_parameters["csf_split"], voxels=int(The_csf.sum()), atropos_voxels=int(The_atropos_csf.sum()), dice=round(dice, 4))
+
+    # 1 the CSF, 2 the damaged tissue
+    The_split = np.zeros(The_cavity.shape, dtype=np.float32)
+    The_split[The_cavity] = 2
+    The_split[The_csf] = 1
+    Write_image(Post_op_resection_cavity_The_atropos.new_image_like(The_split), Do_Resection_Mask_br+"/Postop_find_csv_atropos_Looking_for_sag.nii.gz")
+
+    the_post_op_CSF = Post_op_resection_cavity_The_atropos.new_image_like(The_csf.astype(np.float32) * 2)
+
+    # ===========================================
+    # Subtraction image
+    # ===========================================
+
+    The_subtracted_image = PostOP_rescale - PreOP_rescale
+    Write_image(The_subtracted_image, Do_Resection_Mask_br+"/The_subtracted_image.nii.gz")
+
+    PREop_Part_of_the_subtracted = The_subtracted_image * PreOP_Sseg_MASK
+    Write_image(PREop_Part_of_the_subtracted, Do_Resection_Mask_br+"/PREop_Part_of_the_subtracted.nii.gz")
+
+    vents_overlap = PreOP_ventricles + post_op_VENTS_moving
+
+    vents_overlap = ants.get_mask(vents_overlap,low_thresh=1,cleanup=0)
+    vents_overlap = ants.morphology( vents_overlap, operation='dilate', radius=The_parameters["ventricle_radius"], mtype='binary')
+    Write_image(vents_overlap, Do_Resection_Mask_br+"/vents_overlap.nii.gz")
+
+    PRE_the_none_resected_lobe_remove_vents = PRE_the_none_resected_lobe - vents_overlap
+    PRE_the_none_resected_lobe_remove_vents = ants.threshold_image( PRE_the_none_resected_lobe_remove_vents, 1, 1)
+    Write_image(PRE_the_none_resected_lobe_remove_vents, Do_Resection_Mask_br+"/PRE_the_none_resected_lobe_remove_vents.nii.gz")
+
+    PREop_priorimage = PRE_the_none_resected_lobe_remove_vents + the_post_op_CSF
+    PREop_priorimage_ONE = ants.threshold_image( PREop_priorimage, 1, 1 )
+    Write_image(PREop_priorimage_ONE, Do_Resection_Mask_br+"/PREop_priorimage_ONE.nii.gz")
+
+    PREop_priorimage_TWO = ants.threshold_image( PREop_priorimage, 2, 2 )
+    PREop_priorimage_TWO = PREop_priorimage_TWO * 2
+    Write_image(PREop_priorimage_TWO, Do_Resection_Mask_br+"/PREop_priorimage_TWO.nii.gz")
+
+    PREop_priorimage = PREop_priorimage_ONE + PREop_priorimage_TWO
+
+    Write_image(PREop_priorimage, Do_Resection_Mask_br+"/PREop_priorimage.nii.gz")
+
+    PreOP_Sseg_MASK_errode = ants.morphology( PreOP_Sseg_MASK, operation='erode', radius=The_parameters["brain_mask_erode_radius"], mtype='binary')
+
+    Wait_for_writes(Do_Resection_Mask_br+"/PREop_priorimage.nii.gz")
+    Pre_op_cavity_atropos = Atropos_with_events('pre_op_cavity', d=3,a=The_subtracted_image, i ='PriorLabelImage[2,'+Do_Resection_Mask_br+'/PREop_priorimage.nii.gz,0]',  m=atropos_m, c=atropos_c, x=PreOP_Sseg_MASK_errode)
+    Write_image(Pre_op_cavity_atropos['segmentation'], Do_Resection_Mask_br+"/Pre_op_cavity_atropos.nii.gz")
+
+    Pre_find_resection_cavity = ants.threshold_image( Pre_op_cavity_atropos['segmentation'], 2, 2)
+    Pre_find_resection_cavity = Pre_find_resection_cavity * Pre_OP_feild_map_Resected_area
+    Pre_find_resection_cavity = ants.iMath(Pre_find_resection_cavity, 'GetLargestComponent')
+    Write_image(Pre_find_resection_cavity, Do_Resection_Mask_br+"/Pre_find_resection_cavity.nii.gz")
+
+    # ===========================================
+    # Cavity removal
+    # ===========================================
+
+    # get the erroded cavity
+    Wait_for_writes(Do_Resection_Mask_br+"/Pre_find_resection_cavity.nii.gz")
+    The_MAX = nib.load(Do_Resection_Mask_br+"/Pre_find_resection_cavity.nii.gz")
+    The_MAX_data = The_MAX.get_fdata()
+
+    Pre_find_resection_cavity_errode = ants.morphology( Pre_find_resection_cavity, operation='erode', radius=The_parameters["cavity_erode_radius"], mtype='binary')
+    Write_image(Pre_find_resection_cavity_errode, Do_Resection_Mask_br+"/Pre_find_resection_cavity_errode.nii.gz")
+
+    # get the erroded cavity
+    Wait_for_writes(Do_Resection_Mask_br+"/Pre_find_resection_cavity_errode.nii.gz")
+    The_base_loaded = nib.load(Do_Resection_Mask_br+"/Pre_find_resection_cavity_errode.nii.gz")
+    The_base_loaded_data = The_base_loaded.get_fdata()
+    the_expanded_volume = np.count_nonzero(The_base_loaded_data)
+    pre_base = the_expanded_volume
+
+    # Create a blank image that we will add the voxels that we shouldnt expand into
+    The_no_go_zone = Pre_find_resection_cavity_errode - Pre_find_resection_cavity_errode
+    Write_image(The_no_go_zone, Do_Resection_Mask_br+"/The_no_go_zone.nii.gz")
+
+    the_difference = 10000
+    loop_iteration = 0
+
+    print(the_expanded_volume)
+
+    while the_difference > The_parameters["loop_stop"]:
+
+        The_base_loaded_dilated = nd.binary_dilation(The_base_loaded_data)
+
+        The_base_loaded_dilated = The_base_loaded_dilated * The_MAX_data
+
+        The_base_loaded_dilated_save = nib.Nifti1Image(The_base_loaded_dilated,The_base_loaded.affine,The_base_loaded.header)
+        Write_image(The_base_loaded_dilated_save, Do_Resection_Mask_br+"/The_base_loaded_dilated_save.nii.gz")
+
+        # The images of each iteration are kept in memory for the next one and only written (in the background) to be looked at
+        The_no_go_zone_data = The_no_go_zone.numpy()
+
+        The_expanded_area = The_base_loaded_dilated - The_base_loaded_data - The_no_go_zone_data
+
+        The_expanded_area_save = nib.Nifti1Image(The_expanded_area,The_base_loaded.affine,The_base_loaded.header)
+        Write_image(The_expanded_area_save, Do_Resection_Mask_br+"/The_expanded_area_save.nii.gz")
+
+        # As ants.image_read would give it (float), on the grid of the eroded cavity the base came from
+        ANTS_The_expanded_area_save = Pre_find_resection_cavity_errode.new_image_like(The_expanded_area.astype(np.float32))
+        The_label_clusters=ants.label_clusters(ANTS_The_expanded_area_save,min_cluster_size=0)
+        Write_image(The_label_clusters, Do_Resection_Mask_br+"/The_label_clusters.nii.gz")
+
+        The_label_clusters_loaded_data = The_label_clusters.numpy()
+        the_expanded_volume = np.count_nonzero(The_label_clusters_loaded_data)
+
+        how_many_clusters = np.max(The_label_clusters_loaded_data)
+
+        print(how_many_clusters)
+
+        no_go_zone_changed = False
+
+        for x in range(1, int(how_many_clusters) + 1):
+
+            How_large_is_cluster =   np.sum(The_label_clusters_loaded_data == x)
+
+            if How_large_is_cluster < The_parameters["min_cluster_size"]:
+                get_cluster = ants.threshold_image( The_label_clusters, x, x )
+                The_no_go_zone = The_no_go_zone + get_cluster
+                The_no_go_zone = ants.get_mask(The_no_go_zone,low_thresh=1,cleanup=0)
+                no_go_zone_changed = True
+
+        # Written once with all of this iteration's small clusters
+        if no_go_zone_changed:
+            Write_image(The_no_go_zone, Do_Resection_Mask_br+"/The_no_go_zone.nii.gz")
+
+        The_no_go_zone_data = The_no_go_zone.numpy()
+
+        The_base_loaded_data = The_base_loaded_data + (The_expanded_area - The_no_go_zone_data)
+        # Float, as it reads back from The_base.nii.gz
+        The_base_loaded_data = np.where(The_base_loaded_data!=0, 1.0, 0.0)
+
+        The_base_loaded_data_save = nib.Nifti1Image(The_base_loaded_data,The_base_loaded.affine,The_base_loaded.header)
+        Write_image(The_base_loaded_data_save, Do_Resection_Mask_br+"/The_base.nii.gz")
+
+        the_post_expansion = np.count_nonzero(The_base_loaded_data)
+
+        the_difference = the_post_expansion - pre_base
+        pre_base = the_post_expansion
+        print('the_difference')
+        print(the_difference)
+
+        loop_iteration = loop_iteration + 1
+        Emit_event("cavity_loop", iteration=loop_iteration, clusters=int(how_many_clusters), added_voxels=int(the_difference), volume=int(the_post_expansion))
+
+    # ===========================================
+    # Boundary dilation
+    # ===========================================
+
+    # Get the difference between the border
+    # Only distances under boundary_distance voxels are used so this is done in a narrow band around the resection mask rather than the full volume
+    To_get_distance_data = The_base_loaded_data
+
+    The_border = nib.load(PreOP_mri_synthseg_folder+"/PreOP_Sseg_area_24.nii.gz")
+    The_border_data = The_border.get_fdata()
+
+    # For each voxel get the cordinates to it nearest CSF voxel
+    # Replace the voxel with the CSF voxel distance to the the resection mask voxel (I know confusion)
+    The_border_data_BLANK = Narrow_band_border_dilation(To_get_distance_data, The_border_data, Max_distance=The_parameters["boundary_distance"])
+
+    if Validate_narrow_band:
+
+        The_full_volume_BLANK = Full_volume_border_dilation(To_get_distance_data, The_border_data, Max_distance=The_parameters["boundary_distance"])
+
+        The_full_volume_BLANK_save = nib.Nifti1Image(The_full_volume_BLANK,The_border.affine,The_border.header)
+        Write_image(The_full_volume_BLANK_save, Do_Resection_Mask_br+"/The_voxel_distance_full_volume_save.nii.gz")
+
+        the_mismatch = np.count_nonzero(The_full_volume_BLANK != The_border_data_BLANK)
+        print("> Narrow band vs full volume boundary dilation, voxels that differ --> " + str(the_mismatch))
+
+        if the_mismatch != 0:
+            raise RuntimeError("The narrow band boundary dilation does not match the full volume result (" + str(the_mismatch) + " voxels differ)")
+
+    # Filter the that image to the area of tissue
+    PreOP_Sseg_MASK_load = nib.load(PreOP_mri_synthseg_folder+"/PreOP_Sseg_MASK.nii.gz")
+    PreOP_Sseg_MASK_load_data = PreOP_Sseg_MASK_load.get_fdata()
+
+    The_border_data_BLANK = PreOP_Sseg_MASK_load_data * The_border_data_BLANK
+
+    The_border_data_BLANK_save = nib.Nifti1Image(The_border_data_BLANK,The_border.affine,The_border.header)
+    Write_image(The_border_data_BLANK_save, Do_Resection_Mask_br+"/The_voxel_distance_save.nii.gz")
+
+    # ===========================================
+    # Additional cleaning
+    # ===========================================
+
+    # Get the mask and clean up a little
+    Wait_for_writes(Do_Resection_Mask_br+"/The_voxel_distance_save.nii.gz")
+    The_voxel_distance_image = ants.image_read(Do_Resection_Mask_br+"/The_voxel_distance_save.nii.gz")
+
+    The_final_mask = ants.get_mask(The_voxel_distance_image,low_thresh=1,cleanup=0)
+
+    The_final_mask = ants.iMath(The_final_mask, 'GetLargestComponent')
+    The_final_mask = ants.morphology(The_final_mask,"close",radius=The_parameters["close_radius"])
+
+    Write_image(The_final_mask, Do_Resection_Mask_br+"/THE_Resection_mask.nii.gz")
+
+    return The_final_mask
@@ -0,0 +1,135 @@
+# ========================================
+# RAMPS - DICOM series input
+# Resection Automated Mask in Pre-operative Space
+#
+# Lets RAMPS take a folder holding one DICOM series (one slice per file) in place of a NIfTI image, without a separate
+# conversion to nii.gz first
+# - Check_dicom_series : reads only the slice headers and checks the series is one regular 3D volume
+# - Read_dicom_series : decodes the slices in parallel straight into the volume and returns it as an ants image
+#
+# DICOM positions are in LPS, the same as ITK/ants, so the geometry is taken from the headers as it is:
+# origin = ImagePositionPatient of the first slice, direction = the row and column cosines of ImageOrientationPatient and
+# their cross product, spacing = PixelSpacing and the distance between slices
+#
+# Needs pydicom (pip install pydicom), it is only imported when a DICOM folder is given
+# ========================================
+
+### Imports ---
+
+import os
+import os.path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# ========================================
+### Headers ---
+
+def Import_pydicom():
+
+    try:
+        import pydicom
+    except ImportError:
+        raise ValueError("pydicom is needed to read a DICOM folder (pip install pydicom)")
+
+    return pydicom
+
+def Read_slice_header(slice_file):
+
+    pydicom = Import_pydicom()
+
+    try:
+        return pydicom.dcmread(slice_file, stop_before_pixels=True)
+    except Exception:
+        # Not a DICOM file (DICOMDIR, notes, ...), it is left out
+        return None
+
+# Reads the headers of every slice (in parallel) and works out the order and geometry of the volume
+# Returns a dict with the sorted slice files and the geometry, or raises ValueError
+def Read_series_geometry(Dicom_folder, workers=None):
+
+    The_files = sorted(os.path.join(Dicom_folder, name) for name in os.listdir(Dicom_folder) if os.path.isfile(os.path.join(Dicom_folder, name)))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        The_headers = list(pool.map(Read_slice_header, The_files))
+
+    The_slices = [(slice_file, header) for slice_file, header in zip(The_files, The_headers) if header is not None and "ImagePositionPatient" in header]
+
+    if len(The_slices) < 2:
+        raise ValueError("No DICOM image series found in : " + Dicom_folder)
+
+    The_series = sorted(set(str(header.get("SeriesInstanceUID", "")) for _, header in The_slices))
+    if len(The_series) > 1:
+        raise ValueError("The folder holds " + str(len(The_series)) + " DICOM series, RAMPS needs a folder with one series : " + Dicom_folder)
+
+    header = The_slices[0][1]
+
+    if int(header.get("NumberOfFrames", 1) or 1) > 1:
+        raise ValueError("Multi-frame DICOM is not supported, export the series with one slice per file : " + Dicom_folder)
+
+    orientation = np.array([float(value) for value in header.ImageOrientationPatient])
+    row_cosine, column_cosine = orientation[:3], orientation[3:]
+    normal = np.cross(row_cosine, column_cosine)
+
+    for _, other in The_slices:
+        if not np.allclose([float(value) for value in other.ImageOrientationPatient], orientation, atol=1e-4):
+            raise ValueError("The slices of the DICOM series do not all have the same orientation : " + Dicom_folder)
+        if (int(other.Rows), int(other.Columns)) != (int(header.Rows), int(header.Columns)):
+            raise ValueError("The slices of the DICOM series are not all the same size : " + Dicom_folder)
+
+    # Order the slices along the normal to the slice plane
+    The_positions = np.array([[float(value) for value in other.ImagePositionPatient] for _, other in The_slices])
+    The_distances = The_positions @ normal
+    order = np.argsort(The_distances)
+
+    The_gaps = np.diff(The_distances[order])
+    slice_spacing = float(np.median(The_gaps))
+
+    if slice_spacing <= 0 or np.any(np.abs(The_gaps - slice_spacing) > 0.01 * slice_spacing + 1e-3):
+        raise ValueError("The DICOM slices are not evenly spaced (missing or repeated slices?) : " + Dicom_folder)
+
+    pixel_spacing = [float(value) for value in header.PixelSpacing]
+
+    return {
+        "Files": [The_slices[index][0] for index in order],
+        "Slopes": [(float(The_slices[index][1].get("RescaleSlope", 1) or 1), float(The_slices[index][1].get("RescaleIntercept", 0) or 0)) for index in order],
+        # Index order i (columns), j (rows), k (slices) as in ants
+        "Shape": (int(header.Columns), int(header.Rows), len(order)),
+        "Spacing": [pixel_spacing[1], pixel_spacing[0], slice_spacing],
+        "Origin": list(The_positions[order[0]]),
+        "Direction": np.stack([row_cosine, column_cosine, normal], axis=1),
+    }
+
+# Header-only check, returns a short description of the series or raises ValueError
+def Check_dicom_series(Dicom_folder):
+
+    The_geometry = Read_series_geometry(Dicom_folder)
+
+    return "DICOM series, " + str(The_geometry["Shape"]) + " voxels of " + " x ".join(str(round(size, 3)) for size in The_geometry["Spacing"]) + " mm"
+
+# ========================================
+### Reading ---
+
+# Decodes every slice into its place in one float32 volume (no copy of the whole volume is made) and returns it as an
+# ants image, the same pixel type ants.image_read gives
+def Read_dicom_series(Dicom_folder, workers=None):
+
+    import ants
+
+    pydicom = Import_pydicom()
+
+    The_geometry = Read_series_geometry(Dicom_folder, workers)
+
+    The_volume = np.empty(The_geometry["Shape"], dtype=np.float32)
+
+    def Decode_slice(index):
+        slope, intercept = The_geometry["Slopes"][index]
+        The_pixels = pydicom.dcmread(The_geometry["Files"][index]).pixel_array
+        # pixel_array is (rows, columns), the volume is indexed (column, row, slice)
+        np.multiply(The_pixels.T, slope, out=The_volume[:, :, index], casting="unsafe")
+        The_volume[:, :, index] += intercept
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(Decode_slice, range(The_geometry["Shape"][2])))
+
+    return ants.from_numpy(The_volume, origin=The_geometry["Origin"], spacing=The_geometry["Spacing"], direction=The_geometry["Direction"])
@@ -0,0 +1,180 @@
+# ========================================
+# RAMPS - Cohort evaluation
+# Resection Automated Mask in Pre-operative Space
+#
+# Compares RAMPS masks against reference (manual) masks for a whole cohort, so a change to the pipeline can be checked
+# for accuracy (and speed) before it is used. Cases are run in parallel.
+#
+# The manifest is a csv with the columns
+# - ID : the case ID
+# - RAMPS_Output : the RAMPS output folder (or a mask file)
+# - Reference_mask : the reference mask, on the same grid as the RAMPS mask that is being compared
+#
+# For each case we report Dice, the volumes and their difference, HD95, the maximum (Hausdorff) and average symmetric
+# surface distance (mm), joined to the per-stage timings RAMP.py writes into RAMPS_Resection_Mask_Output
+# ========================================
+
+### Imports ---
+
+import argparse
+import os.path
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+from scipy import ndimage as nd
+
+# ========================================
+### Inputs ---
+
+parser = argparse.ArgumentParser(prog="RAMP_evaluate.py", description="Evaluate RAMPS masks against reference masks for a cohort")
+parser.add_argument("Manifest", help="csv with the columns ID, RAMPS_Output, Reference_mask")
+parser.add_argument("Output_csv", help="where to write the per-case results")
+parser.add_argument("--space", default="PRE", choices=["PRE", "ORIG"], help="which RAMPS mask to compare when RAMPS_Output is a folder (default PRE, the resolution of the pre-op input)")
+parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of cases evaluated at the same time")
+
+# ========================================
+### Metrics ---
+
+# The voxels on the outside of a mask
+def Mask_surface(The_mask):
+
+    return The_mask & ~nd.binary_erosion(The_mask, border_value=0)
+
+# Distance (mm) from every surface voxel of one mask to the nearest surface voxel of the other, in both directions
+# Only the box around both masks is looked at, as all of the surface voxels are inside it
+def Surface_distances(The_mask, The_reference, spacing):
+
+    The_union = np.nonzero(The_mask | The_reference)
+    The_box = tuple(slice(max(int(c.min()) - 1, 0), int(c.max()) + 2) for c in The_union)
+
+    The_mask_surface = Mask_surface(The_mask[The_box])
+    The_reference_surface = Mask_surface(The_reference[The_box])
+
+    Distance_to_reference = nd.distance_transform_edt(~The_reference_surface, sampling=spacing)
+    Distance_to_mask = nd.distance_transform_edt(~The_mask_surface, sampling=spacing)
+
+    return Distance_to_reference[The_mask_surface], Distance_to_mask[The_reference_surface]
+
+def Compare_masks(The_mask, The_reference, spacing):
+
+    The_mask = The_mask > 0
+    The_reference = The_reference > 0
+
+    voxel_volume = float(np.prod(spacing))
+
+    mask_voxels = int(np.count_nonzero(The_mask))
+    reference_voxels = int(np.count_nonzero(The_reference))
+    overlap_voxels = int(np.count_nonzero(The_mask & The_reference))
+
+    The_results = {}
+    The_results["Dice"] = 2 * overlap_voxels / (mask_voxels + reference_voxels) if mask_voxels + reference_voxels > 0 else np.nan
+    The_results["Volume_RAMPS_mm3"] = mask_voxels * voxel_volume
+    The_results["Volume_Reference_mm3"] = reference_voxels * voxel_volume
+    The_results["Volume_difference_mm3"] = (mask_voxels - reference_voxels) * voxel_volume
+    The_results["Volume_difference_percent"] = 100 * (mask_voxels - reference_voxels) / reference_voxels if reference_voxels > 0 else np.nan
+
+    # Surface distances are not defined if either mask is empty
+    if mask_voxels == 0 or reference_voxels == 0:
+        The_results["HD95_mm"] = np.nan
+        The_results["Hausdorff_mm"] = np.nan
+        The_results["ASSD_mm"] = np.nan
+        return The_results
+
+    Mask_to_reference, Reference_to_mask = Surface_distances(The_mask, The_reference, spacing)
+
+    The_results["HD95_mm"] = max(np.percentile(Mask_to_reference, 95), np.percentile(Reference_to_mask, 95))
+    The_results["Hausdorff_mm"] = max(Mask_to_reference.max(), Reference_to_mask.max())
+    The_results["ASSD_mm"] = np.concatenate([Mask_to_reference, Reference_to_mask]).mean()
+
+    return The_results
+
+# ========================================
+### Cases ---
+
+# The per-stage timings written by RAMP.py, one column per stage
+def Read_time_keeping(RAMPS_Output):
+
+    Time_keeping_csv = os.path.join(RAMPS_Output, "RAMPS_Resection_Mask_Output", "RAMP_Time_keeping.csv")
+
+    if not os.path.isfile(Time_keeping_csv):
+        return {}
+
+    Time_keeping = pd.read_csv(Time_keeping_csv)
+
+    The_times = {"Time_" + str(section): float(recorded_time) for section, recorded_time in zip(Time_keeping["Section"], Time_keeping["Time_(SEC)"])}
+    The_times["Time_Total"] = float(Time_keeping["Time_(SEC)"].sum())
+
+    return The_times
+
+def Evaluate_case(Case):
+
+    ID, RAMPS_Output, Reference_mask, space = Case
+
+    The_results = {"ID": ID, "Error": ""}
+
+    if os.path.isdir(RAMPS_Output):
+        The_mask_path = os.path.join(RAMPS_Output, "RAMPS_Resection_Mask_Output", "RAMP_The_resection_mask_in_" + space + ".nii.gz")
+        The_results.update(Read_time_keeping(RAMPS_Output))
+    else:
+        The_mask_path = RAMPS_Output
+
+    for path in [The_mask_path, Reference_mask]:
+        if not os.path.isfile(path):
+            The_results["Error"] = "This file is not detected : " + path
+            return The_results
+
+    The_mask = nib.load(The_mask_path)
+    The_reference = nib.load(Reference_mask)
+
+    if The_mask.shape[:3] != The_reference.shape[:3]:
+        The_results["Error"] = "The RAMPS mask " + str(The_mask.shape) + " and reference mask " + str(The_reference.shape) + " are not on the same grid"
+        return The_results
+
+    if not np.allclose(The_mask.affine, The_reference.affine, atol=1e-3):
+        print("> Warning - " + str(ID) + " the RAMPS and reference mask affines differ")
+
+    spacing = The_mask.header.get_zooms()[:3]
+
+    The_results.update(Compare_masks(np.asanyarray(The_mask.dataobj), np.asanyarray(The_reference.dataobj), spacing))
+
+    return The_results
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    RAMPS_arguments = parser.parse_args()
+
+    if not os.path.isfile(RAMPS_arguments.Manifest):
+        print("Error - This file is not detected : " + RAMPS_arguments.Manifest)
+        sys.exit(1)
+
+    Manifest = pd.read_csv(RAMPS_arguments.Manifest)
+
+    for column in ["ID", "RAMPS_Output", "Reference_mask"]:
+        if column not in Manifest.columns:
+            print("Error - The manifest is missing the column " + column)
+            sys.exit(1)
+
+    The_cases = [(ID, RAMPS_Output, Reference_mask, RAMPS_arguments.space) for ID, RAMPS_Output, Reference_mask in zip(Manifest["ID"], Manifest["RAMPS_Output"], Manifest["Reference_mask"])]
+
+    print("> RAMPS evaluation --> " + str(len(The_cases)) + " cases on " + str(RAMPS_arguments.workers) + " workers")
+
+    with ProcessPoolExecutor(max_workers=RAMPS_arguments.workers) as pool:
+        The_results = pd.DataFrame(list(pool.map(Evaluate_case, The_cases)))
+
+    The_results.to_csv(RAMPS_arguments.Output_csv, index=False)
+
+    The_failed = The_results[The_results["Error"] != ""]
+    for ID, error in zip(The_failed["ID"], The_failed["Error"]):
+        print("Error - " + str(ID) + " : " + error)
+
+    The_summary_columns = [c for c in ["Dice", "Volume_difference_mm3", "HD95_mm", "ASSD_mm", "Time_Total"] if c in The_results.columns]
+    print("")
+    print(The_results[The_summary_columns].describe().loc[["count", "mean", "50%", "min", "max"]].to_string())
+    print("")
+    print("> RAMPS evaluation completed --> " + RAMPS_arguments.Output_csv)
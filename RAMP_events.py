@@ -0,0 +1,287 @@
+# ========================================
+# RAMPS - Progress events
+# Resection Automated Mask in Pre-operative Space
+#
+# A stream of structured events from a RAMPS run, so a scheduler can tell a hung run from a slow one
+# - Add_event_callback(callback) : callback(The_event) is called with every event, a dict
+# - Open_event_fd(fd) : write every event to a file descriptor as newline delimited JSON (RAMP.py --event_fd)
+#
+# Every event has "event", "time" (unix seconds) and "pid", and then
+# - stage_start / stage_end : stage, output_folder (and seconds at the end)
+# - section : section, seconds - a row of RAMP_Time_keeping.csv as it is recorded
+# - heartbeat : name, seconds, cpu_seconds - every Heartbeat_seconds while the registration or Atropos runs (event fds
+#   only), the CPU time of the process keeps going up while it is working and stops if it hangs
+# - registration_iteration : stage (0 rigid, 1 b-spline SyN), level, iteration, metric, convergence
+# - registration_stage_end : stage, seconds
+# - registration_qc : output_folder, attempt, passed, correlation, ventricle_dice, jacobian_min, jacobian_max, failed - the
+#   check of the registration (see RAMP_qc.py)
+# - registration_strategy : output_folder, selected, correlations, failed - the registration strategy that was chosen
+#   when more than one was run (see RAMP_strategies.py)
+# - tool_end : tool, attempt, exit_code, seconds, timed_out, missing_outputs, log - each run of mri_synthstrip or SynthSeg
+#   (see RAMP_tools.py)
+# - atropos_iteration : name, iteration, max_iterations, posterior
+# - atropos_end : name, iterations, max_iterations, posterior, converged, seconds
+# - cavity_loop : iteration, clusters, added_voxels, volume - step 12, the dilation loop
+# - csf_split : method, voxels, atropos_voxels, dice - step 9, only with the csf_split_check cavity parameter
+# The registration and Atropos iteration events are read from their verbose output, which can only be read once they have
+# finished (see Read_tool_output), so they come together at the end of each one, the heartbeats come while they run
+# While they are read fd 1 of the whole process goes to a file, so threads that print while a tool may be running use
+# Print_output, and only one thread at a time reads a tool's output (see Output_lock)
+#
+# With no callbacks nothing is done, the registration and Atropos only run verbose when there is somewhere to send the
+# events
+# ========================================
+
+### Imports ---
+
+import json
+import os
+import re
+import sys
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+Event_callbacks = []
+Event_fds = []
+Event_lock = threading.Lock()
+
+Heartbeat_seconds = 30
+
+# Held for as long as Read_tool_output has fd 1, anything another thread of this process writes to stdout in that time
+# would go into the tool output and be lost
+Output_lock = threading.RLock()
+Output_wait_seconds = 5
+
+# ========================================
+### Callbacks ---
+
+def Add_event_callback(callback):
+
+    Event_callbacks.append(callback)
+
+    return callback
+
+def Remove_event_callback(callback):
+
+    if callback in Event_callbacks:
+        Event_callbacks.remove(callback)
+
+def Events_enabled():
+
+    return len(Event_callbacks) > 0
+
+def Emit_event(event, **fields):
+
+    if not Event_callbacks:
+        return
+
+    The_event = {"event": event, "time": round(time.time(), 3), "pid": os.getpid()}
+    The_event.update(fields)
+
+    Send_event(The_event)
+
+# Pass on an event that has already been made (e.g. one from a worker process, see RAMP_scheduler.py)
+def Send_event(The_event):
+
+    for callback in list(Event_callbacks):
+        try:
+            callback(The_event)
+        except Exception as e:
+            # A broken callback should not stop the run
+            sys.stderr.write("> Event callback failed --> " + repr(e) + "\n")
+
+# Newline delimited JSON on fd, the fd is duplicated so the events still go to the right place while stdout is being
+# read for the registration and Atropos iterations (even if fd is 1)
+def Open_event_fd(fd):
+
+    Event_fd = os.dup(int(fd))
+    Event_fds.append(Event_fd)
+
+    def Write_event(The_event):
+
+        with Event_lock:
+            Write_event_line(Event_fd, The_event)
+
+    return Add_event_callback(Write_event)
+
+def Write_event_line(fd, The_event):
+
+    line = (json.dumps(The_event, default=str) + "\n").encode()
+
+    while line:
+        line = line[os.write(fd, line):]
+
+# ========================================
+### Tool output ---
+
+# The C stdout the ITK tools write through, flushed so what they write ends up on the right side of the redirect
+def Flush_c_stdout():
+
+    import ctypes
+
+    libc = ctypes.CDLL(None)
+
+    try:
+        libc.fflush(ctypes.c_void_p.in_dll(libc, "stdout"))
+    except ValueError:
+        pass
+
+# print for threads that may run while a tool's output is being read (e.g. the RAMP_service.py runners), it waits until
+# fd 1 is back
+def Print_output(text):
+
+    with Output_lock:
+        print(text, flush=True)
+
+# Sends what the ITK tools write to stdout (fd 1) through Parse_line, one line at a time, once the block is done
+# ANTsPy holds the GIL while a tool runs so nothing in this process can read it as it is written (and a pipe could fill
+# up and block the tool), it goes into a temporary file instead
+# fd 1 is shared by every thread, so a tool that starts while another thread is reading one runs without being read (no
+# iteration events, the heartbeats still come) rather than both redirecting fd 1 and putting it back in the wrong order
+@contextmanager
+def Read_tool_output(Parse_line):
+
+    # A Print_output only holds it for a moment, another tool for minutes
+    if not Output_lock.acquire(timeout=Output_wait_seconds):
+        yield
+        return
+
+    try:
+        sys.stdout.flush()
+        Flush_c_stdout()
+
+        The_output = tempfile.TemporaryFile()
+        saved_stdout = os.dup(1)
+        os.dup2(The_output.fileno(), 1)
+    except BaseException:
+        Output_lock.release()
+        raise
+
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        Flush_c_stdout()
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
+        Output_lock.release()
+
+        The_output.seek(0)
+        for line in The_output:
+            try:
+                Parse_line(line.decode(errors="replace"))
+            except Exception:
+                pass
+        The_output.close()
+
+# Sends heartbeat events to the event fds every Heartbeat_seconds until the block is done
+# This has to be a separate process, this one is held by the tool, and it reads the CPU time of this process from /proc
+# (Linux, elsewhere cpu_seconds is None). The Python callbacks do not get heartbeats
+@contextmanager
+def Heartbeat(name):
+
+    if not Event_fds:
+        yield
+        return
+
+    The_watcher = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--heartbeat", str(os.getpid()), name, str(Heartbeat_seconds)] + [str(fd) for fd in Event_fds], pass_fds=Event_fds)
+
+    try:
+        yield
+    finally:
+        The_watcher.terminate()
+        The_watcher.wait()
+
+def Read_cpu_seconds(pid):
+
+    try:
+        with open("/proc/" + str(pid) + "/stat") as stat:
+            The_fields = stat.read().rsplit(")", 1)[1].split()
+        # utime and stime, fields 14 and 15 of /proc/<pid>/stat
+        return round((int(The_fields[11]) + int(The_fields[12])) / os.sysconf("SC_CLK_TCK"), 3)
+    except (OSError, ValueError, IndexError):
+        return None
+
+Registration_stage_line = re.compile(r"^Stage (\d+)\s*$")
+Registration_iteration_line = re.compile(r"^\s*\d*[A-Z]?DIAGNOSTIC,\s*(\d+),\s*([^,]+),\s*([^,]+),")
+Registration_elapsed_line = re.compile(r"Elapsed time \(stage (\d+)\):\s*([^\s]+)")
+
+# ants.registration, with registration_iteration events when there is somewhere to send them
+def Registration_with_events(**registration_args):
+
+    import ants
+
+    if not Events_enabled():
+        return ants.registration(**registration_args)
+
+    The_state = {"stage": 0, "level": 0}
+
+    def Parse_line(line):
+
+        The_match = Registration_stage_line.match(line)
+        if The_match:
+            The_state.update(stage=int(The_match.group(1)), level=0)
+            return
+
+        # Each level of a stage starts with a DIAGNOSTIC header
+        if "DIAGNOSTIC,Iteration" in line:
+            The_state["level"] += 1
+            return
+
+        The_match = Registration_iteration_line.match(line)
+        if The_match:
+            Emit_event("registration_iteration", stage=The_state["stage"], level=The_state["level"], iteration=int(The_match.group(1)), metric=float(The_match.group(2)), convergence=float(The_match.group(3)))
+            return
+
+        The_match = Registration_elapsed_line.search(line)
+        if The_match:
+            Emit_event("registration_stage_end", stage=int(The_match.group(1)), seconds=float(The_match.group(2)))
+
+    with Heartbeat("registration"), Read_tool_output(Parse_line):
+        return ants.registration(verbose=True, **registration_args)
+
+Atropos_iteration_line = re.compile(r"Iteration (\d+) \(of (\d+)\): posterior probability = ([^\s]+)")
+
+# ants.atropos, with atropos_iteration and atropos_end events when there is somewhere to send them
+def Atropos_with_events(name, **atropos_args):
+
+    import ants
+
+    if not Events_enabled():
+        return ants.atropos(**atropos_args)
+
+    The_state = {"iterations": 0, "max_iterations": 0, "posterior": None}
+
+    def Parse_line(line):
+
+        The_match = Atropos_iteration_line.search(line)
+        if The_match:
+            The_state.update(iterations=int(The_match.group(1)), max_iterations=int(The_match.group(2)), posterior=float(The_match.group(3)))
+            Emit_event("atropos_iteration", name=name, iteration=The_state["iterations"], max_iterations=The_state["max_iterations"], posterior=The_state["posterior"])
+
+    start = time.time()
+
+    with Heartbeat("atropos " + name), Read_tool_output(Parse_line):
+        The_atropos = ants.atropos(v=1, **atropos_args)
+
+    # Atropos stops before its maximum number of iterations once the posterior changes less than the threshold
+    Emit_event("atropos_end", name=name, iterations=The_state["iterations"], max_iterations=The_state["max_iterations"], posterior=The_state["posterior"], converged=The_state["iterations"] < The_state["max_iterations"], seconds=round(time.time() - start, 3))
+
+    return The_atropos
+
+# The heartbeat watcher (see Heartbeat), python RAMP_events.py --heartbeat <pid> <name> <seconds> <fd> ...
+if __name__ == "__main__" and len(sys.argv) > 4 and sys.argv[1] == "--heartbeat":
+
+    pid, name, seconds = int(sys.argv[2]), sys.argv[3], float(sys.argv[4])
+    The_fds = [int(fd) for fd in sys.argv[5:]]
+
+    start = time.time()
+
+    while True:
+        time.sleep(seconds)
+        The_event = {"event": "heartbeat", "time": round(time.time(), 3), "pid": pid, "name": name, "seconds": round(time.time() - start, 3), "cpu_seconds": Read_cpu_seconds(pid)}
+        for fd in The_fds:
+            Write_event_line(fd, The_event)
@@ -0,0 +1,293 @@
+# ========================================
+# RAMPS - Hemisphere / lobe hypotheses
+# Resection Automated Mask in Pre-operative Space
+#
+# For cases where the hemisphere and lobe of resection are not known. The Hemisphere and Lobe only change section 3.5
+# (the feild maps of the lobe of resection) and the cavity stage, so on an output folder that has been through the
+# preparation and registration stages (with any Hemisphere and Lobe) every candidate can be tried without re-doing them
+#
+#   python RAMP_hypothesis.py <Output_Folder> --hemisphere LR --lobes T,F,P,O --top 2 --workers 2
+#
+# 1 - every candidate (hemisphere x lobes) gets a subtraction score from its feild map, which takes a moment:
+#     the number of voxels in the feild map where the pre-op brain tissue looks resected in the registered post-op image
+#     (the rescaled post-op minus pre-op is below -subtraction_threshold), less the number expected from the rate of
+#     such voxels in the rest of the brain (registration noise)
+# 2 - the cavity stage (steps 7 to 14, see RAMP_cavity.py) is run for the --top best scoring candidates in parallel
+# 3 - the best scoring candidate with a mask is the answer
+#
+# Outputs (in <Output_Folder>/S13_Hypotheses)
+# - <candidate>/ : the feild maps, the cavity stage intermediates and RAMP_The_resection_mask_in_ORIG.nii.gz
+# - Hypothesis_ranking.csv : every candidate with its score, and the mask volume for the ones that were run
+# - RAMP_The_resection_mask_in_ORIG.nii.gz : the mask of the best candidate
+# RAMP.py runs this in place of its cavity stage when the Hemisphere and/or Lobe is given as auto
+# ========================================
+
+### Imports ---
+
+import argparse
+import multiprocessing
+import os
+import os.path
+import shutil
+import sys
+import time
+
+Default_subtraction_threshold = 0.25
+
+# ========================================
+### Inputs ---
+
+parser = argparse.ArgumentParser(prog="RAMP_hypothesis.py", description="Try every hemisphere / lobe of resection on a RAMPS output folder that has been through registration")
+parser.add_argument("Output_Folder", help="a RAMPS output folder that has been through the registration step")
+parser.add_argument("--hemisphere", default="LR", help="the hemispheres to try, L, R or LR (default LR)")
+parser.add_argument("--lobes", default="T,F,P,O", help="comma separated lobes of resection to try, each any combination of T F O P (default T,F,P,O)")
+parser.add_argument("--top", type=int, default=2, help="number of the best scoring candidates the cavity stage is run for (default 2)")
+parser.add_argument("--subtraction_threshold", type=float, default=Default_subtraction_threshold, help="how much darker (rescaled 0 to 1) the post-op has to be for a voxel to count as resected in the score (default " + str(Default_subtraction_threshold) + ")")
+parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="number of candidates run at the same time")
+parser.add_argument("--threads", type=int, default=1, help="ITK threads for each worker")
+
+# The Hemisphere and Lobe of a case as RAMP.py takes them, L, R or auto and any combination of T F O P or auto (RAMP.py,
+# RAMP_scheduler.py and RAMP_service.py all check them here). Returns the Hemisphere, the list of lobes and the candidates
+# (None unless one of them is auto, the Hemisphere and lobes are then those of the first candidate, which the
+# preparation and registration stages are run with), raises ValueError
+def Parse_hemisphere_lobe(Hemisphere, Lobe):
+
+    Hemisphere = str(Hemisphere).strip().upper()
+    Lobe_intro = str(Lobe).strip().upper()
+
+    if Hemisphere not in ["L", "R", "AUTO"]:
+        raise ValueError("Hemisphere not properly defined, must be L, R or auto")
+
+    Lobes = [element for element in Lobe_intro if element in ['T','F','O','P']]
+    Candidates = None
+
+    if Hemisphere == "AUTO" or Lobe_intro == "AUTO":
+        Candidates = Make_candidates("LR" if Hemisphere == "AUTO" else Hemisphere, "T,F,P,O" if Lobe_intro == "AUTO" else "".join(Lobes))
+        Hemisphere, Lobes = Candidates[0][0], list(Candidates[0][1])
+
+    if not Lobes:
+        raise ValueError("Lobe not properly defined, must be any combination of T F O P or auto")
+
+    return Hemisphere, Lobes, Candidates
+
+# Every hemisphere x lobes candidate, e.g. Make_candidates("LR", "T,F") -> [("L","T"), ("L","F"), ("R","T"), ("R","F")]
+def Make_candidates(Hemispheres, Lobes):
+
+    The_candidates = []
+
+    for Hemisphere in [element for element in str(Hemispheres).upper() if element in ["L", "R"]]:
+        for Lobe in str(Lobes).upper().split(","):
+            Lobe = "".join(element for element in Lobe if element in ['T','F','O','P'])
+            if Lobe and (Hemisphere, Lobe) not in The_candidates:
+                The_candidates.append((Hemisphere, Lobe))
+
+    if not The_candidates:
+        raise ValueError("No candidates, the hemisphere must be L, R or LR and the lobes any combination of T F O P")
+
+    return The_candidates
+
+# ========================================
+### Scoring ---
+
+# The feild map inputs of section 3.5, read once
+def Load_hypothesis_inputs(Output_Folder):
+
+    import ants
+
+    Lobe_template_folder=os.path.join(Output_Folder, "S5_Lobe_template")
+    mri_synthseg_folder=os.path.join(Output_Folder, "S3_mri_synthseg")
+
+    return {
+        "PreOP_ATLAS_DIL_FILTER": ants.image_read(os.path.join(Lobe_template_folder, "Pre_op", "Dilation", "PreOP_ATLAS_DIL_FILTER.nii.gz")),
+        "PostOP_ATLAS_DIL_FILTER": ants.image_read(os.path.join(Lobe_template_folder, "Post_op", "Dilation", "PostOP_ATLAS_DIL_FILTER.nii.gz")),
+        "PreOP_Sseg_MASK": ants.image_read(os.path.join(mri_synthseg_folder, "Pre_op", "PreOP_Sseg_MASK.nii.gz")),
+        "PostOP_Sseg_MASK": ants.image_read(os.path.join(mri_synthseg_folder, "Post_op", "PreOP_Sseg_MASK.nii.gz")),
+    }
+
+def Make_candidate_field_maps(Hypothesis_inputs, Hemisphere, Lobe):
+
+    from RAMP_stages import Make_resection_field_maps
+
+    return Make_resection_field_maps(Hypothesis_inputs["PreOP_ATLAS_DIL_FILTER"], Hypothesis_inputs["PostOP_ATLAS_DIL_FILTER"], Hypothesis_inputs["PreOP_Sseg_MASK"], Hypothesis_inputs["PostOP_Sseg_MASK"], Hemisphere, list(Lobe))
+
+# The pre-op brain voxels that look resected in the registered post-op image, the same rescale as step 7 and the same
+# subtraction as step 10 of the cavity stage, with the ventricles (pre-op and moved post-op) left out
+def Resected_looking_voxels(Cavity_inputs, Subtraction_threshold=Default_subtraction_threshold):
+
+    import numpy as np
+
+    Pre_Op_fdata = Cavity_inputs["Pre_Op_for_rescale"].get_fdata()
+    Post_Op_fdata = Cavity_inputs["Post_Op_for_rescale"].get_fdata()
+
+    Pre_Op_fdata = (Pre_Op_fdata - np.min(Pre_Op_fdata))/np.ptp(Pre_Op_fdata)
+    Post_Op_fdata = (Post_Op_fdata - np.min(Post_Op_fdata))/np.ptp(Post_Op_fdata)
+
+    The_brain = (Cavity_inputs["PreOP_Sseg_MASK"].numpy() > 0) & (Cavity_inputs["PreOP_ventricles"].numpy() == 0) & (Cavity_inputs["post_op_VENTS_moving"].numpy() == 0)
+
+    return (Post_Op_fdata - Pre_Op_fdata < -Subtraction_threshold) & The_brain, The_brain
+
+# Returns the score and the fraction of the feild map that looks resected
+def Subtraction_score(The_resected_looking, The_brain, Pre_OP_feild_map_Resected_area):
+
+    The_field = (Pre_OP_feild_map_Resected_area.numpy() > 0) & The_brain
+    The_rest = The_brain & ~The_field
+
+    field_voxels = int(The_field.sum())
+    in_field = int((The_resected_looking & The_field).sum())
+
+    background_rate = (The_resected_looking & The_rest).sum() / max(1, int(The_rest.sum()))
+
+    return float(in_field - background_rate * field_voxels), in_field / max(1, field_voxels), field_voxels
+
+# ========================================
+### Workers ---
+
+# Loaded once in the main process, with fork the workers share them, otherwise each worker loads its own copy
+Shared_cavity_inputs = None
+Shared_hypothesis_inputs = None
+Shared_folder = None
+
+def Init_worker(Output_Folder, Folder, threads):
+
+    global Shared_cavity_inputs, Shared_hypothesis_inputs, Shared_folder
+
+    os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(threads)
+
+    from RAMP_cavity import Load_cavity_inputs
+
+    Shared_folder = Folder
+
+    if Shared_cavity_inputs is None:
+        Shared_cavity_inputs = Load_cavity_inputs(Output_Folder)
+        Shared_hypothesis_inputs = Load_hypothesis_inputs(Output_Folder)
+
+# Run the cavity stage for one candidate, the post-op feild maps are moved into the pre-op space for this candidate only
+def Run_candidate(Candidate):
+
+    from RAMP_cavity import Set_lobe_of_resection, Make_resection_mask
+
+    Hemisphere, Lobe = Candidate
+
+    Candidate_folder = os.path.join(Shared_folder, Hemisphere + "_" + Lobe)
+    if not os.path.exists(Candidate_folder):
+        os.makedirs(Candidate_folder)
+
+    start = time.time()
+
+    try:
+        The_field_maps = Make_candidate_field_maps(Shared_hypothesis_inputs, Hemisphere, Lobe)
+
+        for The_map, name in zip(The_field_maps, ["PreOP_feildResection", "PostOP_feildResection", "PreOP_NONE_feildResection", "PostOP_NONE_feildResection"]):
+            The_map.image_write(Candidate_folder + "/" + name + ".nii.gz", ri=True)
+
+        Cavity_inputs = Set_lobe_of_resection(dict(Shared_cavity_inputs), *The_field_maps)
+
+        The_final_mask = Make_resection_mask(Cavity_inputs, os.path.join(Candidate_folder, "reg_br"))
+    except Exception as e:
+        return Candidate, None, 0, time.time() - start, repr(e)
+
+    The_mask_path = Candidate_folder + "/RAMP_The_resection_mask_in_ORIG.nii.gz"
+    The_final_mask.image_write(The_mask_path, ri=True)
+
+    return Candidate, The_mask_path, int(The_final_mask.numpy().sum()), time.time() - start, ""
+
+# ========================================
+### Run ---
+
+# Score every candidate, run the cavity stage for the top ones and pick the best
+# Returns the row of Hypothesis_ranking.csv of the best candidate (None if no candidate gave a mask)
+def Run_hypotheses(Output_Folder, The_candidates, top=2, workers=1, threads=1, Subtraction_threshold=Default_subtraction_threshold):
+
+    global Shared_cavity_inputs, Shared_hypothesis_inputs
+
+    import pandas as pd
+    from RAMP_cavity import Load_cavity_inputs
+
+    Hypotheses_folder = os.path.join(Output_Folder, "S13_Hypotheses")
+    if not os.path.exists(Hypotheses_folder):
+        os.makedirs(Hypotheses_folder)
+
+    start = time.time()
+
+    Shared_cavity_inputs = Load_cavity_inputs(Output_Folder)
+    Shared_hypothesis_inputs = Load_hypothesis_inputs(Output_Folder)
+
+    The_resected_looking, The_brain = Resected_looking_voxels(Shared_cavity_inputs, Subtraction_threshold)
+
+    The_results = {}
+    for Hemisphere, Lobe in The_candidates:
+        The_field_maps = Make_candidate_field_maps(Shared_hypothesis_inputs, Hemisphere, Lobe)
+        score, fraction, field_voxels = Subtraction_score(The_resected_looking, The_brain, The_field_maps[0])
+        The_results[(Hemisphere, Lobe)] = dict(Candidate=Hemisphere + "_" + Lobe, Hemisphere=Hemisphere, Lobe=Lobe, Subtraction_score=score, Fraction_resected_looking=fraction, Field_voxels=field_voxels, Voxels=0, Time_SEC=0.0, Mask=None, Error="")
+        print("> " + Hemisphere + "_" + Lobe + " --> subtraction score " + str(round(score)) + " (" + str(round(100 * fraction, 1)) + "% of " + str(field_voxels) + " voxels)", flush=True)
+
+    print("> Scored " + str(len(The_candidates)) + " candidates in " + str(round(time.time() - start)) + " sec", flush=True)
+
+    The_ranking = sorted(The_candidates, key=lambda Candidate: -The_results[Candidate]["Subtraction_score"])
+    The_top = The_ranking[:max(1, top)]
+
+    print("> Running the cavity stage for --> " + ", ".join(Hemisphere + "_" + Lobe for Hemisphere, Lobe in The_top), flush=True)
+
+    # Fork lets every worker share the images loaded here, where fork is not available each worker loads them itself
+    if "fork" in multiprocessing.get_all_start_methods():
+        The_context = multiprocessing.get_context("fork")
+    else:
+        Shared_cavity_inputs = None
+        Shared_hypothesis_inputs = None
+        The_context = multiprocessing.get_context("spawn")
+
+    with The_context.Pool(min(workers, len(The_top)), initializer=Init_worker, initargs=(Output_Folder, Hypotheses_folder, threads)) as pool:
+
+        for Candidate, The_mask_path, voxels, recorded_time, error in pool.imap_unordered(Run_candidate, The_top):
+
+            The_results[Candidate].update(Voxels=voxels, Time_SEC=recorded_time, Mask=The_mask_path, Error=error)
+
+            if The_mask_path is None:
+                print("> " + "_".join(Candidate) + " failed --> " + error, flush=True)
+            else:
+                print("> " + "_".join(Candidate) + " done --> " + str(voxels) + " voxels in " + str(round(recorded_time)) + " sec", flush=True)
+
+    The_best = None
+    for Candidate in The_ranking:
+        if The_results[Candidate]["Mask"] is not None and The_results[Candidate]["Voxels"] > 0:
+            The_best = The_results[Candidate]
+            break
+
+    The_table = pd.DataFrame([The_results[Candidate] for Candidate in The_ranking])
+    The_table["Best"] = [The_best is not None and row == The_best["Candidate"] for row in The_table["Candidate"]]
+    The_table.to_csv(Hypotheses_folder + "/Hypothesis_ranking.csv", index=False)
+
+    if The_best is not None:
+        shutil.copyfile(The_best["Mask"], Hypotheses_folder + "/RAMP_The_resection_mask_in_ORIG.nii.gz")
+        print("> Best hypothesis --> " + The_best["Candidate"] + " (subtraction score " + str(round(The_best["Subtraction_score"])) + ", " + str(The_best["Voxels"]) + " voxels)", flush=True)
+
+    return The_best
+
+if __name__ == "__main__":
+
+    RAMPS_arguments = parser.parse_args()
+
+    Output_Folder = RAMPS_arguments.Output_Folder
+
+    if not os.path.isdir(os.path.join(Output_Folder, "S9_Registration", "reg_br")):
+        print("Error - No registration found in : " + Output_Folder + " (run RAMP.py first)")
+        sys.exit(1)
+
+    try:
+        The_candidates = Make_candidates(RAMPS_arguments.hemisphere, RAMPS_arguments.lobes)
+    except ValueError as e:
+        print("Error - " + str(e))
+        sys.exit(1)
+
+    # ITK reads its thread count the first time it is used, so this has to be set before ants is imported
+    os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(RAMPS_arguments.threads)
+
+    print("> RAMPS hypotheses --> " + str(len(The_candidates)) + " candidates, the cavity stage for the best " + str(RAMPS_arguments.top))
+
+    The_best = Run_hypotheses(Output_Folder, The_candidates, RAMPS_arguments.top, RAMPS_arguments.workers, RAMPS_arguments.threads, RAMPS_arguments.subtraction_threshold)
+
+    if The_best is None:
+        print("Error - None of the candidates gave a resection mask")
+        sys.exit(1)
+
+    print("> RAMPS hypotheses completed --> " + os.path.join(Output_Folder, "S13_Hypotheses"))
@@ -0,0 +1,87 @@
+# ========================================
+# RAMPS - Reading the input images
+# Resection Automated Mask in Pre-operative Space
+#
+# Check_image_header checks an input from its NIfTI header alone (no voxels are read or decompressed), so a bad input
+# stops RAMPS in milliseconds instead of part way through the pipeline. Both .nii and .nii.gz inputs are accepted, an
+# uncompressed .nii is read by ants without the gzip step
+# An input can also be a folder holding one DICOM series (see RAMP_dicom.py), Read_input_image reads either
+# ========================================
+
+### Imports ---
+
+import os.path
+
+import nibabel as nib
+import numpy as np
+
+Image_extensions = (".nii.gz", ".nii")
+
+# ========================================
+### Header checks ---
+
+# Returns a short description of the image or raises ValueError with what is wrong with it
+def Check_image_header(image_file):
+
+    if os.path.isdir(image_file):
+        from RAMP_dicom import Check_dicom_series
+        return Check_dicom_series(image_file)
+
+    if not image_file.endswith(Image_extensions):
+        raise ValueError("Epected the image to end with .nii.gz or .nii (or to be a DICOM series folder) : " + image_file)
+
+    try:
+        The_image = nib.load(image_file)
+    except Exception as e:
+        raise ValueError("Not a readable NIfTI image : " + image_file + " (" + str(e) + ")")
+
+    The_header = The_image.header
+    shape = The_image.shape
+
+    # A 4D image is only fine if it is a single volume
+    if len(shape) == 4 and shape[3] == 1:
+        shape = shape[:3]
+
+    if len(shape) != 3:
+        raise ValueError("Expected a 3D image, " + image_file + " has the dimensions " + str(The_image.shape))
+
+    if min(shape) < 2:
+        raise ValueError("The image is too small " + str(shape) + " : " + image_file)
+
+    spacing = The_header.get_zooms()[:3]
+
+    if not all(np.isfinite(spacing)) or min(spacing) <= 0:
+        raise ValueError("The image has an invalid voxel size " + str(spacing) + " : " + image_file)
+
+    The_affine = The_image.affine
+
+    if not np.all(np.isfinite(The_affine)) or abs(np.linalg.det(The_affine[:3, :3])) < 1e-6:
+        raise ValueError("The image has an invalid orientation (affine) : " + image_file)
+
+    The_datatype = The_header.get_data_dtype()
+
+    if The_datatype.kind not in "iuf" or The_datatype.fields is not None:
+        raise ValueError("The image datatype " + str(The_datatype) + " is not a single channel of numbers : " + image_file)
+
+    # Uncompressed files can be checked to be complete without reading them
+    if image_file.endswith(".nii"):
+        expected_size = int(The_header.get_data_offset()) + int(np.prod(The_image.shape)) * The_datatype.itemsize
+        if os.path.getsize(image_file) < expected_size:
+            raise ValueError("The image file is shorter than its header says (truncated?) : " + image_file)
+
+    return str(tuple(int(size) for size in shape)) + " voxels of " + " x ".join(str(round(float(size), 3)) for size in spacing) + " mm, " + "".join(nib.aff2axcodes(The_affine)) + ", " + str(The_datatype)
+
+# ========================================
+### Reading ---
+
+# A NIfTI file or a DICOM series folder as an ants image
+def Read_input_image(image_file):
+
+    # Imported here so the header checks can be used without loading ants
+    if os.path.isdir(image_file):
+        from RAMP_dicom import Read_dicom_series
+        return Read_dicom_series(image_file)
+
+    import ants
+
+    return ants.image_read(image_file)
@@ -0,0 +1,219 @@
+# ========================================
+# RAMPS - N4 bias correction
+# Resection Automated Mask in Pre-operative Space
+#
+# Section 2 of the preparation stage N4 bias corrects both fake orig images (the whole head, no brain mask exists yet)
+# - N4_presets : the settings of each preset, default is what RAMPS has always run (the ANTsPy defaults)
+# - Make_n4_settings : a preset with any of its settings changed
+# - Case_n4_settings : the same with the N4_* columns of a manifest row / keys of a job on top
+# - Run_n4 : N4 bias correct an image with the settings
+#
+# The settings
+# - shrink_factor : N4 fits the bias on the image shrunk by this much, the biggest effect on run time
+# - iterations : the convergence schedule, the maximum number of iterations at each fitting level
+# - tolerance : the convergence threshold of each level
+# - spline_distance : the distance (mm) between B-spline control points, None is a single B-spline mesh element across the image
+# - mask : None (the whole image) or head (a quick intensity mask of the head, so the air does not take part in the fit)
+#
+# Benchmark - runs every preset on a phantom on the bundled fake orig grid (fakesurfer_orig.nii.gz, 256 x 256 x 256 1mm)
+# with a known bias field, and reports the run time and how well the bias was removed
+#
+#   python RAMP_n4.py --presets fast,default,thorough --threads 1
+# ========================================
+
+### Imports ---
+
+import argparse
+import os
+import os.path
+import sys
+import time
+
+N4_presets = {
+    "fast": {"shrink_factor": 6, "iterations": [50, 50, 30], "tolerance": 1e-6, "spline_distance": None, "mask": "head"},
+    "default": {"shrink_factor": 4, "iterations": [50, 50, 50, 50], "tolerance": 1e-7, "spline_distance": None, "mask": None},
+    "thorough": {"shrink_factor": 2, "iterations": [50, 50, 50, 50], "tolerance": 1e-7, "spline_distance": 200, "mask": "head"},
+}
+
+# ========================================
+### Settings ---
+
+# e.g. Make_n4_settings("fast", iterations="20x20x10") , iterations can be a list or a string like 50x50x30
+def Make_n4_settings(Preset="default", **Changes):
+
+    if Preset not in N4_presets:
+        raise ValueError("Unknown N4 preset " + str(Preset) + ", must be one of " + ", ".join(N4_presets))
+
+    N4_settings = dict(N4_presets[Preset])
+
+    for name, value in Changes.items():
+        if value is None:
+            continue
+        if name not in N4_settings:
+            raise ValueError("Unknown N4 setting " + name)
+        if name == "iterations" and isinstance(value, str):
+            try:
+                value = [int(iters) for iters in value.lower().split("x")]
+            except ValueError:
+                raise ValueError("The N4 iterations must be like 50x50x30, not " + value)
+        if name == "mask" and str(value).lower() == "none":
+            value = None
+        N4_settings[name] = value
+
+    if N4_settings["mask"] not in [None, "head"]:
+        raise ValueError("The N4 mask must be none or head")
+    if int(N4_settings["shrink_factor"]) < 1 or not N4_settings["iterations"]:
+        raise ValueError("The N4 shrink factor must be at least 1 and there must be at least one level of iterations")
+
+    return N4_settings
+
+# The manifest columns (RAMP_scheduler.py) and job keys (RAMP_service.py) that change the N4 settings of one case
+N4_case_columns = {"N4_preset": None, "N4_shrink": "shrink_factor", "N4_iterations": "iterations", "N4_spline_distance": "spline_distance", "N4_mask": "mask"}
+
+# The N4 settings of a case, its own N4_* values on top of the preset and changes given (those of the command line),
+# missing or empty values (an empty manifest cell is NaN) keep them
+def Case_n4_settings(Case, Preset="default", **Changes):
+
+    Changes = dict(Changes)
+
+    for column, name in N4_case_columns.items():
+        value = Case.get(column)
+        if value is None or str(value).strip().lower() in ["", "nan"]:
+            continue
+        value = str(value).strip()
+        try:
+            if name is None:
+                Preset = value
+            elif name == "shrink_factor":
+                Changes[name] = int(value)
+            elif name == "spline_distance":
+                Changes[name] = float(value)
+            else:
+                Changes[name] = value
+        except ValueError:
+            raise ValueError(column + " must be a number, not " + value)
+
+    return Make_n4_settings(Preset, **Changes)
+
+def Describe_n4_settings(N4_settings):
+
+    return "shrink " + str(N4_settings["shrink_factor"]) + ", iterations " + "x".join(str(iters) for iters in N4_settings["iterations"]) + ", spline distance " + str(N4_settings["spline_distance"]) + ", mask " + str(N4_settings["mask"])
+
+# ========================================
+### N4 ---
+
+def Run_n4(image, N4_settings=None):
+
+    import ants
+
+    if N4_settings is None:
+        N4_settings = N4_presets["default"]
+
+    mask = None
+    if N4_settings["mask"] == "head":
+        mask = ants.get_mask(image, cleanup=0)
+        mask = ants.iMath(mask, "FillHoles")
+
+    # With mask None ANTsPy uses the whole image, the same as the original call
+    return ants.n4_bias_field_correction(image, mask=mask, shrink_factor=int(N4_settings["shrink_factor"]), convergence={"iters": list(N4_settings["iterations"]), "tol": N4_settings["tolerance"]}, spline_param=N4_settings["spline_distance"])
+
+# ========================================
+### Benchmark ---
+
+# A head on the fake orig grid: skull, csf, grey matter and white matter shells with noise, times a smooth bias field
+# (a product of low order cosines, about +-20%). Returns the phantom, the bias field, the tissue labels (0 air, 1 skull,
+# 2 csf, 3 grey, 4 white)
+def Make_phantom(Grid_file, seed=0):
+
+    import ants
+    import numpy as np
+
+    The_grid = ants.image_read(Grid_file)
+    shape = The_grid.shape
+
+    i, j, k = np.meshgrid(*[np.linspace(-1, 1, size, dtype=np.float32) for size in shape], indexing="ij")
+    radius = np.sqrt((i / 0.75) ** 2 + (j / 0.85) ** 2 + (k / 0.7) ** 2)
+
+    The_labels = np.zeros(shape, dtype=np.uint8)
+    The_labels[radius < 1.0] = 1
+    The_labels[radius < 0.92] = 2
+    The_labels[radius < 0.88] = 3
+    The_labels[radius < 0.75] = 4
+
+    The_intensities = np.array([0, 60, 30, 90, 130], dtype=np.float32)
+    The_head = The_intensities[The_labels]
+
+    The_bias = (1 + 0.12 * np.cos(np.pi * (i + 0.3) / 2)) * (1 + 0.1 * np.cos(np.pi * (j - 0.2))) * (1 + 0.08 * np.sin(np.pi * k / 2))
+    The_bias = (The_bias / The_bias[The_labels > 0].mean()).astype(np.float32)
+
+    The_noise = np.random.default_rng(seed).normal(0, 3, shape).astype(np.float32)
+
+    The_phantom = np.clip(The_head * The_bias + The_noise, 0, None)
+
+    return The_grid.new_image_like(The_phantom), The_bias, The_labels
+
+# How much bias is left inside the head: the coefficient of variation of the white matter, and the correlation of the
+# removed field (input / corrected) with the true bias field
+def Score_n4(The_phantom, The_corrected, The_bias, The_labels):
+
+    import numpy as np
+
+    The_head = The_labels > 1
+    The_white = The_labels == 4
+
+    corrected = The_corrected.numpy()
+    The_removed = The_phantom.numpy()[The_head] / np.maximum(corrected[The_head], 1e-6)
+
+    return {
+        "White_CV": float(np.std(corrected[The_white]) / np.mean(corrected[The_white])),
+        "Bias_correlation": float(np.corrcoef(np.log(np.maximum(The_removed, 1e-6)), np.log(The_bias[The_head]))[0, 1]),
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="RAMP_n4.py", description="Benchmark the N4 presets on a phantom with a known bias field")
+    parser.add_argument("--presets", default=",".join(N4_presets), help="comma separated presets to run (default " + ",".join(N4_presets) + ")")
+    parser.add_argument("--grid", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakesurfer_orig.nii.gz"), help="the image grid of the phantom (default the bundled fake orig)")
+    parser.add_argument("--repeats", type=int, default=1, help="number of times each preset is run, the fastest time is kept")
+    parser.add_argument("--threads", type=int, default=None, help="ITK threads")
+    parser.add_argument("--output", default=None, help="also write the results to this csv")
+    RAMPS_arguments = parser.parse_args()
+
+    # ITK reads its thread count the first time it is used, so this has to be set before ants is imported
+    if RAMPS_arguments.threads is not None:
+        os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(RAMPS_arguments.threads)
+
+    import pandas as pd
+
+    The_presets = [Preset.strip() for Preset in RAMPS_arguments.presets.split(",") if Preset.strip()]
+    for Preset in The_presets:
+        if Preset not in N4_presets:
+            print("Error - Unknown N4 preset " + Preset + ", must be one of " + ", ".join(N4_presets))
+            sys.exit(1)
+
+    The_phantom, The_bias, The_labels = Make_phantom(RAMPS_arguments.grid)
+    print("> Phantom --> " + str(The_phantom.shape) + ", white matter CV before N4 " + str(round(float(The_phantom.numpy()[The_labels == 4].std() / The_phantom.numpy()[The_labels == 4].mean()), 4)))
+
+    The_results = []
+    for Preset in The_presets:
+
+        N4_settings = Make_n4_settings(Preset)
+        The_times = []
+
+        for repeat in range(max(1, RAMPS_arguments.repeats)):
+            start = time.time()
+            The_corrected = Run_n4(The_phantom, N4_settings)
+            The_times.append(time.time() - start)
+
+        The_row = dict(Preset=Preset, Settings=Describe_n4_settings(N4_settings), Time_SEC=min(The_times))
+        The_row.update(Score_n4(The_phantom, The_corrected, The_bias, The_labels))
+        The_results.append(The_row)
+
+        print("> " + Preset + " --> " + str(round(The_row["Time_SEC"], 1)) + " sec, white matter CV " + str(round(The_row["White_CV"], 4)) + ", bias correlation " + str(round(The_row["Bias_correlation"], 3)), flush=True)
+
+    The_table = pd.DataFrame(The_results)
+    print("")
+    print(The_table.to_string(index=False))
+
+    if RAMPS_arguments.output is not None:
+        The_table.to_csv(RAMPS_arguments.output, index=False)
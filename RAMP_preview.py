@@ -0,0 +1,121 @@
+# ========================================
+# RAMPS - Preview
+# Resection Automated Mask in Pre-operative Space
+#
+# A quick provisional mask for triage, before the full run has finished. RAMP.py --preview first runs all three stages
+# on a 2 mm version of the fake orig grid, into <Output_Folder>/RAMPS_Preview (a RAMPS output folder of its own), and
+# writes the preview mask next to the final outputs
+# - RAMPS_Resection_Mask_Output/RAMP_The_preview_mask_in_ORIG.nii.gz (on the 1 mm fake orig grid)
+# - RAMPS_Resection_Mask_Output/RAMP_The_preview_mask_in_PRE.nii.gz (on the pre-op grid)
+# With --preview_only it stops there, otherwise the 1 mm run carries on and refines it
+# - the 1 mm registration starts from the rigid transform of the preview registration, only the b-spline SyN is run
+# - the resection is only looked for inside the preview mask dilated by --preview_margin mm (see Restrict_to_roi in
+#   RAMP_cavity.py), unless the preview mask is empty
+#
+# At 2 mm N4, SynthStrip, the registration and the cavity stage have an eighth of the voxels. SynthSeg segments at 1 mm
+# whatever the grid, it is run with --fast and its segmentations are put back onto the 2 mm grid
+# The cavity parameters count voxels, so the ones that are volumes or distances are scaled to 2 mm (Preview_cavity_parameters)
+# ========================================
+
+### Imports ---
+
+import os
+import os.path
+import shutil
+import time
+
+from RAMP_events import Emit_event
+
+Preview_spacing = 2.0
+Preview_margin = 10.0
+
+# Voxel counts are 1/8 and distances 1/2 of those of Default_cavity_parameters in RAMP_cavity.py
+Preview_cavity_parameters = {"loop_stop": 12, "min_cluster_size": 4, "boundary_distance": 2}
+
+# ========================================
+### Preview ---
+
+def Preview_folder(Output_Folder):
+
+    return os.path.join(Output_Folder, "RAMPS_Preview")
+
+# The fake orig grid at spacing mm, covering the same space
+def Make_preview_grid(Grid_file, spacing=Preview_spacing):
+
+    import ants
+
+    return ants.resample_image(ants.image_read(Grid_file), [spacing] * 3, use_voxels=False, interp_type=0)
+
+# Run the three stages at Preview_spacing mm into <Output_Folder>/RAMPS_Preview
+# Returns the preview mask on the 1 mm fake orig grid and the time keeping (with a Preview section)
+def Run_preview(PreOP_Data_image, PostOP_Data_image, Output_Folder, Hemisphere, Lobe, Time_keeping=None, Threads=None, N4_settings=None, Candidates=None, spacing=Preview_spacing):
+
+    import ants
+    from RAMP_stages import blank_orig_file, New_time_keeping, Add_section_time, Save_time_keeping, Run_preparation, Run_registration, Run_cavity
+
+    start = time.time()
+    Emit_event("stage_start", stage="preview", output_folder=Output_Folder)
+
+    if Time_keeping is None:
+        Time_keeping = New_time_keeping()
+
+    Folder = Preview_folder(Output_Folder)
+    if not os.path.exists(Folder):
+        os.makedirs(Folder)
+
+    print("> Preview at " + str(spacing) + " mm --> " + Folder)
+
+    # The preview keeps its own time keeping, in its own folder
+    Preview_time_keeping = New_time_keeping()
+
+    PreOP_image, PostOP_image, Region_atlases, Preview_time_keeping = Run_preparation(PreOP_Data_image, PostOP_Data_image, Folder, Hemisphere, Lobe, Preview_time_keeping, Threads=Threads, N4_settings=N4_settings, Orig_grid=Make_preview_grid(blank_orig_file, spacing), Synthseg_fast=True)
+    Preview_time_keeping = Run_registration(Folder, Preview_time_keeping)
+    Preview_time_keeping = Run_cavity(Folder, PreOP_image, Preview_time_keeping, Candidates=Candidates, PostOP_N4bias_image=PostOP_image, Cavity_parameters=Preview_cavity_parameters, Region_atlases=Region_atlases)
+
+    Save_time_keeping(Folder, Preview_time_keeping)
+
+    The_resection_mask_Final=os.path.join(Output_Folder, "RAMPS_Resection_Mask_Output")
+    if not os.path.exists(The_resection_mask_Final):
+        os.makedirs(The_resection_mask_Final)
+
+    # The same grid change as the final outputs (see Run_cavity), multiLabel for a mask
+    The_preview_mask = ants.image_read(os.path.join(Folder, "RAMPS_Resection_Mask_Output", "RAMP_The_resection_mask_in_ORIG.nii.gz"))
+    The_preview_mask = ants.resample_image_to_target(The_preview_mask, ants.image_read(blank_orig_file), interp_type='multiLabel')
+    The_preview_mask.image_write(The_resection_mask_Final+"/RAMP_The_preview_mask_in_ORIG.nii.gz",ri=True)
+
+    shutil.copyfile(os.path.join(Folder, "RAMPS_Resection_Mask_Output", "RAMP_The_resection_mask_in_PRE.nii.gz"), The_resection_mask_Final+"/RAMP_The_preview_mask_in_PRE.nii.gz")
+
+    recorded_time = time.time() - start
+    voxels = int((The_preview_mask.numpy() > 0).sum())
+
+    Time_keeping = Add_section_time(Time_keeping, 'Preview', recorded_time)
+
+    print("> Preview mask --> " + str(voxels) + " voxels in " + str(round(recorded_time)) + " sec --> " + The_resection_mask_Final+"/RAMP_The_preview_mask_in_PRE.nii.gz", flush=True)
+    Emit_event("stage_end", stage="preview", output_folder=Output_Folder, seconds=round(recorded_time, 3), voxels=voxels, mask=The_resection_mask_Final+"/RAMP_The_preview_mask_in_PRE.nii.gz")
+
+    return The_preview_mask, Time_keeping
+
+# ========================================
+### Refinement ---
+
+# The preview mask dilated by margin mm, where the 1 mm run looks for the resection, None if the preview found nothing
+def Preview_roi(The_preview_mask, margin=Preview_margin):
+
+    import ants
+    import numpy as np
+
+    if not (The_preview_mask.numpy() > 0).any():
+        return None
+
+    radius = int(np.ceil(margin / min(The_preview_mask.spacing)))
+
+    return ants.morphology(ants.get_mask(The_preview_mask, low_thresh=1, cleanup=0), operation='dilate', radius=radius, mtype='binary')
+
+# The rigid transform of the preview registration, to start the 1 mm registration from
+def Preview_initial_transform(Output_Folder):
+
+    from RAMP_strategies import Registration_folder
+
+    The_transform = os.path.join(Registration_folder(Preview_folder(Output_Folder)), "br_0GenericAffine.mat")
+
+    return The_transform if os.path.isfile(The_transform) else None
@@ -0,0 +1,131 @@
+# ========================================
+# RAMPS - Stage profiling
+# Resection Automated Mask in Pre-operative Space
+#
+# RAMP.py --profile (and RAMP_scheduler.py --profile) runs each stage under cProfile and writes into
+# <Output_Folder>/RAMPS_Profile
+# - <stage>.pstats : the profile, e.g. python -m pstats <stage>.pstats or snakeviz
+# - <stage>_top.txt : the 40 functions with the most time of their own and the 40 with the most cumulative time
+# - <stage>.collapsed.txt : collapsed stacks ("a;b;c <microseconds>" per line) for flamegraph.pl, speedscope or inferno
+#
+# cProfile only keeps who called who, not the full stacks, so the collapsed stacks are built from the call graph by
+# sharing the time of each function between its callers in proportion to the time each call took (as gprof does). The
+# time in ITK shows up as the own time of the ANTsPy function that called it (e.g. apply_transforms.py:apply_transforms,
+# atropos.py:atropos), gzip writes as <method 'compress' of 'zlib.Compress' objects> and SynthStrip / SynthSeg (run as
+# their own processes, see RAMP_tools.py) as the wait of subprocess.Popen
+#
+# Without --profile Profile_stage is a null context, nothing is profiled
+# ========================================
+
+### Imports ---
+
+import os
+import os.path
+from contextlib import contextmanager, nullcontext
+
+# Calls that took less than this (seconds) are left out of the collapsed stacks
+Collapsed_min_seconds = 1e-4
+Collapsed_max_depth = 64
+
+# ========================================
+### Profiling ---
+
+def Profile_stage(Output_Folder, stage, enabled=False):
+
+    if not enabled:
+        return nullcontext()
+
+    return Profiled(Output_Folder, stage)
+
+@contextmanager
+def Profiled(Output_Folder, stage):
+
+    import cProfile
+
+    The_profile = cProfile.Profile()
+    The_profile.enable()
+
+    try:
+        yield The_profile
+    finally:
+        The_profile.disable()
+        Write_profile(The_profile, Output_Folder, stage)
+
+def Write_profile(The_profile, Output_Folder, stage):
+
+    import pstats
+
+    Profile_folder = os.path.join(Output_Folder, "RAMPS_Profile")
+    if not os.path.exists(Profile_folder):
+        os.makedirs(Profile_folder)
+
+    The_profile.dump_stats(os.path.join(Profile_folder, stage + ".pstats"))
+
+    with open(os.path.join(Profile_folder, stage + "_top.txt"), "w") as top:
+        The_stats = pstats.Stats(The_profile, stream=top)
+        The_stats.sort_stats("tottime").print_stats(40)
+        The_stats.sort_stats("cumulative").print_stats(40)
+
+    Write_collapsed_stacks(The_stats, os.path.join(Profile_folder, stage + ".collapsed.txt"))
+
+    print("> Profile of the " + stage + " stage --> " + os.path.join(Profile_folder, stage + ".pstats"))
+
+# ========================================
+### Collapsed stacks ---
+
+def Function_name(func):
+
+    filename, line, name = func
+
+    if filename == "~":
+        # Built-in, the name is already e.g. <built-in method posix.system>
+        return name.replace(";", ",")
+
+    return (os.path.basename(filename) + ":" + name).replace(";", ",")
+
+def Write_collapsed_stacks(The_stats, collapsed_file):
+
+    # func -> (primitive calls, calls, own time, cumulative time, {caller: (calls, primitive calls, own time, cumulative time)})
+    The_functions = The_stats.stats
+
+    The_callees = {}
+    for func, (_, _, _, _, The_callers) in The_functions.items():
+        for caller, caller_stats in The_callers.items():
+            The_callees.setdefault(caller, []).append((func, caller_stats[3]))
+
+    The_stacks = {}
+
+    # share is the fraction of func's time that was spent under this path
+    def Walk(func, The_path, The_on_path, share):
+
+        own_time = The_functions[func][2]
+
+        The_path = The_path + [Function_name(func)]
+        stack = ";".join(The_path)
+        The_stacks[stack] = The_stacks.get(stack, 0.0) + own_time * share
+
+        if len(The_path) >= Collapsed_max_depth:
+            return
+
+        for callee, call_time in The_callees.get(func, []):
+
+            callee_time = The_functions[callee][3]
+            if callee in The_on_path or callee_time <= 0:
+                continue
+
+            callee_share = share * call_time / callee_time
+            if callee_share * callee_time < Collapsed_min_seconds:
+                continue
+
+            Walk(callee, The_path, The_on_path | {callee}, callee_share)
+
+    for func, (_, _, _, _, The_callers) in The_functions.items():
+        # The roots, called from outside the profile
+        if not The_callers:
+            Walk(func, [], {func}, 1.0)
+
+    with open(collapsed_file, "w") as collapsed:
+        for stack, seconds in sorted(The_stacks.items()):
+            microseconds = int(round(seconds * 1e6))
+            if microseconds > 0:
+                collapsed.write(stack + " " + str(microseconds) + "\n")
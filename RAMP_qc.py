@@ -0,0 +1,148 @@
+# ========================================
+# RAMPS - Registration quality check
+# Resection Automated Mask in Pre-operative Space
+#
+# A badly aligned post-op image (S9_Registration/reg_br/warpedmovout.nii.gz, or that of the registration strategy that
+# was chosen, see RAMP_strategies.py) makes the step 9 Atropos and the step 12
+# loop run long and give a mask that is no use, so the registration is checked as soon as it is done, before the cavity
+# stage. Three measures, all in the pre-op orig space
+# - correlation : of the pre-op and the registered post-op image over the lobes that were not resected (the S6
+#   PreOP_NONE_feildResection map), where the two scans should look the same
+# - ventricle_dice : the Dice overlap of the pre-op ventricles and the post-op ventricles moved into the pre-op (S7)
+# - jacobian_min / jacobian_max : the extremes of the Jacobian determinant of br_1Warp.nii.gz inside the brain, below 0
+#   the warp has folded, very large values are a warp that has run away
+# The check takes a few seconds and is written to S9_Registration/Registration_QC.json (one entry per attempt)
+#
+# What RAMP.py --registration_qc does when a check fails (Registration_qc_modes)
+# - off : no check
+# - warn : report it and carry on (the default)
+# - fail : stop before the cavity stage (RuntimeError)
+# - retry : register the chosen strategy once more with Retry_transform (rigid + affine + SyN, the same masks) into
+#   <strategy>_retry, which is then the registration that is used (see RAMP_strategies.py), stop if that fails too
+# ========================================
+
+### Imports ---
+
+import json
+import os
+import os.path
+import time
+
+from RAMP_events import Emit_event
+from RAMP_strategies import Registration_folder, Strategy_transforms
+
+Registration_qc_modes = ["off", "warn", "fail", "retry"]
+
+Registration_qc_thresholds = {
+    "min_correlation": 0.75,
+    "min_ventricle_dice": 0.5,
+    "min_jacobian": 0.0,
+    "max_jacobian": 10.0,
+}
+
+Retry_transform = Strategy_transforms["retry"][0]
+
+# ========================================
+### Measures ---
+
+def Correlation(The_fixed, The_moving, The_mask):
+
+    import numpy as np
+
+    fixed = The_fixed[The_mask].astype(np.float64)
+    moving = The_moving[The_mask].astype(np.float64)
+
+    if fixed.size < 2 or fixed.std() == 0 or moving.std() == 0:
+        return 0.0
+
+    return float(np.corrcoef(fixed, moving)[0, 1])
+
+def Dice(The_a, The_b):
+
+    total = int(The_a.sum()) + int(The_b.sum())
+
+    if total == 0:
+        return 1.0
+
+    return 2.0 * int((The_a & The_b).sum()) / total
+
+# ========================================
+### Check ---
+
+# Check the registration in <Output_Folder>/S9_Registration/reg_br (or the chosen strategy), returns the measures with "passed" and the "failed" reasons
+def Check_registration(Output_Folder, Thresholds=None, attempt=1):
+
+    import ants
+
+    start = time.time()
+
+    The_thresholds = dict(Registration_qc_thresholds)
+    if Thresholds is not None:
+        The_thresholds.update(Thresholds)
+
+    RemoveHyper=os.path.join(Output_Folder, "S8_RemoveHyper")
+    Lobe_of_resection=os.path.join(Output_Folder, "S6_Lobe_of_resection")
+    Get_ventricles=os.path.join(Output_Folder, "S7_Get_ventricles")
+    Do_Registration=os.path.join(Output_Folder, "S9_Registration")
+    reg_br=Registration_folder(Output_Folder)
+
+    PreOP_RemoveHyper = ants.image_read(RemoveHyper+"/Pre_Final_skullstriped_image_Manual_remove_hyper.nii.gz")
+    The_pre = PreOP_RemoveHyper.numpy()
+    The_post = ants.image_read(reg_br+"/warpedmovout.nii.gz").numpy()
+
+    The_brain = (The_pre > 0) & (The_post > 0)
+
+    # The lobes that were not resected, the whole brain if there is no S6 map (e.g. an auto hemisphere / lobe run)
+    The_none_resected_file = Lobe_of_resection+"/PreOP_NONE_feildResection.nii.gz"
+    if os.path.isfile(The_none_resected_file):
+        The_region = The_brain & (ants.image_read(The_none_resected_file).numpy() > 0)
+    else:
+        The_region = The_brain
+
+    # Which transform set was checked
+    The_qc = {"attempt": attempt, "folder": os.path.basename(reg_br)}
+    The_qc["correlation"] = Correlation(The_pre, The_post, The_region)
+
+    # genericLabel rather than the multiLabel of the cavity stage, a binary mask does not need its smoothing and it is much faster
+    PostOP_ventricles_moving = ants.apply_transforms(fixed=PreOP_RemoveHyper, moving=ants.image_read(Get_ventricles+"/PostOP_ventricles.nii.gz"), transformlist=[reg_br+"/br_1Warp.nii.gz", reg_br+"/br_0GenericAffine.mat"], interpolator='genericLabel')
+    The_qc["ventricle_dice"] = Dice(ants.image_read(Get_ventricles+"/PreOP_ventricles.nii.gz").numpy() > 0, PostOP_ventricles_moving.numpy() > 0)
+
+    The_jacobian = ants.create_jacobian_determinant_image(PreOP_RemoveHyper, reg_br+"/br_1Warp.nii.gz").numpy()[The_pre > 0]
+    The_qc["jacobian_min"] = float(The_jacobian.min()) if The_jacobian.size else 1.0
+    The_qc["jacobian_max"] = float(The_jacobian.max()) if The_jacobian.size else 1.0
+    The_qc["folded_voxels"] = int((The_jacobian <= 0).sum())
+
+    The_failed = []
+    if The_qc["correlation"] < The_thresholds["min_correlation"]:
+        The_failed.append("correlation " + str(round(The_qc["correlation"], 3)) + " < " + str(The_thresholds["min_correlation"]))
+    if The_qc["ventricle_dice"] < The_thresholds["min_ventricle_dice"]:
+        The_failed.append("ventricle dice " + str(round(The_qc["ventricle_dice"], 3)) + " < " + str(The_thresholds["min_ventricle_dice"]))
+    if The_qc["jacobian_min"] <= The_thresholds["min_jacobian"]:
+        The_failed.append("jacobian min " + str(round(The_qc["jacobian_min"], 3)) + " <= " + str(The_thresholds["min_jacobian"]))
+    if The_qc["jacobian_max"] > The_thresholds["max_jacobian"]:
+        The_failed.append("jacobian max " + str(round(The_qc["jacobian_max"], 3)) + " > " + str(The_thresholds["max_jacobian"]))
+
+    The_qc["passed"] = not The_failed
+    The_qc["failed"] = The_failed
+    The_qc["thresholds"] = The_thresholds
+    The_qc["seconds"] = round(time.time() - start, 3)
+
+    Write_registration_qc(Do_Registration, The_qc)
+
+    print("> Registration check " + ("passed" if The_qc["passed"] else "FAILED (" + ", ".join(The_failed) + ")") + " --> correlation " + str(round(The_qc["correlation"], 3)) + ", ventricle dice " + str(round(The_qc["ventricle_dice"], 3)) + ", jacobian " + str(round(The_qc["jacobian_min"], 3)) + " to " + str(round(The_qc["jacobian_max"], 3)) + " in " + str(round(The_qc["seconds"], 1)) + " sec", flush=True)
+    Emit_event("registration_qc", output_folder=Output_Folder, attempt=attempt, passed=The_qc["passed"], correlation=round(The_qc["correlation"], 4), ventricle_dice=round(The_qc["ventricle_dice"], 4), jacobian_min=round(The_qc["jacobian_min"], 4), jacobian_max=round(The_qc["jacobian_max"], 4), failed=The_failed)
+
+    return The_qc
+
+# Registration_QC.json keeps every attempt of the last run, a first attempt starts it again
+def Write_registration_qc(Do_Registration, The_qc):
+
+    The_qc_file = os.path.join(Do_Registration, "Registration_QC.json")
+
+    The_attempts = []
+    if The_qc["attempt"] > 1 and os.path.isfile(The_qc_file):
+        with open(The_qc_file) as f:
+            The_attempts = json.load(f)
+
+    with open(The_qc_file, "w") as f:
+        json.dump(The_attempts + [The_qc], f, indent=1)
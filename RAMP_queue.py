@@ -0,0 +1,375 @@
+# ========================================
+# RAMPS - Shared folder work queue
+# Resection Automated Mask in Pre-operative Space
+#
+# Lets any number of RAMPS workers, on any number of machines that share a folder (e.g. NFS), work through the same
+# manifest of cases without a cluster scheduler. Start the same command on every node:
+#
+#   python RAMP_queue.py <Manifest.csv> <Queue_folder> --workers 2
+#
+# The manifest is a csv with the columns ID, PreOP, PostOP, Output_Folder, Hemisphere, Lobe (the RAMP.py inputs)
+#
+# How it works (everything is a file in the queue folder)
+# - claims/<ID>.claim : a worker owns the case, created with O_EXCL so only one worker can claim it
+#                        the owner touches it every --heartbeat seconds while the case runs
+# - if a claim has not been touched for --stale_after seconds its node is assumed dead, the claim is broken and the case
+#   goes back into the queue
+# - attempts/<ID>.<n> : one file per attempt, a case that has failed --max_attempts times is not tried again
+# - done/<ID>.done, failed/<ID>.failed : finished cases
+# - logs/<ID>.attempt_<n>.log : the output of each attempt
+#
+# Times are compared against the shared folder's clock (the mtime of a file we touch), not the local one, so nodes with
+# different clocks agree on when a claim is stale
+# ========================================
+
+### Imports ---
+
+import argparse
+import multiprocessing
+import os
+import os.path
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pandas as pd
+
+# Get the location of this script is, to keep all this code in the same place
+Location_of_script = os.path.dirname(os.path.abspath(__file__))
+
+Default_command = "{python} " + os.path.join(Location_of_script, "RAMP.py") + " {PreOP} {PostOP} {Output_Folder} {ID} {Hemisphere} {Lobe}"
+
+# ========================================
+### Inputs ---
+
+parser = argparse.ArgumentParser(prog="RAMP_queue.py", description="Work through a manifest of RAMPS cases from a folder shared between machines")
+parser.add_argument("Manifest", help="csv with the columns ID, PreOP, PostOP, Output_Folder, Hemisphere, Lobe")
+parser.add_argument("Queue_folder", help="shared folder that holds the queue state")
+parser.add_argument("--workers", type=int, default=1, help="number of workers to start on this machine")
+parser.add_argument("--heartbeat", type=float, default=30, help="seconds between heartbeats while a case is running")
+parser.add_argument("--stale_after", type=float, default=600, help="seconds without a heartbeat before a claim is taken back")
+parser.add_argument("--max_attempts", type=int, default=3, help="attempts per case before it is marked failed")
+parser.add_argument("--poll", type=float, default=10, help="seconds to wait when every remaining case is claimed")
+parser.add_argument("--command", default=Default_command, help="command run for each case, {column} is replaced with the manifest value, {python} with this python")
+parser.add_argument("--status", action="store_true", help="print the state of every case and exit")
+
+# ========================================
+### Queue ---
+
+class RAMPS_queue:
+
+    def __init__(self, Queue_folder, stale_after=600):
+
+        self.Queue_folder = Queue_folder
+        self.stale_after = stale_after
+
+        self.owner = socket.gethostname() + "." + str(os.getpid())
+
+        for folder in ["claims", "attempts", "done", "failed", "logs", "clock"]:
+            os.makedirs(os.path.join(Queue_folder, folder), exist_ok=True)
+
+    def Path(self, folder, name):
+
+        return os.path.join(self.Queue_folder, folder, name)
+
+    # The time on the shared folder (the mtime of a file we have just touched)
+    def Now(self):
+
+        clock = self.Path("clock", self.owner)
+        with open(clock, "a"):
+            os.utime(clock, None)
+        return os.stat(clock).st_mtime
+
+    # The clock file is only for this worker
+    def Close(self):
+
+        try:
+            os.remove(self.Path("clock", self.owner))
+        except FileNotFoundError:
+            pass
+
+    def Age(self, path):
+
+        try:
+            return self.Now() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    # Create a file only if it does not exist yet, the write is atomic on local disks and NFS
+    def Create(self, path, text=""):
+
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+
+        return True
+
+    def Read(self, path):
+
+        try:
+            with open(path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def Is_finished(self, ID):
+
+        return os.path.exists(self.Path("done", ID + ".done")) or os.path.exists(self.Path("failed", ID + ".failed"))
+
+    def Attempts(self, ID):
+
+        return len([name for name in os.listdir(os.path.join(self.Queue_folder, "attempts")) if name.rsplit(".", 1)[0] == ID])
+
+    # Take back a claim whose owner has stopped sending heartbeats
+    # Only one worker at a time can break a claim (the .break file) and the claim is checked again once we hold it
+    def Break_stale_claim(self, ID):
+
+        claim = self.Path("claims", ID + ".claim")
+        claim_break = claim + ".break"
+
+        if not self.Create(claim_break, self.owner):
+            # A worker that died while breaking a claim leaves this behind
+            age = self.Age(claim_break)
+            if age is not None and age > self.stale_after:
+                try:
+                    os.remove(claim_break)
+                except FileNotFoundError:
+                    pass
+            return False
+
+        try:
+            age = self.Age(claim)
+            if age is None or age <= self.stale_after:
+                return False
+
+            print("> " + self.owner + " taking back the stale claim on " + ID + " from " + str(self.Read(claim)) + " (no heartbeat for " + str(round(age)) + " sec)", flush=True)
+            os.remove(claim)
+            return True
+        finally:
+            os.remove(claim_break)
+
+    # Try to claim a case, returns the attempt number or None
+    def Claim(self, ID, max_attempts):
+
+        if self.Is_finished(ID):
+            return None
+
+        claim = self.Path("claims", ID + ".claim")
+
+        if not self.Create(claim, self.owner):
+            age = self.Age(claim)
+            if age is None or age <= self.stale_after:
+                return None
+            if not self.Break_stale_claim(ID) or not self.Create(claim, self.owner):
+                return None
+
+        # It may have finished between the check and the claim
+        if self.Is_finished(ID):
+            self.Release(ID)
+            return None
+
+        attempt = self.Attempts(ID) + 1
+
+        if attempt > max_attempts:
+            self.Create(self.Path("failed", ID + ".failed"), "failed " + str(max_attempts) + " attempts\n")
+            self.Release(ID)
+            return None
+
+        self.Create(self.Path("attempts", ID + "." + str(attempt)), self.owner)
+
+        return attempt
+
+    # Touch the claim, returns False if it is no longer ours
+    def Heartbeat(self, ID):
+
+        claim = self.Path("claims", ID + ".claim")
+
+        if self.Read(claim) != self.owner:
+            return False
+
+        os.utime(claim, None)
+
+        return True
+
+    def Release(self, ID):
+
+        claim = self.Path("claims", ID + ".claim")
+
+        if self.Read(claim) == self.owner:
+            os.remove(claim)
+
+    def Complete(self, ID, text=""):
+
+        self.Create(self.Path("done", ID + ".done"), text)
+        self.Release(ID)
+
+    def Status(self, IDs):
+
+        The_status = []
+
+        for ID in IDs:
+
+            if os.path.exists(self.Path("done", ID + ".done")):
+                state = "done"
+            elif os.path.exists(self.Path("failed", ID + ".failed")):
+                state = "failed"
+            elif os.path.exists(self.Path("claims", ID + ".claim")):
+                age = self.Age(self.Path("claims", ID + ".claim"))
+                state = "stale" if age is not None and age > self.stale_after else "running"
+            else:
+                state = "waiting"
+
+            The_status.append({"ID": ID, "State": state, "Attempts": self.Attempts(ID), "Owner": self.Read(self.Path("claims", ID + ".claim")) or ""})
+
+        return pd.DataFrame(The_status)
+
+# ========================================
+### Workers ---
+
+# Run one case, touching the claim while it runs. Returns True if the command finished without an error
+def Run_case(The_queue, Case, attempt, command, heartbeat):
+
+    ID = str(Case["ID"])
+
+    The_command = [token.format(python=sys.executable, **Case) for token in shlex.split(command)]
+
+    if "Output_Folder" in Case and not os.path.isdir(str(Case["Output_Folder"])):
+        os.makedirs(str(Case["Output_Folder"]), exist_ok=True)
+
+    The_log = The_queue.Path("logs", ID + ".attempt_" + str(attempt) + ".log")
+
+    with open(The_log, "w") as log:
+
+        log.write("> " + The_queue.owner + " attempt " + str(attempt) + " : " + " ".join(The_command) + "\n")
+        log.flush()
+
+        The_process = subprocess.Popen(The_command, stdout=log, stderr=subprocess.STDOUT)
+
+        while True:
+            try:
+                The_process.wait(timeout=heartbeat)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+
+            # Someone else has taken the case (we missed too many heartbeats), stop working on it
+            if not The_queue.Heartbeat(ID):
+                log.write("> The claim on this case was lost, stopping\n")
+                The_process.kill()
+                The_process.wait()
+                return False
+
+    return The_process.returncode == 0
+
+def Keep_claim(The_queue, ID, stop, heartbeat):
+
+    while not stop.wait(heartbeat):
+        The_queue.Heartbeat(ID)
+
+def Worker(Manifest, Queue_folder, arguments):
+
+    The_queue = RAMPS_queue(Queue_folder, arguments.stale_after)
+
+    The_cases = Manifest.to_dict("records")
+
+    try:
+        Work_through(The_queue, The_cases, arguments)
+    finally:
+        The_queue.Close()
+
+# Claim and run cases until every one of them is done or failed
+def Work_through(The_queue, The_cases, arguments):
+
+    while True:
+
+        if all(The_queue.Is_finished(str(Case["ID"])) for Case in The_cases):
+            break
+
+        ran_a_case = False
+
+        for Case in The_cases:
+
+            ID = str(Case["ID"])
+
+            attempt = The_queue.Claim(ID, arguments.max_attempts)
+            if attempt is None:
+                continue
+
+            print("> " + The_queue.owner + " started " + ID + " (attempt " + str(attempt) + ")", flush=True)
+
+            start = time.time()
+
+            # A separate heartbeat so the claim stays fresh while the case is being set up and cleaned up
+            stop = threading.Event()
+            beat = threading.Thread(target=Keep_claim, args=(The_queue, ID, stop, arguments.heartbeat), daemon=True)
+            beat.start()
+
+            try:
+                worked = Run_case(The_queue, Case, attempt, arguments.command, arguments.heartbeat)
+            finally:
+                stop.set()
+                beat.join()
+
+            recorded_time = time.time() - start
+
+            if worked:
+                The_queue.Complete(ID, The_queue.owner + " attempt " + str(attempt) + " " + str(round(recorded_time)) + " sec\n")
+                print("> " + The_queue.owner + " finished " + ID + " in " + str(round(recorded_time)) + " sec", flush=True)
+            else:
+                The_queue.Release(ID)
+                print("> " + The_queue.owner + " failed " + ID + " (attempt " + str(attempt) + "), see " + The_queue.Path("logs", ID + ".attempt_" + str(attempt) + ".log"), flush=True)
+
+            ran_a_case = True
+
+        if not ran_a_case:
+            time.sleep(arguments.poll)
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    RAMPS_arguments = parser.parse_args()
+
+    if not os.path.isfile(RAMPS_arguments.Manifest):
+        print("Error - This file is not detected : " + RAMPS_arguments.Manifest)
+        sys.exit(1)
+
+    Manifest = pd.read_csv(RAMPS_arguments.Manifest, dtype=str)
+
+    if "ID" not in Manifest.columns:
+        print("Error - The manifest is missing the column ID")
+        sys.exit(1)
+
+    if Manifest["ID"].duplicated().any():
+        print("Error - The manifest has repeated IDs")
+        sys.exit(1)
+
+    if RAMPS_arguments.status:
+        The_queue = RAMPS_queue(RAMPS_arguments.Queue_folder, RAMPS_arguments.stale_after)
+        The_status = The_queue.Status([str(ID) for ID in Manifest["ID"]])
+        The_queue.Close()
+        print(The_status.to_string(index=False))
+        print("")
+        print(The_status["State"].value_counts().to_string())
+        sys.exit(0)
+
+    The_workers = [multiprocessing.Process(target=Worker, args=(Manifest, RAMPS_arguments.Queue_folder, RAMPS_arguments)) for _ in range(RAMPS_arguments.workers)]
+
+    for worker in The_workers:
+        worker.start()
+
+    for worker in The_workers:
+        worker.join()
+
+    The_queue = RAMPS_queue(RAMPS_arguments.Queue_folder, RAMPS_arguments.stale_after)
+    The_status = The_queue.Status([str(ID) for ID in Manifest["ID"]])
+    The_queue.Close()
+    print(The_status["State"].value_counts().to_string())
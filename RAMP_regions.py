@@ -0,0 +1,173 @@
+# ========================================
+# RAMPS - Resection volume by region
+# Resection Automated Mask in Pre-operative Space
+#
+# How much of each brain region the resection mask takes, written by the cavity stage next to the final mask
+# - RAMPS_Resection_Mask_Output/RAMP_The_resection_volume_by_region.csv
+# one row per label of the pre-op SynthSeg parcellation (S3_mri_synthseg/Pre_op/PreOP_Sseg.nii.gz) and per label of the
+# dilated lobe atlas (S5_Lobe_template/Pre_op/Dilation/PreOP_ATLAS_DIL_FILTER.nii.gz), both on the same grid as
+# RAMP_The_resection_mask_in_ORIG.nii.gz, with the columns
+#   Atlas (SynthSeg or Lobe), Label, Region, Resected_voxels, Resected_mm3, Region_voxels, Region_mm3, Percent_resected
+#
+# Each atlas is counted in one np.bincount over the whole grid (label * 2 + mask), which gives the voxels of every label
+# inside and outside the mask at once, rather than one pass over the image for each label. When the preparation stage ran
+# in the same process the cavity stage counts the atlases it returned, rather than reading them back from the folder
+#
+# For output folders that were run before the table was written
+#   python RAMP_regions.py <RAMPS output folder> [<RAMPS output folder> ...]
+# ========================================
+
+### Imports ---
+
+import argparse
+import os
+import os.path
+import sys
+
+import numpy as np
+
+from RAMP_store import Case_mask_file, Case_atlas_file, Lobe_regions
+
+# The labels of SynthSeg 2.0 run with --parc (the cortex, 3 and 42, is split into the 1000s and 2000s)
+Synthseg_regions = {
+    0: "Background",
+    2: "Left_Cerebral_White_Matter", 4: "Left_Lateral_Ventricle", 5: "Left_Inf_Lat_Vent", 7: "Left_Cerebellum_White_Matter",
+    8: "Left_Cerebellum_Cortex", 10: "Left_Thalamus", 11: "Left_Caudate", 12: "Left_Putamen", 13: "Left_Pallidum",
+    14: "3rd_Ventricle", 15: "4th_Ventricle", 16: "Brain_Stem", 17: "Left_Hippocampus", 18: "Left_Amygdala", 24: "CSF",
+    26: "Left_Accumbens_area", 28: "Left_VentralDC",
+    41: "Right_Cerebral_White_Matter", 43: "Right_Lateral_Ventricle", 44: "Right_Inf_Lat_Vent", 46: "Right_Cerebellum_White_Matter",
+    47: "Right_Cerebellum_Cortex", 49: "Right_Thalamus", 50: "Right_Caudate", 51: "Right_Putamen", 52: "Right_Pallidum",
+    53: "Right_Hippocampus", 54: "Right_Amygdala", 58: "Right_Accumbens_area", 60: "Right_VentralDC",
+}
+
+Cortical_regions = {
+    1: "bankssts", 2: "caudalanteriorcingulate", 3: "caudalmiddlefrontal", 5: "cuneus", 6: "entorhinal", 7: "fusiform",
+    8: "inferiorparietal", 9: "inferiortemporal", 10: "isthmuscingulate", 11: "lateraloccipital", 12: "lateralorbitofrontal",
+    13: "lingual", 14: "medialorbitofrontal", 15: "middletemporal", 16: "parahippocampal", 17: "paracentral",
+    18: "parsopercularis", 19: "parsorbitalis", 20: "parstriangularis", 21: "pericalcarine", 22: "postcentral",
+    23: "posteriorcingulate", 24: "precentral", 25: "precuneus", 26: "rostralanteriorcingulate", 27: "rostralmiddlefrontal",
+    28: "superiorfrontal", 29: "superiorparietal", 30: "superiortemporal", 31: "supramarginal", 32: "frontalpole",
+    33: "temporalpole", 34: "transversetemporal", 35: "insula",
+}
+
+for label, name in Cortical_regions.items():
+    Synthseg_regions[1000 + label] = "ctx_lh_" + name
+    Synthseg_regions[2000 + label] = "ctx_rh_" + name
+
+def Case_synthseg_file(Output_Folder):
+
+    return os.path.join(Output_Folder, "S3_mri_synthseg", "Pre_op", "PreOP_Sseg.nii.gz")
+
+def Case_regions_file(Output_Folder):
+
+    return os.path.join(Output_Folder, "RAMPS_Resection_Mask_Output", "RAMP_The_resection_volume_by_region.csv")
+
+# ========================================
+### Counting ---
+
+# The voxels of each label of The_labels inside The_mask (boolean, same shape) and in all, in one pass
+# Returns two arrays indexed by label
+def Count_regions(The_labels, The_mask):
+
+    The_labels = np.rint(np.asarray(The_labels).ravel()).astype(np.int64)
+
+    if The_labels.size and The_labels.min() < 0:
+        raise ValueError("The atlas has negative labels")
+
+    size = int(The_labels.max()) + 1 if The_labels.size else 1
+
+    The_counts = np.bincount(The_labels * 2 + np.asarray(The_mask).ravel().astype(np.int64), minlength=2 * size).reshape(size, 2)
+
+    return The_counts[:, 1], The_counts.sum(axis=1)
+
+# The rows of the table for one atlas, every label of The_regions and any other label found in the atlas
+def Region_rows(Atlas, The_labels, The_mask, The_regions, voxel_mm3):
+
+    The_resected, The_region = Count_regions(The_labels, The_mask)
+
+    The_found = [label for label in np.nonzero(The_region)[0].tolist() if label not in The_regions]
+
+    The_rows = []
+    for label in list(The_regions) + The_found:
+
+        resected = int(The_resected[label]) if label < len(The_resected) else 0
+        region = int(The_region[label]) if label < len(The_region) else 0
+
+        The_rows.append({
+            "Atlas": Atlas,
+            "Label": int(label),
+            "Region": The_regions.get(label, "Label_" + str(label)),
+            "Resected_voxels": resected,
+            "Resected_mm3": round(resected * voxel_mm3, 3),
+            "Region_voxels": region,
+            "Region_mm3": round(region * voxel_mm3, 3),
+            "Percent_resected": round(100.0 * resected / region, 3) if region else 0.0,
+        })
+
+    return The_rows
+
+# Write the table of <Output_Folder>, The_mask is the final ORIG mask (an ANTsImage, read from the folder if None)
+# The_atlases are the atlases already in memory by name (SynthSeg, Lobe), ANTsImages or arrays, any other is read from
+# the folder
+# Returns the table, an atlas that is missing or not on the grid of the mask is left out
+def Write_region_volumes(Output_Folder, The_mask=None, The_atlases=None):
+
+    import nibabel as nib
+    import pandas as pd
+
+    if The_mask is None:
+        The_image = nib.load(Case_mask_file(Output_Folder))
+        The_mask = np.asanyarray(The_image.dataobj) > 0
+        voxel_mm3 = float(abs(np.linalg.det(The_image.affine[:3, :3])))
+    else:
+        voxel_mm3 = float(np.prod(The_mask.spacing))
+        The_mask = The_mask.numpy() > 0
+
+    The_rows = []
+    for Atlas, The_atlas_file, The_regions in [("SynthSeg", Case_synthseg_file(Output_Folder), Synthseg_regions), ("Lobe", Case_atlas_file(Output_Folder), Lobe_regions)]:
+
+        The_atlas = (The_atlases or {}).get(Atlas)
+
+        if The_atlas is not None:
+            The_atlas = The_atlas.numpy() if hasattr(The_atlas, "numpy") else np.asarray(The_atlas)
+        elif not os.path.isfile(The_atlas_file):
+            print("> No " + Atlas + " atlas for the volume by region --> " + The_atlas_file)
+            continue
+        else:
+            The_atlas = nib.load(The_atlas_file)
+
+        if The_atlas.shape[:3] != The_mask.shape:
+            print("> The " + Atlas + " atlas is not on the grid of the mask, left out of the volume by region --> " + The_atlas_file)
+            continue
+
+        if not isinstance(The_atlas, np.ndarray):
+            The_atlas = np.asanyarray(The_atlas.dataobj)
+
+        The_rows += Region_rows(Atlas, The_atlas.reshape(The_mask.shape), The_mask, The_regions, voxel_mm3)
+
+    The_table = pd.DataFrame(The_rows, columns=["Atlas", "Label", "Region", "Resected_voxels", "Resected_mm3", "Region_voxels", "Region_mm3", "Percent_resected"])
+    The_table.to_csv(Case_regions_file(Output_Folder), index=False)
+
+    return The_table
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="RAMP_regions.py", description="Write the resection volume by region of finished RAMPS output folders")
+    parser.add_argument("Output_Folders", nargs="+", help="RAMPS output folders")
+
+    RAMPS_arguments = parser.parse_args()
+
+    for Output_Folder in RAMPS_arguments.Output_Folders:
+        if not os.path.isfile(Case_mask_file(Output_Folder)):
+            print("Error - This file is not detected : " + Case_mask_file(Output_Folder))
+            sys.exit(1)
+
+    for Output_Folder in RAMPS_arguments.Output_Folders:
+
+        The_table = Write_region_volumes(Output_Folder)
+        The_lobes = The_table[(The_table["Atlas"] == "Lobe") & (The_table["Resected_voxels"] > 0)]
+
+        print("> " + Output_Folder + " --> " + ", ".join(The_lobes["Region"] + " " + The_lobes["Percent_resected"].astype(str) + " %") + " --> " + Case_regions_file(Output_Folder), flush=True)
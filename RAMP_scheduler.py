@@ -0,0 +1,302 @@
+# ========================================
+# RAMPS - Pipelined scheduler
+# Resection Automated Mask in Pre-operative Space
+#
+# Runs a manifest of cases on one machine with the three RAMPS stages (see RAMP_stages.py) overlapped across cases.
+# Each stage has its own pool of worker processes and its own thread budget, so while one case is in the preparation
+# stage (SynthStrip/SynthSeg inference) the case before it can be registering (multi-threaded ITK) and the one before
+# that in the cavity stage (mostly single threaded NumPy/SciPy)
+#
+#   python RAMP_scheduler.py <Manifest.csv> --registration_workers 2 --registration_threads 4
+#
+# The manifest is a csv with the columns ID, PreOP, PostOP, Output_Folder, Hemisphere, Lobe (the RAMP.py inputs), and
+# optionally N4_preset, N4_shrink, N4_iterations, N4_spline_distance, N4_mask to change the --n4_* settings of one case
+# ========================================
+
+### Imports ---
+
+import argparse
+import multiprocessing
+import os
+import os.path
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+from RAMP_autotune import Load_autotune_profile
+from RAMP_events import Add_event_callback, Emit_event, Open_event_fd, Send_event
+from RAMP_hypothesis import Parse_hemisphere_lobe
+from RAMP_images import Check_image_header
+from RAMP_n4 import N4_presets, Case_n4_settings, Describe_n4_settings
+from RAMP_profile import Profile_stage
+from RAMP_qc import Registration_qc_modes
+from RAMP_strategies import Default_strategies, Parse_strategies
+from RAMP_store import Append_cases
+
+# The same as Stages in RAMP_stages.py, repeated here so the scheduler itself never imports ants
+Stages = ["preparation", "registration", "cavity"]
+
+# ========================================
+### Inputs ---
+
+CPUs = os.cpu_count() or 1
+
+parser = argparse.ArgumentParser(prog="RAMP_scheduler.py", description="Run a manifest of RAMPS cases with the stages of different cases overlapped")
+parser.add_argument("Manifest", help="csv with the columns ID, PreOP, PostOP, Output_Folder, Hemisphere, Lobe")
+parser.add_argument("--status_csv", default=None, help="where to write the stage times of every case (default: next to the manifest)")
+# Used when neither the command line nor the autotune profile of this machine (see RAMP_autotune.py) gives them
+Stage_defaults = {"preparation": (1, max(1, CPUs // 2)), "registration": (1, max(1, CPUs // 2)), "cavity": (max(1, CPUs // 4), 1)}
+for stage, (workers, threads) in Stage_defaults.items():
+    parser.add_argument("--" + stage + "_workers", type=int, default=None, help="cases in the " + stage + " stage at the same time (default from the autotune profile, or " + str(workers) + ")")
+    parser.add_argument("--" + stage + "_threads", type=int, default=None, help="threads for each " + stage + " worker (default from the autotune profile, or " + str(threads) + ")")
+parser.add_argument("--validate_narrow_band", action="store_true", help="passed on to the cavity stage, see RAMP.py")
+parser.add_argument("--profile", action="store_true", help="profile each stage of every case, see RAMP.py")
+parser.add_argument("--registration_qc", default="warn", choices=Registration_qc_modes, help="what to do when a registration fails its quality check, a case that fails stops before the cavity stage (see RAMP_qc.py)")
+parser.add_argument("--registration_strategies", default=",".join(Default_strategies), help="the registration strategies of each case, run at the same time with the --registration_threads split between them (all or a comma separated list, see RAMP_strategies.py)")
+parser.add_argument("--tool_timeout", type=float, default=None, help="stop mri_synthstrip / SynthSeg after this many sec (default: per tool, see RAMP_tools.py)")
+parser.add_argument("--tool_retries", type=int, default=None, help="run a failed mri_synthstrip / SynthSeg again this many times (default 1)")
+parser.add_argument("--tool_memory_gb", type=float, default=None, help="cap the memory (data, not address space) of mri_synthstrip / SynthSeg (default no cap)")
+parser.add_argument("--n4_preset", default="default", choices=list(N4_presets), help="N4 bias correction preset of every case, see RAMP.py (an N4_preset column changes it for one case)")
+parser.add_argument("--n4_shrink", type=int, default=None, help="N4 shrink factor, changes the preset (column N4_shrink)")
+parser.add_argument("--n4_iterations", default=None, help="N4 convergence schedule e.g. 50x50x30, changes the preset (column N4_iterations)")
+parser.add_argument("--n4_spline_distance", type=float, default=None, help="N4 B-spline control point distance (mm), changes the preset (column N4_spline_distance)")
+parser.add_argument("--n4_mask", default=None, choices=["none", "head"], help="N4 fit over the whole image (none) or a head mask, changes the preset (column N4_mask)")
+parser.add_argument("--store", default=None, help="append the ORIG mask of every finished case to this cohort store (HDF5, see RAMP_store.py)")
+parser.add_argument("--event_fd", type=int, default=None, help="write the progress events of every case (with its ID) as newline delimited JSON to this file descriptor (see RAMP_events.py)")
+
+# ========================================
+### Stage workers ---
+
+Worker_threads = None
+Worker_case = None
+
+# Runs once in each worker process before anything is imported
+# ITK reads the number of threads to use the first time it is used, so the thread budget has to be set here
+# With an Event_queue the progress events of the worker are sent back to the scheduler, tagged with the case ID
+# Tool_configuration is passed on to Configure_tools (see RAMP_tools.py)
+def Init_stage_worker(threads, Event_queue=None, Tool_configuration=None):
+
+    global Worker_threads
+
+    from RAMP_tools import Configure_tools
+
+    Worker_threads = threads
+
+    Configure_tools(**(Tool_configuration or {}))
+
+    if Event_queue is not None:
+        Add_event_callback(lambda The_event: Event_queue.put(dict(The_event, id=Worker_case)))
+
+    os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(threads)
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+def Run_stage(stage, Case, validate_narrow_band=False, profile=False, registration_qc="off", registration_strategies=None):
+
+    global Worker_case
+
+    from RAMP_stages import Run_preparation, Run_registration, Run_cavity, Save_time_keeping
+
+    Worker_case = str(Case["ID"])
+
+    Output_Folder = Case["Output_Folder"]
+
+    if not os.path.isdir(Output_Folder):
+        os.makedirs(Output_Folder, exist_ok=True)
+
+    # With auto the cavity stage tries every candidate, as in RAMP.py
+    Hemisphere, Lobe, Candidates = Parse_hemisphere_lobe(Case["Hemisphere"], Case["Lobe"])
+
+    start = time.time()
+
+    # Keep the output of each stage with the case, the workers are shared between cases
+    with open(os.path.join(Output_Folder, "RAMP_" + stage + ".log"), "w") as log:
+
+        stdout, stderr = os.dup(1), os.dup(2)
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+
+        try:
+            with Profile_stage(Output_Folder, stage, profile):
+                if stage == "preparation":
+                    The_preop, The_postop, The_atlases, Time_keeping = Run_preparation(Case["PreOP"], Case["PostOP"], Output_Folder, Hemisphere, Lobe, Threads=Worker_threads, N4_settings=Case.get("N4_settings"))
+                elif stage == "registration":
+                    Time_keeping = Run_registration(Output_Folder, Registration_qc=registration_qc, Strategies=registration_strategies, Threads=Worker_threads)
+                else:
+                    Time_keeping = Run_cavity(Output_Folder, Case["PreOP"], Validate_narrow_band=validate_narrow_band, Candidates=Candidates)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(stdout, 1)
+            os.dup2(stderr, 2)
+            os.close(stdout)
+            os.close(stderr)
+
+    Save_time_keeping(Output_Folder, Time_keeping)
+
+    return time.time() - start
+
+# Write out the events the workers send back, until None
+def Forward_events(The_event_queue):
+
+    for The_event in iter(The_event_queue.get, None):
+        Send_event(The_event)
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    RAMPS_arguments = parser.parse_args()
+
+    if not os.path.isfile(RAMPS_arguments.Manifest):
+        print("Error - This file is not detected : " + RAMPS_arguments.Manifest)
+        sys.exit(1)
+
+    Manifest = pd.read_csv(RAMPS_arguments.Manifest, dtype=str)
+
+    for column in ["ID", "PreOP", "PostOP", "Output_Folder", "Hemisphere", "Lobe"]:
+        if column not in Manifest.columns:
+            print("Error - The manifest is missing the column " + column)
+            sys.exit(1)
+
+    N4_changes = dict(shrink_factor=RAMPS_arguments.n4_shrink, iterations=RAMPS_arguments.n4_iterations, spline_distance=RAMPS_arguments.n4_spline_distance, mask=RAMPS_arguments.n4_mask)
+    try:
+        N4_settings = Case_n4_settings({}, RAMPS_arguments.n4_preset, **N4_changes)
+    except ValueError as e:
+        print("Error - " + str(e))
+        sys.exit(1)
+
+    The_cases = Manifest.to_dict("records")
+
+    # The N4 settings go with each case to its preparation worker
+    for Case in The_cases:
+        try:
+            Parse_hemisphere_lobe(Case["Hemisphere"], Case["Lobe"])
+            Case["N4_settings"] = Case_n4_settings(Case, RAMPS_arguments.n4_preset, **N4_changes)
+        except ValueError as e:
+            print("Error - " + str(Case["ID"]) + " : " + str(e))
+            sys.exit(1)
+
+    for image in list(Manifest["PreOP"]) + list(Manifest["PostOP"]):
+        if not os.path.exists(image):
+            print("Error - This file is not detected : " + image)
+            sys.exit(1)
+        try:
+            Check_image_header(image)
+        except ValueError as e:
+            print("Error - " + str(e))
+            sys.exit(1)
+
+    try:
+        Registration_strategies = Parse_strategies(RAMPS_arguments.registration_strategies)
+    except ValueError as e:
+        print("Error - " + str(e))
+        sys.exit(1)
+
+    status_csv = RAMPS_arguments.status_csv or os.path.splitext(RAMPS_arguments.Manifest)[0] + "_schedule.csv"
+
+    # Spawned workers so the thread settings are in place before ants is imported
+    The_context = multiprocessing.get_context("spawn")
+
+    # Events from the workers come back on a queue and are written out here
+    The_event_queue = None
+    if RAMPS_arguments.event_fd is not None:
+        try:
+            Open_event_fd(RAMPS_arguments.event_fd)
+        except OSError as e:
+            print("Error - Cannot write events to file descriptor " + str(RAMPS_arguments.event_fd) + " : " + str(e))
+            sys.exit(1)
+
+        The_event_queue = The_context.Queue()
+        The_event_forwarder = threading.Thread(target=Forward_events, args=(The_event_queue,), daemon=True)
+        The_event_forwarder.start()
+
+    # The settings that are not given come from the autotune profile of this machine
+    The_profile = Load_autotune_profile()
+    for stage, The_defaults in Stage_defaults.items():
+        The_tuned = (The_profile or {}).get("stages", {}).get(stage) or {}
+        for kind, default in zip(["workers", "threads"], The_defaults):
+            if getattr(RAMPS_arguments, stage + "_" + kind) is None:
+                setattr(RAMPS_arguments, stage + "_" + kind, The_tuned.get(kind, default))
+
+    The_pools = {}
+    for stage in Stages:
+        workers = getattr(RAMPS_arguments, stage + "_workers")
+        threads = getattr(RAMPS_arguments, stage + "_threads")
+        print("> " + stage + " --> " + str(workers) + " workers x " + str(threads) + " threads")
+        The_pools[stage] = ProcessPoolExecutor(max_workers=workers, mp_context=The_context, initializer=Init_stage_worker, initargs=(threads, The_event_queue, dict(timeout=RAMPS_arguments.tool_timeout, retries=RAMPS_arguments.tool_retries, memory_gb=RAMPS_arguments.tool_memory_gb)))
+
+    # The command line settings, cases with their own N4_* columns are listed
+    print("> N4 bias correction --> " + RAMPS_arguments.n4_preset + " (" + Describe_n4_settings(N4_settings) + ")")
+    for Case in The_cases:
+        if Case["N4_settings"] != N4_settings:
+            print(">  " + str(Case["ID"]) + " --> " + Describe_n4_settings(Case["N4_settings"]))
+
+    The_status = {str(Case["ID"]): {"ID": str(Case["ID"]), "State": "waiting", "Error": ""} for Case in The_cases}
+
+    start = time.time()
+
+    # Every case starts in the preparation queue, when a stage finishes the case moves on to the next stage's queue
+    running = {}
+    for Case in The_cases:
+        future = The_pools["preparation"].submit(Run_stage, "preparation", Case, profile=RAMPS_arguments.profile)
+        running[future] = (Case, "preparation", time.time())
+
+    while running:
+
+        finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+
+        for future in finished:
+
+            Case, stage, submitted = running.pop(future)
+            ID = str(Case["ID"])
+
+            try:
+                recorded_time = future.result()
+            except Exception as e:
+                The_status[ID]["State"] = "failed"
+                The_status[ID]["Error"] = stage + " : " + repr(e)
+                print("> " + ID + " failed in " + stage + " --> " + repr(e) + " (see " + os.path.join(Case["Output_Folder"], "RAMP_" + stage + ".log") + ")", flush=True)
+                Emit_event("stage_failed", id=ID, stage=stage, output_folder=Case["Output_Folder"], error=repr(e))
+                continue
+
+            The_status[ID][stage + "_SEC"] = recorded_time
+            The_status[ID][stage + "_wait_SEC"] = time.time() - submitted - recorded_time
+
+            print("> " + ID + " finished " + stage + " in " + str(round(recorded_time)) + " sec", flush=True)
+
+            if stage == Stages[-1]:
+                The_status[ID]["State"] = "done"
+                The_status[ID]["Finished_SEC"] = time.time() - start
+                # The cases are stored from here, one at a time, as an HDF5 file cannot take two writers
+                if RAMPS_arguments.store is not None:
+                    try:
+                        Append_cases(RAMPS_arguments.store, [Case])
+                    except (OSError, ValueError) as e:
+                        The_status[ID]["Error"] = "store : " + repr(e)
+                        print("> " + ID + " could not be stored --> " + repr(e), flush=True)
+                continue
+
+            next_stage = Stages[Stages.index(stage) + 1]
+            The_status[ID]["State"] = next_stage
+            next_future = The_pools[next_stage].submit(Run_stage, next_stage, Case, RAMPS_arguments.validate_narrow_band, RAMPS_arguments.profile, RAMPS_arguments.registration_qc, Registration_strategies)
+            running[next_future] = (Case, next_stage, time.time())
+
+        pd.DataFrame(list(The_status.values())).to_csv(status_csv, index=False)
+
+    for pool in The_pools.values():
+        pool.shutdown()
+
+    if The_event_queue is not None:
+        The_event_queue.put(None)
+        The_event_forwarder.join()
+
+    recorded_time = time.time() - start
+    The_done = sum(1 for status in The_status.values() if status["State"] == "done")
+
+    print("")
+    print("> RAMPS scheduler completed --> " + str(The_done) + " of " + str(len(The_cases)) + " cases in " + str(round(recorded_time)) + " sec (" + str(round(3600 * The_done / recorded_time, 2)) + " cases per hour)")
+    print("> Stage times --> " + status_csv)
@@ -0,0 +1,371 @@
+# ========================================
+# RAMPS - Service
+# Resection Automated Mask in Pre-operative Space
+#
+# A long running RAMPS that keeps its worker processes (and the ANTs / NumPy / SciPy libraries loaded in them) warm, and
+# takes jobs from two places
+# - an inbox folder : drop a <name>.json pair manifest in it, e.g.
+#       {"ID": "patient_X", "PreOP": "/data/X_pre.nii.gz", "PostOP": "/data/X_post.nii.gz",
+#        "Output_Folder": "/data/X_RAMPS", "Hemisphere": "R", "Lobe": "F"}
+#   the file is moved to inbox/accepted (or inbox/rejected with the reason) once it has been read, the optional keys
+#   N4_preset, N4_shrink, N4_iterations, N4_spline_distance, N4_mask change its N4 settings (see RAMP_n4.py)
+# - a small HTTP endpoint on this machine
+#       POST /jobs          the same json as the body, returns the job
+#       GET  /jobs          every job
+#       GET  /jobs/<ID>     one job, with the state and time of each stage
+#
+#   python RAMP_service.py <Service_folder> --jobs 2 --threads 4 --port 8765
+#
+# At most --jobs cases run at the same time, the rest wait in the queue. Each job runs its stages (see RAMP_stages.py)
+# one after another in the warm workers, so the status of a job shows the stage it is in. The status of every job is
+# also kept in <Service_folder>/jobs/<ID>.json, and jobs that had not finished when the service stopped are queued
+# again when it starts.
+# SynthStrip and SynthSeg are still started as their own processes by the preparation stage (as in RAMP.py)
+# ========================================
+
+### Imports ---
+
+import argparse
+import json
+import multiprocessing
+import os
+import os.path
+import queue
+import shutil
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from RAMP_autotune import Load_autotune_profile
+from RAMP_events import Print_output
+from RAMP_hypothesis import Parse_hemisphere_lobe
+from RAMP_images import Check_image_header
+from RAMP_n4 import Case_n4_settings
+from RAMP_scheduler import Stages, Init_stage_worker, Run_stage
+
+# ========================================
+### Inputs ---
+
+parser = argparse.ArgumentParser(prog="RAMP_service.py", description="Keep RAMPS running and take jobs from an inbox folder and a local HTTP endpoint")
+parser.add_argument("Service_folder", help="folder for the inbox and the job status files")
+parser.add_argument("--jobs", type=int, default=None, help="cases that run at the same time (default from the autotune profile, see RAMP_autotune.py, or 1)")
+parser.add_argument("--threads", type=int, default=None, help="threads for each running case (default from the autotune profile, or half the CPUs)")
+parser.add_argument("--host", default="127.0.0.1", help="address the HTTP endpoint listens on (default this machine only)")
+parser.add_argument("--port", type=int, default=8765, help="port of the HTTP endpoint, 0 turns it off")
+parser.add_argument("--poll", type=float, default=5, help="seconds between looks in the inbox")
+parser.add_argument("--validate_narrow_band", action="store_true", help="passed on to the cavity stage, see RAMP.py")
+
+# ========================================
+### Jobs ---
+
+# Check a pair manifest and fill in the defaults, returns the case or raises ValueError
+def Read_job(The_job):
+
+    if not isinstance(The_job, dict):
+        raise ValueError("a job is a json object")
+
+    for key in ["PreOP", "PostOP", "Output_Folder", "Hemisphere", "Lobe"]:
+        if key not in The_job:
+            raise ValueError("the job is missing " + key)
+
+    for key in ["PreOP", "PostOP"]:
+        if not os.path.exists(str(The_job[key])):
+            raise ValueError("This file is not detected : " + str(The_job[key]))
+        Check_image_header(str(The_job[key]))
+
+    # The same as RAMP.py, auto included
+    Parse_hemisphere_lobe(The_job["Hemisphere"], The_job["Lobe"])
+
+    Case = {key: str(The_job[key]) for key in ["PreOP", "PostOP", "Output_Folder", "Hemisphere", "Lobe"]}
+    Case["ID"] = str(The_job.get("ID") or os.path.basename(os.path.normpath(Case["Output_Folder"])))
+
+    # The ID names the status file
+    if not Case["ID"] or "/" in Case["ID"] or "\\" in Case["ID"] or Case["ID"].startswith("."):
+        raise ValueError("the ID cannot be used as a file name : " + Case["ID"])
+
+    # Passed on to the preparation stage, as the --n4_* flags of RAMP.py
+    Case["N4_settings"] = Case_n4_settings(The_job)
+
+    return Case
+
+class RAMPS_service:
+
+    def __init__(self, Service_folder, jobs=1, threads=1, validate_narrow_band=False):
+
+        self.Service_folder = Service_folder
+        self.validate_narrow_band = validate_narrow_band
+        self.jobs = jobs
+        self.threads = threads
+
+        for folder in ["inbox", os.path.join("inbox", "accepted"), os.path.join("inbox", "rejected"), "jobs"]:
+            os.makedirs(os.path.join(Service_folder, folder), exist_ok=True)
+
+        self.The_jobs = {}
+        self.The_queue = queue.Queue()
+        self.lock = threading.Lock()
+
+        self.The_pool = None
+        self.Start_pool()
+
+        self.The_runners = [threading.Thread(target=self.Runner, daemon=True) for _ in range(jobs)]
+
+        # Pick up the jobs from the last time the service ran
+        for name in sorted(os.listdir(os.path.join(Service_folder, "jobs"))):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(Service_folder, "jobs", name)) as f:
+                The_status = json.load(f)
+            self.The_jobs[The_status["ID"]] = The_status
+            if The_status["State"] not in ["done", "failed"]:
+                Print_output("> Queued again from the last run --> " + The_status["ID"])
+                # It runs from the first stage again
+                The_status.update(State="queued", Stage="", Error="", Stages={stage: {"State": "waiting"} for stage in Stages})
+                self.Save(The_status)
+                self.The_queue.put(The_status["ID"])
+
+        for runner in self.The_runners:
+            runner.start()
+
+    # One warm worker process for each job that can run, they are started (and RAMP_stages imported) straight away
+    # Also starts a new pool in place of The_broken one, when a worker has died (a segfault in ITK, killed for memory)
+    # every job in the pool fails with BrokenProcessPool and the pool takes no more
+    def Start_pool(self, The_broken=None):
+
+        with self.lock:
+
+            if self.The_pool is not The_broken:
+                return
+
+            if The_broken is not None:
+                Print_output("> A worker process died, starting the warm workers again")
+                The_broken.shutdown(wait=False)
+
+            The_context = multiprocessing.get_context("spawn")
+            self.The_pool = ProcessPoolExecutor(max_workers=self.jobs, mp_context=The_context, initializer=Init_warm_worker, initargs=(self.threads,))
+            for _ in range(self.jobs):
+                self.The_pool.submit(time.sleep, 0)
+
+    # Run a stage in the warm workers, once more in new workers if a worker died
+    def Run_stage_in_pool(self, stage, Case):
+
+        for attempt in [1, 2]:
+
+            The_pool = self.The_pool
+
+            try:
+                return The_pool.submit(Run_stage, stage, Case, self.validate_narrow_band).result()
+            except BrokenProcessPool:
+                self.Start_pool(The_pool)
+                if attempt == 2:
+                    raise
+
+    def Save(self, The_status):
+
+        The_status["Updated"] = time.time()
+
+        job_file = os.path.join(self.Service_folder, "jobs", The_status["ID"] + ".json")
+        with open(job_file + ".tmp", "w") as f:
+            json.dump(The_status, f, indent=1)
+        os.replace(job_file + ".tmp", job_file)
+
+    # A deep copy taken under the lock, the worker changes the nested Stages while the copy is serialised
+    def Status(self, ID=None):
+
+        with self.lock:
+            if ID is None:
+                return json.loads(json.dumps(list(self.The_jobs.values())))
+            if ID not in self.The_jobs:
+                return None
+            return json.loads(json.dumps(self.The_jobs[ID]))
+
+    # Queue a job, raises ValueError if it is not a valid job or the ID is already queued or running
+    def Submit(self, The_job, source):
+
+        Case = Read_job(The_job)
+
+        with self.lock:
+
+            if Case["ID"] in self.The_jobs and self.The_jobs[Case["ID"]]["State"] not in ["done", "failed"]:
+                raise ValueError("the job " + Case["ID"] + " is already " + self.The_jobs[Case["ID"]]["State"])
+
+            The_status = {"ID": Case["ID"], "Case": Case, "Source": source, "State": "queued", "Stage": "", "Error": "",
+                          "Submitted": time.time(), "Stages": {stage: {"State": "waiting"} for stage in Stages}}
+
+            self.The_jobs[Case["ID"]] = The_status
+            self.Save(The_status)
+
+        Print_output("> Queued --> " + Case["ID"] + " (from " + source + ")")
+
+        self.The_queue.put(Case["ID"])
+
+        return self.Status(Case["ID"])
+
+    def Update(self, ID, **changes):
+
+        with self.lock:
+            self.The_jobs[ID].update(changes)
+            self.Save(self.The_jobs[ID])
+
+    def Update_stage(self, ID, stage, **changes):
+
+        with self.lock:
+            self.The_jobs[ID]["Stages"][stage].update(changes)
+            self.Save(self.The_jobs[ID])
+
+    # Takes jobs off the queue and runs their stages in the warm workers, --jobs of these run at the same time
+    def Runner(self):
+
+        while True:
+
+            ID = self.The_queue.get()
+            Case = self.Status(ID)["Case"]
+
+            self.Update(ID, State="running", Started=time.time())
+            Print_output("> Started --> " + ID)
+
+            for stage in Stages:
+
+                self.Update(ID, Stage=stage)
+                self.Update_stage(ID, stage, State="running")
+
+                try:
+                    recorded_time = self.Run_stage_in_pool(stage, Case)
+                except Exception as e:
+                    self.Update_stage(ID, stage, State="failed")
+                    self.Update(ID, State="failed", Error=stage + " : " + repr(e), Finished=time.time())
+                    Print_output("> " + ID + " failed in " + stage + " --> " + repr(e) + " (see " + os.path.join(Case["Output_Folder"], "RAMP_" + stage + ".log") + ")")
+                    break
+
+                self.Update_stage(ID, stage, State="done", SEC=recorded_time)
+
+            else:
+                self.Update(ID, State="done", Stage="", Finished=time.time())
+                Print_output("> Finished --> " + ID)
+
+    # Pick up the pair manifests dropped in the inbox
+    def Watch_inbox(self, poll):
+
+        inbox = os.path.join(self.Service_folder, "inbox")
+
+        while True:
+
+            for name in sorted(os.listdir(inbox)):
+
+                manifest = os.path.join(inbox, name)
+
+                if not name.endswith(".json") or not os.path.isfile(manifest):
+                    continue
+
+                # Leave files that are still being written for the next look
+                if time.time() - os.stat(manifest).st_mtime < poll:
+                    continue
+
+                try:
+                    with open(manifest) as f:
+                        self.Submit(json.load(f), "inbox/" + name)
+                    shutil.move(manifest, os.path.join(inbox, "accepted", name))
+                except (ValueError, OSError) as e:
+                    Print_output("> Rejected " + name + " --> " + str(e))
+                    shutil.move(manifest, os.path.join(inbox, "rejected", name))
+                    with open(os.path.join(inbox, "rejected", name + ".error"), "w") as f:
+                        f.write(str(e) + "\n")
+
+            time.sleep(poll)
+
+# Starting a worker also loads ANTs and the rest of RAMPS so the first job does not wait for it
+def Init_warm_worker(threads):
+
+    Init_stage_worker(threads)
+
+    # Only imported to load it (and ANTs) now, Run_stage imports it again when the first job comes
+    import RAMP_stages  # noqa: F401
+
+# ========================================
+### HTTP ---
+
+def Make_handler(The_service):
+
+    class RAMPS_handler(BaseHTTPRequestHandler):
+
+        def Reply(self, code, The_reply):
+
+            body = json.dumps(The_reply, indent=1).encode()
+
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+
+            path = self.path.rstrip("/")
+
+            if path == "/jobs":
+                self.Reply(200, The_service.Status())
+            elif path.startswith("/jobs/"):
+                ID = urllib.parse.unquote(path[len("/jobs/"):])
+                The_status = The_service.Status(ID)
+                if The_status is None:
+                    self.Reply(404, {"Error": "no job " + ID})
+                else:
+                    self.Reply(200, The_status)
+            else:
+                self.Reply(404, {"Error": "use /jobs or /jobs/<ID>"})
+
+        def do_POST(self):
+
+            if self.path.rstrip("/") != "/jobs":
+                self.Reply(404, {"Error": "post jobs to /jobs"})
+                return
+
+            try:
+                The_job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+                self.Reply(202, The_service.Submit(The_job, "http"))
+            except ValueError as e:
+                self.Reply(400, {"Error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return RAMPS_handler
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    RAMPS_arguments = parser.parse_args()
+
+    if not os.path.isdir(RAMPS_arguments.Service_folder):
+        os.makedirs(RAMPS_arguments.Service_folder)
+
+    # The settings that are not given come from the autotune profile of this machine
+    The_tuned = (Load_autotune_profile() or {}).get("service") or {}
+    if RAMPS_arguments.jobs is None:
+        RAMPS_arguments.jobs = The_tuned.get("jobs", 1)
+    if RAMPS_arguments.threads is None:
+        RAMPS_arguments.threads = The_tuned.get("threads", max(1, (os.cpu_count() or 1) // 2))
+
+    print("> Starting " + str(RAMPS_arguments.jobs) + " warm workers x " + str(RAMPS_arguments.threads) + " threads", flush=True)
+
+    The_service = RAMPS_service(RAMPS_arguments.Service_folder, RAMPS_arguments.jobs, RAMPS_arguments.threads, RAMPS_arguments.validate_narrow_band)
+
+    threading.Thread(target=The_service.Watch_inbox, args=(RAMPS_arguments.poll,), daemon=True).start()
+    print("> Watching --> " + os.path.join(RAMPS_arguments.Service_folder, "inbox"), flush=True)
+
+    try:
+        if RAMPS_arguments.port:
+            The_server = ThreadingHTTPServer((RAMPS_arguments.host, RAMPS_arguments.port), Make_handler(The_service))
+            print("> Listening --> http://" + RAMPS_arguments.host + ":" + str(The_server.server_address[1]) + "/jobs", flush=True)
+            The_server.serve_forever()
+        else:
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        print("> Stopping, unfinished jobs are queued again on the next start")
+        sys.exit(0)
@@ -0,0 +1,1010 @@
+# ========================================
+# RAMPS - Stages
+# Resection Automated Mask in Pre-operative Space
+#
+# The three stages of RAMPS (PREPARING, REGISTRATION and CREATION) as functions. Each stage only needs what the
+# stages before it have written into the output folder, so a case can be run one stage at a time, in different processes
+# (see RAMP_scheduler.py). RAMP.py runs them one after another.
+# ========================================
+
+### Imports ---
+
+import pandas as pd
+import ants
+import time
+import os.path
+import shutil
+import nibabel as nib
+import numpy as np
+from scipy import ndimage as nd
+
+from RAMP_cavity import Load_cavity_inputs, Make_resection_mask, Restrict_to_roi
+from RAMP_hypothesis import Run_hypotheses
+from RAMP_images import Read_input_image
+from RAMP_n4 import Run_n4
+from RAMP_events import Emit_event
+from RAMP_qc import Check_registration, Retry_transform
+from RAMP_writer import Start_writer, Write_image, Wait_for_writes, Finish_writes
+from RAMP_regions import Write_region_volumes
+from RAMP_tools import Run_tool
+from RAMP_strategies import Default_strategies, Registration_strategies, Check_registration_threads, Strategy_folder, Retry_folder, Selected_strategy, Registration_folder, Load_strategy_inputs, Register_strategy, Strategy_measures, Run_strategies, Write_selected_strategy, Add_retry_row
+
+# Get the location of this script is, to keep all this code in the same place
+Location_of_script = os.path.dirname(os.path.abspath(__file__))
+
+#Get freesurfer_home
+FREESURFER_HOME=os.environ.get('FREESURFER_HOME', '')
+
+#Get the python scripts for synthstrip and synthseg
+mri_synthstrip = FREESURFER_HOME+"/python/scripts/mri_synthstrip"
+mri_synthseg = str(Location_of_script)+"/Place_SynthSeg_here/SynthSeg/scripts/commands/SynthSeg_predict.py"
+
+# Location of fake ORIG file
+blank_orig_file = str(Location_of_script)+"/fakesurfer_orig.nii.gz"
+
+Stages = ["preparation", "registration", "cavity"]
+
+# ========================================
+### Time keeping ---
+
+# A spreadsheet that tracks how long each section is taking
+def New_time_keeping():
+
+    return pd.DataFrame(columns=['Section','Time_(SEC)'])
+
+# Add a row to the time keeping, and send it as a section event (see RAMP_events.py)
+def Add_section_time(Time_keeping, Section, recorded_time):
+
+    Emit_event("section", section=Section, seconds=round(recorded_time, 3))
+
+    return pd.concat([Time_keeping, pd.DataFrame([[Section,recorded_time]], columns=['Section','Time_(SEC)'])], ignore_index=True)
+
+# Keep the time each section took with the outputs (RAMP_evaluate.py joins these onto the accuracy results)
+# A stage run on its own replaces its own sections and keeps the times of the other stages
+def Save_time_keeping(Output_Folder, Time_keeping):
+
+    The_resection_mask_Final=os.path.join(Output_Folder, "RAMPS_Resection_Mask_Output")
+    if not os.path.exists(The_resection_mask_Final):
+        os.makedirs(The_resection_mask_Final)
+
+    Time_keeping_csv = The_resection_mask_Final+"/RAMP_Time_keeping.csv"
+
+    if os.path.isfile(Time_keeping_csv):
+        The_previous = pd.read_csv(Time_keeping_csv)
+        The_previous = The_previous[~The_previous['Section'].isin(Time_keeping['Section'])]
+        Time_keeping = pd.concat([The_previous, Time_keeping], ignore_index=True)
+
+    Time_keeping.to_csv(Time_keeping_csv, index=False)
+
+# ========================================
+### Lobe of resection ---
+
+# The labels of each lobe in the dilated lobe atlas (S5_Lobe_template), Temporal also takes the sub-cortical and insula
+Lobe_labels = {
+    "L": {"T": [13, 15, 16], "F": [11], "P": [12], "O": [14]},
+    "R": {"T": [23, 25, 26], "F": [21], "P": [22], "O": [24]},
+}
+
+Lobe_names = {"T": "Temporal", "F": "Frontal", "P": "Parietal", "O": "Occipital"}
+
+# Section 3.5, the only part of PREPARING that depends on the Hemisphere and Lobe
+# feild_map_Resected_area which is a mask of all lobes a user specifies the resection takes place
+# feild_map_NONE_Resected_area which is the lobes where resection didnt take place (the rest of the Sseg mask)
+# Returns the pre-op and post-op feild maps and the pre-op and post-op none resected maps
+def Make_resection_field_maps(PreOP_ATLAS_DIL_FILTER, PostOP_ATLAS_DIL_FILTER, PreOP_Sseg_MASK, PostOP_Sseg_MASK, Hemisphere, Lobe):
+
+    Pre_OP_feild_map_Resected_area = ants.get_mask(PreOP_ATLAS_DIL_FILTER,low_thresh=1,cleanup=0) * 0
+    Post_OP_feild_map_Resected_area = ants.get_mask(PostOP_ATLAS_DIL_FILTER,low_thresh=1,cleanup=0) * 0
+
+    print("Hemisphere is " + {"L": "Left", "R": "Right"}.get(Hemisphere, Hemisphere))
+
+    # the aim of this for loop is to filter through each of lobes the user specified the resection took place and add that lobe to the feild maps
+    for The_lobe in ["T", "F", "P", "O"]:
+
+        if The_lobe not in Lobe or Hemisphere not in Lobe_labels:
+            continue
+
+        print(Lobe_names[The_lobe])
+
+        for label in Lobe_labels[Hemisphere][The_lobe]:
+            Pre_OP_feild_map_Resected_area = Pre_OP_feild_map_Resected_area + ants.threshold_image( PreOP_ATLAS_DIL_FILTER, label, label )
+            Post_OP_feild_map_Resected_area = Post_OP_feild_map_Resected_area + ants.threshold_image( PostOP_ATLAS_DIL_FILTER, label, label )
+
+        Pre_OP_feild_map_Resected_area = ants.get_mask(Pre_OP_feild_map_Resected_area,low_thresh=1,cleanup=0) * 1
+        Post_OP_feild_map_Resected_area = ants.get_mask(Post_OP_feild_map_Resected_area,low_thresh=1,cleanup=0) * 1
+
+    PRE_the_none_resected_lobe = Pre_OP_feild_map_Resected_area + PreOP_Sseg_MASK
+    PRE_the_none_resected_lobe = ants.threshold_image( PRE_the_none_resected_lobe, 1, 1 )
+
+    POST_the_none_resected_lobe = Post_OP_feild_map_Resected_area + PostOP_Sseg_MASK
+    POST_the_none_resected_lobe = ants.threshold_image( POST_the_none_resected_lobe, 1, 1 )
+
+    return Pre_OP_feild_map_Resected_area, Post_OP_feild_map_Resected_area, PRE_the_none_resected_lobe, POST_the_none_resected_lobe
+
+# ========================================
+### PREPARING ---
+
+# Steps 1 to 5, from the two input images to the skull stripped images and lobe maps in the orig space
+# The inputs are NIfTI files or DICOM series folders, Save_input_nifti also writes a DICOM input out as
+# <Output_Folder>/<ID>/Input_image.nii.gz
+# Threads is passed on to SynthSeg (None keeps the SynthSeg default)
+# Orig_grid is the grid used in place of the fake orig (e.g. the 2 mm preview grid, see RAMP_preview.py), Synthseg_fast
+# runs SynthSeg with --fast
+# Returns the pre-op image (it is needed again for the PRE resolution outputs), the N4 bias corrected post-op orig image
+# (the source of the post-op outputs, see Run_cavity), the pre-op SynthSeg parcellation and dilated lobe atlas on the
+# orig grid (the atlases of the volume by region, see RAMP_regions.py) and the time keeping
+def Run_preparation(PreOP_Data_image, PostOP_Data_image, Output_Folder, Hemisphere, Lobe, Time_keeping=None, Threads=None, Save_input_nifti=False, N4_settings=None, Orig_grid=None, Synthseg_fast=False):
+
+    stage_start = time.time()
+    Emit_event("stage_start", stage="preparation", output_folder=Output_Folder)
+
+    if Time_keeping is None:
+        Time_keeping = New_time_keeping()
+
+    # The images of the stage are written in the background (see RAMP_writer.py)
+    Start_writer()
+
+    blank_orig = ants.image_read(blank_orig_file) if Orig_grid is None else Orig_grid
+
+    # ========================================
+    # 1 - Get the image into orig resolution
+    # We want an orig file but don't want to run somthing like recon-all that will take alot of time
+    # Instead we apply ants resample_image_to_target. All this does is change the resolution of the image to the same of orig
+    # ========================================
+
+    start = time.time()
+
+    # First we
+    # --- Pre-op
+
+    # extract the file name from the inputted folder path
+    ID_PreOP = os.path.basename(os.path.normpath(PreOP_Data_image))
+    ID_PreOP = ID_PreOP.split(".")[0]
+
+    # Create the folders the store the mri file
+    PreOP_Data_Folder=os.path.join(Output_Folder, ID_PreOP)
+    PreOP_Data_Folder_mri=os.path.join(PreOP_Data_Folder,'mri')
+
+    if not os.path.exists(PreOP_Data_Folder):
+        os.makedirs(PreOP_Data_Folder)
+        os.makedirs(PreOP_Data_Folder_mri)
+
+    PreOP_is_dicom = os.path.isdir(PreOP_Data_image)
+    PreOP_Data_image = Read_input_image(PreOP_Data_image)
+
+    if PreOP_is_dicom and Save_input_nifti:
+        Write_image(PreOP_Data_image, PreOP_Data_Folder+"/Input_image.nii.gz")
+
+    # resample the image into that of orig space
+    pre_op_fake=ants.resample_image_to_target(PreOP_Data_image,blank_orig)
+    Write_image(pre_op_fake, PreOP_Data_Folder_mri+"/orig.nii.gz")
+
+    ID_PostOP = os.path.basename(os.path.normpath(PostOP_Data_image))
+    ID_PostOP = ID_PostOP.split(".")[0]
+
+    # --- Post-op
+
+    # Create the folders the store the mri file
+    PostOP_Data_Folder=os.path.join(Output_Folder, ID_PostOP)
+    PostOP_Data_Folder_mri=os.path.join(PostOP_Data_Folder,'mri')
+
+    if not os.path.exists(PostOP_Data_Folder):
+        os.makedirs(PostOP_Data_Folder)
+        os.makedirs(PostOP_Data_Folder_mri)
+
+    PostOP_is_dicom = os.path.isdir(PostOP_Data_image)
+    PostOP_Data_image = Read_input_image(PostOP_Data_image)
+
+    if PostOP_is_dicom and Save_input_nifti:
+        Write_image(PostOP_Data_image, PostOP_Data_Folder+"/Input_image.nii.gz")
+
+    post_op_fake=ants.resample_image_to_target(PostOP_Data_image,blank_orig)
+    Write_image(post_op_fake, PostOP_Data_Folder_mri+"/orig.nii.gz")
+
+
+    end = time.time()
+
+    recorded_time=end-start
+    print(recorded_time)
+
+    Time_keeping = Add_section_time(Time_keeping, 'Fake_Orig', recorded_time)
+
+    # ========================================
+    # 2 - Refined skull stripping
+    # When using tools like ANTs and Atropos, it's crucial that images undergo skull stripping to remove any remaining skull. Failure to do so can lead to issues during processing. Additionally, FastSurfer results sometimes exhibit harshness around the resection area, potentially resulting in regions being falsely identified as "resected" due to artifacts from the skull stripping process. Through testing, it's been observed that employing mri_synthstrip with the --no-csf option can produce cleaner results with fewer skull fragments and smoother cuts around the resection area.
+    # What the next set of code allows is us to perform a brain extraction on the images that keeps the shape of the brain even if apart of it has been resected (keeps the resection cavity within the image but gets rid of any bits of skull or tissue that likes with the resection cavity).
+    # First N4bias the image to remove noise
+    # We achieve this by using mri_synthstrip to skull strip the image but trying to keep the pial surface intact.
+    # ========================================
+
+    start = time.time()
+
+    # Create the folders the store the N4bias file
+    N4Bias_folder=os.path.join(Output_Folder, "S1_N4bias")
+    PreOP_N4Bias_folder=os.path.join(N4Bias_folder,'Pre_op')
+    PostOP_N4Bias_folder=os.path.join(N4Bias_folder,'Post_op')
+
+    if not os.path.exists(N4Bias_folder):
+        os.makedirs(N4Bias_folder)
+        os.makedirs(PreOP_N4Bias_folder)
+        os.makedirs(PostOP_N4Bias_folder)
+
+    # N4_settings from RAMP_n4.Make_n4_settings, None is the default preset (the ANTsPy defaults)
+    Pre_op_N4Bias=Run_n4(pre_op_fake, N4_settings)
+    Write_image(Pre_op_N4Bias, PreOP_N4Bias_folder+"/Orig_N4bias.nii.gz")
+
+    Post_op_N4Bias=Run_n4(post_op_fake, N4_settings)
+    Write_image(Post_op_N4Bias, PostOP_N4Bias_folder+"/Orig_N4bias.nii.gz")
+
+    end = time.time()
+
+    recorded_time=end-start
+    print(recorded_time)
+
+    Time_keeping = Add_section_time(Time_keeping, 'N4bias', recorded_time)
+
+    ## ---- 2.2 Run mri_synthstrip ----
+    # Get mri_synthstrip version of the image - basically with the pial surface still attched, this is so we arnt doing a bet that goes deep within the resection cavity
+
+    start = time.time()
+
+    print("2.2.1 Pre-op mri_synthstrip")
+
+
+    mri_synthstrip_folder=os.path.join(Output_Folder, "S2_mri_synthstrip")
+    PreOP_mri_synthstrip_folder=os.path.join(mri_synthstrip_folder,'Pre_op')
+    PostOP_mri_synthstrip_folder=os.path.join(mri_synthstrip_folder,'Post_op')
+
+    if not os.path.exists(mri_synthstrip_folder):
+        os.makedirs(mri_synthstrip_folder)
+        os.makedirs(PreOP_mri_synthstrip_folder)
+        os.makedirs(PostOP_mri_synthstrip_folder)
+
+    # SynthStrip reads the N4 images from disk
+    Wait_for_writes(PreOP_N4Bias_folder+"/Orig_N4bias.nii.gz", PostOP_N4Bias_folder+"/Orig_N4bias.nii.gz")
+
+    # A crash, a hang or a missing output stops the stage here (see RAMP_tools.py)
+    Run_tool("mri_synthstrip", ['python3', mri_synthstrip, '-i', PreOP_N4Bias_folder+'/Orig_N4bias.nii.gz', '-o', PreOP_mri_synthstrip_folder+'/Orig_N4bias_synthstrip_B1.nii.gz', '-b', '1'], PreOP_mri_synthstrip_folder+'/mri_synthstrip.log', Outputs=[PreOP_mri_synthstrip_folder+'/Orig_N4bias_synthstrip_B1.nii.gz'], threads=Threads, Output_Folder=Output_Folder)
+
+    Run_tool("mri_synthstrip", ['python3', mri_synthstrip, '-i', PostOP_N4Bias_folder+'/Orig_N4bias.nii.gz', '-o', PostOP_mri_synthstrip_folder+'/Orig_N4bias_synthstrip_B1.nii.gz', '-b', '1'], PostOP_mri_synthstrip_folder+'/mri_synthstrip.log', Outputs=[PostOP_mri_synthstrip_folder+'/Orig_N4bias_synthstrip_B1.nii.gz'], threads=Threads, Output_Folder=Output_Folder)
+
+    end = time.time()
+
+    recorded_time=end-start
+    print(recorded_time)
+
+    Time_keeping = Add_section_time(Time_keeping, 'mri_synthstrip', recorded_time)
+
+    ## ---- 2.3 Run Synthseg ----
+    #  SynthSeg is a Deep learning tool for segmentation of brain scans of any contrast - It takes awhile to run but its produces a good segemention of the brain that we will use to group the atlas regions into lobes and additionally have a mask of the brain
+
+    start = time.time()
+
+    mri_synthseg_folder=os.path.join(Output_Folder, "S3_mri_synthseg")
+    PreOP_mri_synthseg_folder=os.path.join(mri_synthseg_folder,'Pre_op')
+    PostOP_mri_synthseg_folder=os.path.join(mri_synthseg_folder,'Post_op')
+
+    if not os.path.exists(mri_synthseg_folder):
+        os.makedirs(mri_synthseg_folder)
+        os.makedirs(PreOP_mri_synthseg_folder)
+        os.makedirs(PostOP_mri_synthseg_folder)
+
+
+    SynthSeg_threads = [] if Threads is None else ['--threads', str(Threads)]
+    if Synthseg_fast:
+        SynthSeg_threads = SynthSeg_threads + ['--fast']
+
+    Run_tool("SynthSeg", ['python', mri_synthseg, '--i', PreOP_mri_synthstrip_folder+'/Orig_N4bias_synthstrip_B1.nii.gz', '--o', PreOP_mri_synthseg_folder+'/PreOP_Sseg.nii.gz', '--parc'] + SynthSeg_threads, PreOP_mri_synthseg_folder+'/SynthSeg.log', Outputs=[PreOP_mri_synthseg_folder+'/PreOP_Sseg.nii.gz'], threads=Threads, Output_Folder=Output_Folder)
+
+    Run_tool("SynthSeg", ['python', mri_synthseg, '--i', PostOP_mri_synthstrip_folder+'/Orig_N4bias_synthstrip_B1.nii.gz', '--o', PostOP_mri_synthseg_folder+'/PostOP_Sseg.nii.gz', '--parc'] + SynthSeg_threads, PostOP_mri_synthseg_folder+'/SynthSeg.log', Outputs=[PostOP_mri_synthseg_folder+'/PostOP_Sseg.nii.gz'], threads=Threads, Output_Folder=Output_Folder)
+
+    # SynthSeg always segments at 1 mm, on any other grid the segmentations are put back onto the grid
+    if Orig_grid is not None:
+        for Sseg_file, The_grid_image in [(PreOP_mri_synthseg_folder+'/PreOP_Sseg.nii.gz', pre_op_fake), (PostOP_mri_synthseg_folder+'/PostOP_Sseg.nii.gz', post_op_fake)]:
+            The_sseg = ants.image_read(Sseg_file)
+            if The_sseg.shape != The_grid_image.shape or not np.allclose(The_sseg.spacing, The_grid_image.spacing) or not np.allclose(The_sseg.origin, The_grid_image.origin):
+                Write_image(ants.resample_image_to_target(The_sseg, The_grid_image, interp_type='genericLabel'), Sseg_file)
+
+        Wait_for_writes(PreOP_mri_synthseg_folder+'/PreOP_Sseg.nii.gz', PostOP_mri_synthseg_folder+'/PostOP_Sseg.nii.gz')
+
+    end = time.time()
+
+    recorded_time=end-start
+    print(recorded_time)
+
+    Time_keeping = Add_section_time(Time_keeping, 'mri_synthseg', recorded_time)
+
+    ## ---- 2.4.1 Use the Synthseg to remove pial surface ----
+
+    start = time.time()
+
+    Skull_strip_folder=os.path.join(Output_Folder, "S4_Skull_strip")
+    PreOP_Skull_strip_folder=os.path.join(Skull_strip_folder,'Pre_op')
+    PostOP_Skull_strip_folder=os.path.join(Skull_strip_folder,'Post_op')
+
+    if not os.path.exists(Skull_strip_folder):
+        os.makedirs(Skull_strip_folder)
+        os.makedirs(PreOP_Skull_strip_folder)
+        os.makedirs(PostOP_Skull_strip_folder)
+
+    #Pre-op
+    # In the mri_synthseg region 24 relates to areas of CSF that we want to remove from the image
+
+    PreOP_Sseg_image = ants.image_read(PreOP_mri_synthseg_folder+'/PreOP_Sseg.nii.gz' )
+    PreOP_Orig_N4bias_synthstrip_B1 = ants.image_read(PreOP_mri_synthstrip_folder+'/Orig_N4bias_synthstrip_B1.nii.gz' )
+
+    # area 24 is the area outside the brain that we dont need
+    PreOP_Sseg_image_thr_24 = ants.threshold_image( PreOP_Sseg_image, 24, 24 )
+    Write_image(PreOP_Sseg_image_thr_24, PreOP_mri_synthseg_folder+"/PreOP_Sseg_area_24.nii.gz")
+    PreOP_Sseg_MASK = ants.get_mask(PreOP_Sseg_image,low_thresh=1,cleanup=0)
+    PreOP_Sseg_MASK = PreOP_Sseg_MASK - PreOP_Sseg_image_thr_24
+    Write_image(PreOP_Sseg_MASK, PreOP_mri_synthseg_folder+"/PreOP_Sseg_MASK.nii.gz.nii.gz")
+
+    PreOP_Orig_N4bias_synthstrip_B1_MUL_Sseg = PreOP_Orig_N4bias_synthstrip_B1 * PreOP_Sseg_MASK
+    Write_image(PreOP_Orig_N4bias_synthstrip_B1_MUL_Sseg, PreOP_Skull_strip_folder+"/Final_skullstriped_image.nii.gz")
+
+    ## ---- 2.4.2 Post-op synthseg - remove pial ----
+
+    PostOP_Sseg_image = ants.image_read(PostOP_mri_synthseg_folder+'/PostOP_Sseg.nii.gz' )
+    PostOP_Orig_N4bias_synthstrip_B1 = ants.image_read(PostOP_mri_synthstrip_folder+'/Orig_N4bias_synthstrip_B1.nii.gz' )
+
+    # area 24 is the area outside the brain that we dont need
+    PostOP_Sseg_image_thr_24 = ants.threshold_image( PostOP_Sseg_image, 24, 24 )
+    Write_image(PostOP_Sseg_image_thr_24, PostOP_mri_synthseg_folder+"/PostOP_Sseg_area_24.nii.gz")
+    PostOP_Sseg_MASK = ants.get_mask(PostOP_Sseg_image,low_thresh=1,cleanup=0)
+    PostOP_Sseg_MASK = PostOP_Sseg_MASK - PostOP_Sseg_image_thr_24
+    Write_image(PostOP_Sseg_MASK, PostOP_mri_synthseg_folder+"/PreOP_Sseg_MASK.nii.gz")
+
+    PostOP_Orig_N4bias_synthstrip_B1_MUL_Sseg = PostOP_Orig_N4bias_synthstrip_B1 * PostOP_Sseg_MASK
+    Write_image(PostOP_Orig_N4bias_synthstrip_B1_MUL_Sseg, PostOP_Skull_strip_folder+"/Final_skullstriped_image.nii.gz")
+
+    end = time.time()
+
+    recorded_time=end-start
+    print(recorded_time)
+    Time_keeping = Add_section_time(Time_keeping, 'remove_pial', recorded_time)
+
+
+    PreOP_Sseg_image = ants.image_read(PreOP_mri_synthseg_folder+'/PreOP_Sseg.nii.gz' )
+    PostOP_Sseg_image = ants.image_read(PostOP_mri_synthseg_folder+'/PostOP_Sseg.nii.gz' )
+
+
+    # ========================================
+    # 3 - Mask the lobes - Not resected and resected
+    # We know what lobe the resection has taken place so lets filter the area where the resection can take place to those lobes. To do this we need to group the regions from the segmentation into lobes, then dilate to get the white matter attached to those GM regions.
+    # ========================================
+
+    # Create folders we will store this sections outputs
+
+    start = time.time()
+
+    Lobe_template_folder=os.path.join(Output_Folder, "S5_Lobe_template")
+    PreOP_Lobe_template_folder=os.path.join(Lobe_template_folder,'Pre_op')
+    PostOP_Lobe_template_folder=os.path.join(Lobe_template_folder,'Post_op')
+
+    PreOP_Lobe_template_folder_Regions=os.path.join(PreOP_Lobe_template_folder,'Regions')
+    PreOP_Lobe_template_folder_Lobes=os.path.join(PreOP_Lobe_template_folder,'Lobes')
+    PreOP_Lobe_template_folder_Dilation=os.path.join(PreOP_Lobe_template_folder,'Dilation')
+
+    PostOP_Lobe_template_folder_Regions=os.path.join(PostOP_Lobe_template_folder,'Regions')
+    PostOP_Lobe_template_folder_Lobes=os.path.join(PostOP_Lobe_template_folder,'Lobes')
+    PostOP_Lobe_template_folder_Dilation=os.path.join(PostOP_Lobe_template_folder,'Dilation')
+
+    if not os.path.exists(Lobe_template_folder):
+        os.makedirs(Lobe_template_folder)
+        os.makedirs(PreOP_Lobe_template_folder)
+        os.makedirs(PostOP_Lobe_template_folder)
+
+        os.makedirs(PreOP_Lobe_template_folder_Regions)
+        os.makedirs(PreOP_Lobe_template_folder_Lobes)
+        os.makedirs(PreOP_Lobe_template_folder_Dilation)
+
+        os.makedirs(PostOP_Lobe_template_folder_Regions)
+        os.makedirs(PostOP_Lobe_template_folder_Lobes)
+        os.makedirs(PostOP_Lobe_template_folder_Dilation)
+
+    # Pre FRONTAL
+    threshold = []
+    #frontal = sum(ants.threshold_image(, threshold, threshold) for threshold in thresholds)
+    Pre_Left_Frontal =  ants.threshold_image( PreOP_Sseg_image, 1002, 1002 ) + ants.threshold_image( PreOP_Sseg_image, 1003, 1003 )+ ants.threshold_image( PreOP_Sseg_image, 1012, 1012 )+ ants.threshold_image( PreOP_Sseg_image, 1014, 1014 ) + ants.threshold_image( PreOP_Sseg_image, 1017, 1017 ) + ants.threshold_image( PreOP_Sseg_image, 1018, 1018 ) + ants.threshold_image( PreOP_Sseg_image, 1019, 1019 ) + ants.threshold_image( PreOP_Sseg_image, 1020, 1020 ) + ants.threshold_image( PreOP_Sseg_image, 1024, 1024 ) + ants.threshold_image( PreOP_Sseg_image, 1026, 1026 ) + ants.threshold_image( PreOP_Sseg_image, 1027, 1027 ) + ants.threshold_image( PreOP_Sseg_image, 1028, 1028 ) + ants.threshold_image( PreOP_Sseg_image, 1032, 1032 )
+    Pre_Left_Frontal = ants.get_mask(Pre_Left_Frontal,low_thresh=1,cleanup=0) * 11
+    Write_image(Pre_Left_Frontal, PreOP_Lobe_template_folder_Lobes+"/Pre_Left_Frontal.nii.gz")
+
+    Pre_Right_Frontal = ants.threshold_image( PreOP_Sseg_image, 2002, 2002 )+ ants.threshold_image( PreOP_Sseg_image, 2003, 2003 )+ ants.threshold_image( PreOP_Sseg_image, 2012, 2012 )+ ants.threshold_image( PreOP_Sseg_image, 2014, 2014 )+ ants.threshold_image( PreOP_Sseg_image, 2017, 2017 )+ ants.threshold_image( PreOP_Sseg_image, 2018, 2018 )+ ants.threshold_image( PreOP_Sseg_image, 2019, 2019 )+ ants.threshold_image( PreOP_Sseg_image, 2020, 2020 )+ ants.threshold_image( PreOP_Sseg_image, 2024, 2024 )+ ants.threshold_image( PreOP_Sseg_image, 2026, 2026 )+ ants.threshold_image( PreOP_Sseg_image, 2027, 2027 )+ ants.threshold_image( PreOP_Sseg_image, 2028, 2028 )+ ants.threshold_image( PreOP_Sseg_image, 2032, 2032 )
+    Pre_Right_Frontal = ants.get_mask(Pre_Right_Frontal,low_thresh=1,cleanup=0) * 21
+    Write_image(Pre_Right_Frontal, PreOP_Lobe_template_folder_Lobes+"/Pre_Right_Frontal.nii.gz")
+
+    Post_Left_Frontal = ants.threshold_image( PostOP_Sseg_image, 1002, 1002 ) + ants.threshold_image( PostOP_Sseg_image, 1003, 1003 ) + ants.threshold_image( PostOP_Sseg_image, 1012, 1012 ) + ants.threshold_image( PostOP_Sseg_image, 1014, 1014 ) + ants.threshold_image( PostOP_Sseg_image, 1017, 1017 ) + ants.threshold_image( PostOP_Sseg_image, 1018, 1018 ) + ants.threshold_image( PostOP_Sseg_image, 1019, 1019 ) + ants.threshold_image( PostOP_Sseg_image, 1020, 1020 ) + ants.threshold_image( PostOP_Sseg_image, 1024, 1024 ) + ants.threshold_image( PostOP_Sseg_image, 1026, 1026 ) + ants.threshold_image( PostOP_Sseg_image, 1027, 1027 ) + ants.threshold_image( PostOP_Sseg_image, 1028, 1028 ) + ants.threshold_image( PostOP_Sseg_image, 1032, 1032 )
+    Post_Left_Frontal = ants.get_mask(Post_Left_Frontal,low_thresh=1,cleanup=0) * 11
+    Write_image(Post_Left_Frontal, PostOP_Lobe_template_folder_Lobes+"/Post_Left_Frontal.nii.gz")
+
+    Post_Right_Frontal =  ants.threshold_image( PostOP_Sseg_image, 2002, 2002 ) + ants.threshold_image( PostOP_Sseg_image, 2003, 2003 ) + ants.threshold_image( PostOP_Sseg_image, 2012, 2012 ) + ants.threshold_image( PostOP_Sseg_image, 2014, 2014 ) + ants.threshold_image( PostOP_Sseg_image, 2017, 2017 ) + ants.threshold_image( PostOP_Sseg_image, 2018, 2018 ) + ants.threshold_image( PostOP_Sseg_image, 2019, 2019 ) + ants.threshold_image( PostOP_Sseg_image, 2020, 2020 ) + ants.threshold_image( PostOP_Sseg_image, 2024, 2024 ) + ants.threshold_image( PostOP_Sseg_image, 2026, 2026 ) + ants.threshold_image( PostOP_Sseg_image, 2027, 2027 ) + ants.threshold_image( PostOP_Sseg_image, 2028, 2028 ) + ants.threshold_image( PostOP_Sseg_image, 2032, 2032 )
+    Post_Right_Frontal = ants.get_mask(Post_Right_Frontal,low_thresh=1,cleanup=0) * 21
+    Write_image(Post_Right_Frontal, PostOP_Lobe_template_folder_Lobes+"/Post_Right_Frontal.nii.gz")
+
+    Pre_Left_Parietal = ants.threshold_image( PreOP_Sseg_image, 1008, 1008 ) + ants.threshold_image( PreOP_Sseg_image, 1010, 1010 ) + ants.threshold_image( PreOP_Sseg_image, 1022, 1022 ) + ants.threshold_image( PreOP_Sseg_image, 1023, 1023 ) + ants.threshold_image( PreOP_Sseg_image, 1029, 1029 ) + ants.threshold_image( PreOP_Sseg_image, 1031, 1031 )
+    Pre_Left_Parietal = ants.get_mask(Pre_Left_Parietal,low_thresh=1,cleanup=0) * 12
+    Write_image(Pre_Left_Parietal, PreOP_Lobe_template_folder_Lobes+"/Pre_Left_Parietal.nii.gz")
+
+    Pre_Right_Parietal = ants.threshold_image( PreOP_Sseg_image, 2008, 2008 ) + ants.threshold_image( PreOP_Sseg_image, 2010, 2010 ) + ants.threshold_image( PreOP_Sseg_image, 2022, 2022 ) + ants.threshold_image( PreOP_Sseg_image, 2023, 2023 ) + ants.threshold_image( PreOP_Sseg_image, 2029, 2029 ) + ants.threshold_image( PreOP_Sseg_image, 2031, 2031 )
+    Pre_Right_Parietal = ants.get_mask(Pre_Right_Parietal,low_thresh=1,cleanup=0) * 22
+    Write_image(Pre_Right_Parietal, PreOP_Lobe_template_folder_Lobes+"/Pre_Right_Parietal.nii.gz")
+
+    Post_Left_Parietal = ants.threshold_image( PostOP_Sseg_image, 1008, 1008 ) + ants.threshold_image( PostOP_Sseg_image, 1010, 1010 ) + ants.threshold_image( PostOP_Sseg_image, 1022, 1022 ) + ants.threshold_image( PostOP_Sseg_image, 1023, 1023 ) + ants.threshold_image( PostOP_Sseg_image, 1029, 1029 ) + ants.threshold_image( PostOP_Sseg_image, 1031, 1031 )
+    Post_Left_Parietal = ants.get_mask(Post_Left_Parietal,low_thresh=1,cleanup=0) * 12
+    Write_image(Post_Left_Parietal, PostOP_Lobe_template_folder_Lobes+"/Post_Left_Parietal.nii.gz")
+
+    Post_Right_Parietal = ants.threshold_image( PostOP_Sseg_image, 2008, 2008 ) + ants.threshold_image( PostOP_Sseg_image, 2010, 2010 ) + ants.threshold_image( PostOP_Sseg_image, 2022, 2022 ) + ants.threshold_image( PostOP_Sseg_image, 2023, 2023 ) + ants.threshold_image( PostOP_Sseg_image, 2029, 2029 ) + ants.threshold_image( PostOP_Sseg_image, 2031, 2031 )
+    Post_Right_Parietal = ants.get_mask(Post_Right_Parietal,low_thresh=1,cleanup=0) * 22
+    Write_image(Post_Right_Parietal, PostOP_Lobe_template_folder_Lobes+"/Post_Right_Parietal.nii.gz")
+
+
+    Pre_Left_Temporal = ants.threshold_image( PreOP_Sseg_image, 1001, 1001 ) + ants.threshold_image( PreOP_Sseg_image, 1006, 1006 ) + ants.threshold_image( PreOP_Sseg_image, 1007, 1007 ) + ants.threshold_image( PreOP_Sseg_image, 1009, 1009 ) + ants.threshold_image( PreOP_Sseg_image, 1015, 1015 ) + ants.threshold_image( PreOP_Sseg_image, 1016, 1016 ) + ants.threshold_image( PreOP_Sseg_image, 1030, 1030 ) + ants.threshold_image( PreOP_Sseg_image, 1033, 1033 ) + ants.threshold_image( PreOP_Sseg_image, 1034, 1034 )
+    Pre_Left_Temporal = ants.get_mask(Pre_Left_Temporal,low_thresh=1,cleanup=0) * 13
+    Write_image(Pre_Left_Temporal, PreOP_Lobe_template_folder_Lobes+"/Pre_Left_Temporal.nii.gz")
+
+    Pre_Right_Temporal = ants.threshold_image( PreOP_Sseg_image, 2001, 2001 ) + ants.threshold_image( PreOP_Sseg_image, 2006, 2006 ) + ants.threshold_image( PreOP_Sseg_image, 2007, 2007 ) + ants.threshold_image( PreOP_Sseg_image, 2009, 2009 ) + ants.threshold_image( PreOP_Sseg_image, 2015, 2015 ) + ants.threshold_image( PreOP_Sseg_image, 2016, 2016 ) + ants.threshold_image( PreOP_Sseg_image, 2030, 2030 ) + ants.threshold_image( PreOP_Sseg_image, 2033, 2033 ) + ants.threshold_image( PreOP_Sseg_image, 2034, 2034 )
+    Pre_Right_Temporal = ants.get_mask(Pre_Right_Temporal,low_thresh=1,cleanup=0) * 23
+    Write_image(Pre_Right_Temporal, PreOP_Lobe_template_folder_Lobes+"/Pre_Right_Temporal.nii.gz")
+
+    Post_Left_Temporal =  ants.threshold_image( PostOP_Sseg_image, 1001, 1001 ) +  ants.threshold_image( PostOP_Sseg_image, 1006, 1006 ) +  ants.threshold_image( PostOP_Sseg_image, 1007, 1007 ) + ants.threshold_image( PostOP_Sseg_image, 1009, 1009 ) +  ants.threshold_image( PostOP_Sseg_image, 1015, 1015 ) + ants.threshold_image( PostOP_Sseg_image, 1016, 1016 ) + ants.threshold_image( PostOP_Sseg_image, 1030, 1030 ) + ants.threshold_image( PostOP_Sseg_image, 1033, 1033 ) + ants.threshold_image( PostOP_Sseg_image, 1034, 1034 )
+    Post_Left_Temporal = ants.get_mask(Post_Left_Temporal,low_thresh=1,cleanup=0) * 13
+    Write_image(Post_Left_Temporal, PostOP_Lobe_template_folder_Lobes+"/Post_Left_Temporal.nii.gz")
+
+    Post_Right_Temporal = ants.threshold_image( PostOP_Sseg_image, 2001, 2001 ) + ants.threshold_image( PostOP_Sseg_image, 2006, 2006 ) +  ants.threshold_image( PostOP_Sseg_image, 2007, 2007 ) +  ants.threshold_image( PostOP_Sseg_image, 2009, 2009 ) +  ants.threshold_image( PostOP_Sseg_image, 2015, 2015 ) +  ants.threshold_image( PostOP_Sseg_image, 2016, 2016 ) + ants.threshold_image( PostOP_Sseg_image, 2030, 2030 ) + ants.threshold_image( PostOP_Sseg_image, 2033, 2033 ) + ants.threshold_image( PostOP_Sseg_image, 2034, 2034 )
+    Post_Right_Temporal = ants.get_mask(Post_Right_Temporal,low_thresh=1,cleanup=0) * 23
+    Write_image(Post_Right_Temporal, PostOP_Lobe_template_folder_Lobes+"/Post_Right_Temporal.nii.gz")
+
+    Pre_Left_Occipital = ants.threshold_image( PreOP_Sseg_image, 1005, 1005 ) + ants.threshold_image( PreOP_Sseg_image, 1011, 1011 ) + ants.threshold_image( PreOP_Sseg_image, 1013, 1013 ) + ants.threshold_image( PreOP_Sseg_image, 1021, 1021 ) + ants.threshold_image( PreOP_Sseg_image, 1025, 1025 )
+    Pre_Left_Occipital = ants.get_mask(Pre_Left_Occipital,low_thresh=1,cleanup=0) * 14
+    Write_image(Pre_Left_Occipital, PreOP_Lobe_template_folder_Lobes+"/Pre_Left_Occipital.nii.gz")
+
+    Pre_Right_Occipital = ants.threshold_image( PreOP_Sseg_image, 2005, 2005 ) + ants.threshold_image( PreOP_Sseg_image, 2011, 2011 ) + ants.threshold_image( PreOP_Sseg_image, 2013, 2013 ) + ants.threshold_image( PreOP_Sseg_image, 2021, 2021 ) + ants.threshold_image( PreOP_Sseg_image, 2025, 2025 )
+    Pre_Right_Occipital = ants.get_mask(Pre_Right_Occipital,low_thresh=1,cleanup=0) * 24
+    Write_image(Pre_Right_Occipital, PreOP_Lobe_template_folder_Lobes+"/Pre_Right_Occipital.nii.gz")
+
+    Post_Left_Occipital = ants.threshold_image( PostOP_Sseg_image, 1005, 1005 ) + ants.threshold_image( PostOP_Sseg_image, 1011, 1011 ) + ants.threshold_image( PostOP_Sseg_image, 1013, 1013 ) + ants.threshold_image( PostOP_Sseg_image, 1021, 1021 ) + ants.threshold_image( PostOP_Sseg_image, 1025, 1025 )
+    Post_Left_Occipital = ants.get_mask(Post_Left_Occipital,low_thresh=1,cleanup=0) * 14
+    Write_image(Post_Left_Occipital, PostOP_Lobe_template_folder_Lobes+"/Post_Left_Occipital.nii.gz")
+
+    Post_Right_Occipital = ants.threshold_image( PostOP_Sseg_image, 2005, 2005 ) + ants.threshold_image( PostOP_Sseg_image, 2011, 2011 ) + ants.threshold_image( PostOP_Sseg_image, 2013, 2013 ) + ants.threshold_image( PostOP_Sseg_image, 2021, 2021 ) + ants.threshold_image( PostOP_Sseg_image, 2025, 2025 )
+    Post_Right_Occipital = ants.get_mask(Post_Right_Occipital,low_thresh=1,cleanup=0) * 24
+    Write_image(Post_Right_Occipital, PostOP_Lobe_template_folder_Lobes+"/Post_Right_Occipital.nii.gz")
+
+    Pre_Left_Insula = ants.threshold_image( PreOP_Sseg_image, 1035, 1035 )
+    Pre_Left_Insula = ants.get_mask(Pre_Left_Insula,low_thresh=1,cleanup=0) * 15
+    Write_image(Pre_Left_Insula, PreOP_Lobe_template_folder_Lobes+"/Pre_Left_Insula.nii.gz")
+
+    Pre_Right_Insula = ants.threshold_image( PreOP_Sseg_image, 2035, 2035 )
+    Pre_Right_Insula = ants.get_mask(Pre_Right_Insula,low_thresh=1,cleanup=0) * 25
+    Write_image(Pre_Right_Insula, PreOP_Lobe_template_folder_Lobes+"/Pre_Right_Insula.nii.gz")
+
+    Post_Left_Insula = ants.threshold_image( PostOP_Sseg_image, 1035, 1035 )
+    Post_Left_Insula = ants.get_mask(Post_Left_Insula,low_thresh=1,cleanup=0) * 15
+    Write_image(Post_Left_Insula, PostOP_Lobe_template_folder_Lobes+"/Post_Left_Insula.nii.gz")
+
+    Post_Right_Insula = ants.threshold_image( PostOP_Sseg_image, 2035, 2035 )
+    Post_Right_Insula = ants.get_mask(Post_Right_Insula,low_thresh=1,cleanup=0) * 25
+    Write_image(Post_Right_Insula, PostOP_Lobe_template_folder_Lobes+"/Post_Right_Insula.nii.gz")
+
+
+    Pre_left_Sub_Cortical = ants.threshold_image( PreOP_Sseg_image, 10, 10 ) + ants.threshold_image( PreOP_Sseg_image, 11, 11 ) +  ants.threshold_image( PreOP_Sseg_image, 12, 12 ) +  ants.threshold_image( PreOP_Sseg_image, 13, 13 ) +  ants.threshold_image( PreOP_Sseg_image, 17, 17 ) +  ants.threshold_image( PreOP_Sseg_image, 18, 18 ) +  ants.threshold_image( PreOP_Sseg_image, 26, 26 ) +  ants.threshold_image( PreOP_Sseg_image, 28, 28 )
+    Pre_left_Sub_Cortical = ants.get_mask(Pre_left_Sub_Cortical,low_thresh=1,cleanup=0) * 16
+    Write_image(Pre_left_Sub_Cortical, PreOP_Lobe_template_folder_Lobes+"/Pre_left_Sub_Cortical.nii.gz")
+
+    Pre_right_Sub_Cortical = ants.threshold_image( PreOP_Sseg_image, 49, 49 ) + ants.threshold_image( PreOP_Sseg_image, 50, 50 ) + ants.threshold_image( PreOP_Sseg_image, 51, 51 ) + ants.threshold_image( PreOP_Sseg_image, 52, 52 ) + ants.threshold_image( PreOP_Sseg_image, 53, 53 ) + ants.threshold_image( PreOP_Sseg_image, 54, 54 ) +  ants.threshold_image( PreOP_Sseg_image, 58, 58 ) + ants.threshold_image( PreOP_Sseg_image, 60, 60 )
+    Pre_right_Sub_Cortical = ants.get_mask(Pre_right_Sub_Cortical,low_thresh=1,cleanup=0) * 26
+    Write_image(Pre_right_Sub_Cortical, PreOP_Lobe_template_folder_Lobes+"/Pre_right_Sub_Cortical.nii.gz")
+
+    Post_left_Sub_Cortical = ants.threshold_image( PostOP_Sseg_image, 10, 10 ) + ants.threshold_image( PostOP_Sseg_image, 11, 11 ) + ants.threshold_image( PostOP_Sseg_image, 12, 12 ) + ants.threshold_image( PostOP_Sseg_image, 13, 13 ) + ants.threshold_image( PostOP_Sseg_image, 17, 17 ) + ants.threshold_image( PostOP_Sseg_image, 18, 18 ) + ants.threshold_image( PostOP_Sseg_image, 26, 26 ) +  ants.threshold_image( PostOP_Sseg_image, 28, 28 )
+    Post_left_Sub_Cortical = ants.get_mask(Post_left_Sub_Cortical,low_thresh=1,cleanup=0) * 16
+    Write_image(Post_left_Sub_Cortical, PostOP_Lobe_template_folder_Lobes+"/Post_left_Sub_Cortical.nii.gz")
+
+    Post_right_Sub_Cortical = ants.threshold_image( PostOP_Sseg_image, 49, 49 ) + ants.threshold_image( PostOP_Sseg_image, 50, 50 ) + ants.threshold_image( PostOP_Sseg_image, 51, 51 ) + ants.threshold_image( PostOP_Sseg_image, 52, 52 ) + ants.threshold_image( PostOP_Sseg_image, 53, 53 ) + ants.threshold_image( PostOP_Sseg_image, 54, 54 ) + ants.threshold_image( PostOP_Sseg_image, 58, 58 ) + ants.threshold_image( PostOP_Sseg_image, 60, 60 )
+    Post_right_Sub_Cortical = ants.get_mask(Post_right_Sub_Cortical,low_thresh=1,cleanup=0) * 26
+    Write_image(Post_right_Sub_Cortical, PostOP_Lobe_template_folder_Lobes+"/Post_right_Sub_Cortical.nii.gz")
+
+
+    Pre_NO_GO = ants.threshold_image( PreOP_Sseg_image, 4, 4 ) + ants.threshold_image( PreOP_Sseg_image, 7, 7 ) + ants.threshold_image( PreOP_Sseg_image, 8, 8 ) + ants.threshold_image( PreOP_Sseg_image, 14, 14 ) + ants.threshold_image( PreOP_Sseg_image, 15, 15 ) + ants.threshold_image( PreOP_Sseg_image, 16, 16 ) + ants.threshold_image( PreOP_Sseg_image, 43, 43 ) + ants.threshold_image( PreOP_Sseg_image, 46, 46 ) + ants.threshold_image( PreOP_Sseg_image, 47, 47 )
+    Pre_NO_GO = ants.get_mask(Pre_NO_GO,low_thresh=1,cleanup=0) * 50
+    Write_image(Pre_NO_GO, PreOP_Lobe_template_folder_Lobes+"/Pre_NO_GO.nii.gz")
+
+    Post_NO_GO = ants.threshold_image( PostOP_Sseg_image, 4, 4 ) + ants.threshold_image( PostOP_Sseg_image, 7, 7 ) + ants.threshold_image( PostOP_Sseg_image, 8, 8 ) + ants.threshold_image( PostOP_Sseg_image, 14, 14 ) + ants.threshold_image( PostOP_Sseg_image, 15, 15 ) + ants.threshold_image( PostOP_Sseg_image, 16, 16 ) + ants.threshold_image( PostOP_Sseg_image, 43, 43 ) + ants.threshold_image( PostOP_Sseg_image, 46, 46 ) + ants.threshold_image( PostOP_Sseg_image, 47, 47 )
+    Post_NO_GO = ants.get_mask(Post_NO_GO,low_thresh=1,cleanup=0) * 50
+    Write_image(Post_NO_GO, PostOP_Lobe_template_folder_Lobes+"/Post_NO_GO.nii.gz")
+
+    # ========================================
+    # 3 - Mask the lobes - Not resected and resected
+    # We know what lobe the resection has taken place so lets filter the area where the resection can take place to those lobes. To do this we need to group the regions from the segmentation into lobes, then dilate to get the white matter attached to those GM regions.
+    # ========================================
+
+    # Create folders we will store this sections outputs
+
+    start = time.time()
+
+    Lobe_template_folder=os.path.join(Output_Folder, "S5_Lobe_template")
+    PreOP_Lobe_template_folder=os.path.join(Lobe_template_folder,'Pre_op')
+    PostOP_Lobe_template_folder=os.path.join(Lobe_template_folder,'Post_op')
+
+    PreOP_Lobe_template_folder_Regions=os.path.join(PreOP_Lobe_template_folder,'Regions')
+    PreOP_Lobe_template_folder_Lobes=os.path.join(PreOP_Lobe_template_folder,'Lobes')
+    PreOP_Lobe_template_folder_Dilation=os.path.join(PreOP_Lobe_template_folder,'Dilation')
+
+    PostOP_Lobe_template_folder_Regions=os.path.join(PostOP_Lobe_template_folder,'Regions')
+    PostOP_Lobe_template_folder_Lobes=os.path.join(PostOP_Lobe_template_folder,'Lobes')
+    PostOP_Lobe_template_folder_Dilation=os.path.join(PostOP_Lobe_template_folder,'Dilation')
+
+    if not os.path.exists(Lobe_template_folder):
+        os.makedirs(Lobe_template_folder)
+        os.makedirs(PreOP_Lobe_template_folder)
+        os.makedirs(PostOP_Lobe_template_folder)
+
+        os.makedirs(PreOP_Lobe_template_folder_Regions)
+        os.makedirs(PreOP_Lobe_template_folder_Lobes)
+        os.makedirs(PreOP_Lobe_template_folder_Dilation)
+
+        os.makedirs(PostOP_Lobe_template_folder_Regions)
+        os.makedirs(PostOP_Lobe_template_folder_Lobes)
+        os.makedirs(PostOP_Lobe_template_folder_Dilation)
+
+    # "-- 3.3.8 Combind-Image --"
+    PreOP_Lobe_Atlas = Pre_Left_Frontal + Pre_Right_Frontal + Pre_Left_Parietal + Pre_Right_Parietal + Pre_Left_Temporal + Pre_Right_Temporal + Pre_Left_Occipital + Pre_Right_Occipital + Pre_Left_Insula + Pre_Right_Insula + Pre_left_Sub_Cortical + Pre_right_Sub_Cortical + Pre_NO_GO
+    Write_image(PreOP_Lobe_Atlas, PreOP_Lobe_template_folder_Lobes+"/PreOP_Lobe_Atlas.nii.gz")
+
+    PreOP_Lobe_Atlas_WITHOUT_NG = Pre_Left_Frontal + Pre_Right_Frontal + Pre_Left_Parietal + Pre_Right_Parietal + Pre_Left_Temporal + Pre_Right_Temporal + Pre_Left_Occipital + Pre_Right_Occipital + Pre_Left_Insula + Pre_Right_Insula + Pre_left_Sub_Cortical + Pre_right_Sub_Cortical
+    Write_image(PreOP_Lobe_Atlas_WITHOUT_NG, PreOP_Lobe_template_folder_Lobes+"/PreOP_Lobe_Atlas_Without_NG.nii.gz")
+
+
+    PostOP_Lobe_Atlas = Post_Left_Frontal + Post_Right_Frontal + Post_Left_Parietal + Post_Right_Parietal + Post_Left_Temporal + Post_Right_Temporal + Post_Left_Occipital + Post_Right_Occipital + Post_Left_Insula + Post_Right_Insula + Post_left_Sub_Cortical + Post_right_Sub_Cortical + Post_NO_GO
+    Write_image(PostOP_Lobe_Atlas, PostOP_Lobe_template_folder_Lobes+"/PostOP_Lobe_Atlas.nii.gz")
+
+    PostOP_Lobe_Atlas_WITHOUT_NG = Post_Left_Frontal + Post_Right_Frontal + Post_Left_Parietal + Post_Right_Parietal + Post_Left_Temporal + Post_Right_Temporal + Post_Left_Occipital + Post_Right_Occipital + Post_Left_Insula + Post_Right_Insula + Post_left_Sub_Cortical + Post_right_Sub_Cortical
+    Write_image(PostOP_Lobe_Atlas_WITHOUT_NG, PreOP_Lobe_template_folder_Lobes+"/PostOP_Lobe_Atlas_Without_NG.nii.gz")
+
+    end = time.time()
+
+    recorded_time=end-start
+    print(recorded_time)
+    Time_keeping = Add_section_time(Time_keeping, 'Group_lobes', recorded_time)
+
+    # "---- 3.4 Dilation-Image ----"
+
+    Wait_for_writes(PreOP_Lobe_template_folder_Lobes+"/PreOP_Lobe_Atlas_Without_NG.nii.gz", PreOP_Lobe_template_folder_Lobes+"/PostOP_Lobe_Atlas_Without_NG.nii.gz")
+
+    PRE_Lobe_dilation_img_data = nib.load(PreOP_Lobe_template_folder_Lobes+"/PreOP_Lobe_Atlas_Without_NG.nii.gz")
+    PRE_Lobe_dilation_img = PRE_Lobe_dilation_img_data.get_fdata()
+    PRE_Lobe_dilation_img[PRE_Lobe_dilation_img==0] = np.nan
+
+    invalid=None
+    if invalid is None: invalid = np.isnan(PRE_Lobe_dilation_img)
+    idx = nd.distance_transform_edt(invalid, return_distances=False, return_indices=True)
+    PRE_Lobe_dilation_img = PRE_Lobe_dilation_img[tuple(idx)]
+
+    PRE_save = nib.Nifti1Image(PRE_Lobe_dilation_img,PRE_Lobe_dilation_img_data.affine,PRE_Lobe_dilation_img_data.header)
+    Write_image(PRE_save, PreOP_Lobe_template_folder_Dilation+"/PreOP_ATLAS_DIL.nii.gz")
+
+    Wait_for_writes(PreOP_Lobe_template_folder_Dilation+"/PreOP_ATLAS_DIL.nii.gz")
+    PreOP_ATLAS_DIL = ants.image_read(PreOP_Lobe_template_folder_Dilation+"/PreOP_ATLAS_DIL.nii.gz" )
+
+    Pre_NO_GO_Mask = ants.get_mask(Pre_NO_GO,low_thresh=1,cleanup=0) * 1
+
+    PreOP_ATLAS_DIL_NO_GO = PreOP_ATLAS_DIL * Pre_NO_GO_Mask
+    PreOP_ATLAS_DIL = PreOP_ATLAS_DIL - PreOP_ATLAS_DIL_NO_GO
+    PreOP_ATLAS_DIL = PreOP_ATLAS_DIL + Pre_NO_GO
+    Write_image(PreOP_ATLAS_DIL, PreOP_Lobe_template_folder_Dilation+"/PreOP_ATLAS_DIL.nii.gz")
+
+
+    POST_Lobe_dilation_img_data = nib.load(PreOP_Lobe_template_folder_Lobes+"/PostOP_Lobe_Atlas_Without_NG.nii.gz")
+    POST_Lobe_dilation_img = POST_Lobe_dilation_img_data.get_fdata()
+    POST_Lobe_dilation_img[POST_Lobe_dilation_img==0] = np.nan
+
+    invalid=None
+    if invalid is None: invalid = np.isnan(POST_Lobe_dilation_img)
+    idx = nd.distance_transform_edt(invalid, return_distances=False, return_indices=True)
+    POST_Lobe_dilation_img = POST_Lobe_dilation_img[tuple(idx)]
+
+    POST_save = nib.Nifti1Image(POST_Lobe_dilation_img,POST_Lobe_dilation_img_data.affine,POST_Lobe_dilation_img_data.header)
+    Write_image(POST_save, PostOP_Lobe_template_folder_Dilation+"/PostOP_ATLAS_DIL.nii.gz")
+
+    Wait_for_writes(PostOP_Lobe_template_folder_Dilation+"/PostOP_ATLAS_DIL.nii.gz")
+    PostOP_ATLAS_DIL = ants.image_read(PostOP_Lobe_template_folder_Dilation+"/PostOP_ATLAS_DIL.nii.gz" )
+
+    Post_NO_GO_Mask = ants.get_mask(Post_NO_GO,low_thresh=1,cleanup=0) * 1
+
+    PostOP_ATLAS_DIL_NO_GO = PostOP_ATLAS_DIL * Post_NO_GO_Mask
+    PostOP_ATLAS_DIL = PostOP_ATLAS_DIL - PostOP_ATLAS_DIL_NO_GO
+    PostOP_ATLAS_DIL = PostOP_ATLAS_DIL + Post_NO_GO
+    Write_image(PostOP_ATLAS_DIL, PostOP_Lobe_template_folder_Dilation+"/PostOP_ATLAS_DIL.nii.gz")
+
+    Wait_for_writes(PreOP_Lobe_template_folder_Dilation+"/PreOP_ATLAS_DIL.nii.gz")
+    PreOP_ATLAS_DIL = ants.image_read(PreOP_Lobe_template_folder_Dilation+"/PreOP_ATLAS_DIL.nii.gz" )
+    Wait_for_writes(PostOP_Lobe_template_folder_Dilation+"/PostOP_ATLAS_DIL.nii.gz")
+    PostOP_ATLAS_DIL = ants.image_read(PostOP_Lobe_template_folder_Dilation+"/PostOP_ATLAS_DIL.nii.gz" )
+
+    PreOP_ATLAS_DIL_FILTER = PreOP_ATLAS_DIL * PreOP_Sseg_MASK
+
+    PostOP_ATLAS_DIL_FILTER = PostOP_ATLAS_DIL * PostOP_Sseg_MASK
+
+    Write_image(PreOP_ATLAS_DIL_FILTER, PreOP_Lobe_template_folder_Dilation+"/PreOP_ATLAS_DIL_FILTER.nii.gz")
+    Write_image(PostOP_ATLAS_DIL_FILTER, PostOP_Lobe_template_folder_Dilation+"/PostOP_ATLAS_DIL_FILTER.nii.gz")
+
+    # echo "---- 3.5 Get the lobes where the resection took places ----"
+    # as we have a mask for each of the lobes lets make 2 new mask for each image
+    # feild_map_Resected_area which is a mask of all lobes a user specifies the resection takes place
+    # feild_map_NONE_Resected_area which is the lobes where resection didnt take place
+
+    start = time.time()
+
+    Lobe_of_resection=os.path.join(Output_Folder, "S6_Lobe_of_resection")
+
+    if not os.path.exists(Lobe_of_resection):
+        os.makedirs(Lobe_of_resection)
+
+    Pre_OP_feild_map_Resected_area, Post_OP_feild_map_Resected_area, PRE_the_none_resected_lobe, POST_the_none_resected_lobe = Make_resection_field_maps(PreOP_ATLAS_DIL_FILTER, PostOP_ATLAS_DIL_FILTER, PreOP_Sseg_MASK, PostOP_Sseg_MASK, Hemisphere, Lobe)
+
+    Write_image(Pre_OP_feild_map_Resected_area, Lobe_of_resection+"/PreOP_feildResection.nii.gz")
+    Write_image(Post_OP_feild_map_Resected_area, Lobe_of_resection+"/PostOP_feildResection.nii.gz")
+
+    Write_image(PRE_the_none_resected_lobe, Lobe_of_resection+"/PreOP_NONE_feildResection.nii.gz")
+    Write_image(POST_the_none_resected_lobe, Lobe_of_resection+"/PostOP_NONE_feildResection.nii.gz")
+
+    end = time.time()
+
+    recorded_time=end-start
+    print(recorded_time)
+    Time_keeping = Add_section_time(Time_keeping, 'The_resection_Lobe_mask', recorded_time)
+
+    # echo "---- 4.6 Get the Vents ----"
+
+    start = time.time()
+
+    Get_ventricles=os.path.join(Output_Folder, "S7_Get_ventricles")
+
+    if not os.path.exists(Get_ventricles):
+        os.makedirs(Get_ventricles)
+
+    # PreOP
+    PreOP_Sseg_image_thr_43 = ants.threshold_image( PreOP_Sseg_image, 43, 43 )
+    PreOP_Sseg_image_thr_4 = ants.threshold_image( PreOP_Sseg_image, 4, 4 )
+
+    PreOP_ventricles = PreOP_Sseg_image_thr_43 + PreOP_Sseg_image_thr_4
+    PreOP_ventricles = ants.get_mask(PreOP_ventricles,low_thresh=1,cleanup=0) * 1
+
+
+    PostOP_Sseg_image_thr_43 = ants.threshold_image( PostOP_Sseg_image, 43, 43 )
+    PostOP_Sseg_image_thr_4 = ants.threshold_image( PostOP_Sseg_image, 4, 4 )
+
+    PostOP_ventricles = PostOP_Sseg_image_thr_43 + PostOP_Sseg_image_thr_4
+    PostOP_ventricles = ants.get_mask(PostOP_ventricles,low_thresh=1,cleanup=0) * 1
+
+    Write_image(PreOP_ventricles, Get_ventricles+"/PreOP_ventricles.nii.gz")
+    Write_image(PostOP_ventricles, Get_ventricles+"/PostOP_ventricles.nii.gz")
+
+    end = time.time()
+    recorded_time=end-start
+    print(recorded_time)
+    Time_keeping = Add_section_time(Time_keeping, 'Get_ventricles', recorded_time)
+
+    # ========================================
+    # 5 - Try and manually remove hyperintesity
+    # So we want to make sure that we have removed hyper intestity and its normally only one or two voxels so lets swap the top 1% with the median
+    # ========================================
+
+    start = time.time()
+
+    RemoveHyper=os.path.join(Output_Folder, "S8_RemoveHyper")
+
+    if not os.path.exists(RemoveHyper):
+        os.makedirs(RemoveHyper)
+
+    Wait_for_writes(PreOP_Skull_strip_folder+"/Final_skullstriped_image.nii.gz", PostOP_Skull_strip_folder+"/Final_skullstriped_image.nii.gz")
+    PreOP_Final_skullstriped_image_for_THR = nib.load(PreOP_Skull_strip_folder+"/Final_skullstriped_image.nii.gz")
+    PreOP_Final_skullstriped_image_for_THR_fdata = PreOP_Final_skullstriped_image_for_THR.get_fdata()
+
+    Pre_99 = np.percentile( PreOP_Final_skullstriped_image_for_THR_fdata[np.nonzero(PreOP_Final_skullstriped_image_for_THR_fdata)] , 99)
+    Pre_50 = np.percentile(PreOP_Final_skullstriped_image_for_THR_fdata[np.nonzero(PreOP_Final_skullstriped_image_for_THR_fdata)] , 50)
+
+    PreOP_Final_skullstriped_image_for_THR_fdata[PreOP_Final_skullstriped_image_for_THR_fdata >= Pre_99] = Pre_50
+
+    PRE_save = nib.Nifti1Image(PreOP_Final_skullstriped_image_for_THR_fdata,PreOP_Final_skullstriped_image_for_THR.affine,PreOP_Final_skullstriped_image_for_THR.header)
+    Write_image(PRE_save, RemoveHyper+"/Pre_Final_skullstriped_image_Manual_remove_hyper.nii.gz")
+
+
+    PostOP_Final_skullstriped_image_for_THR = nib.load(PostOP_Skull_strip_folder+"/Final_skullstriped_image.nii.gz" )
+    PostOP_Final_skullstriped_image_for_THR_fdata = PostOP_Final_skullstriped_image_for_THR.get_fdata()
+
+    Post_99 = np.percentile( PostOP_Final_skullstriped_image_for_THR_fdata[np.nonzero(PostOP_Final_skullstriped_image_for_THR_fdata)] , 99)
+    Post_50 = np.percentile(PostOP_Final_skullstriped_image_for_THR_fdata[np.nonzero(PostOP_Final_skullstriped_image_for_THR_fdata)] , 50)
+
+    PostOP_Final_skullstriped_image_for_THR_fdata[PostOP_Final_skullstriped_image_for_THR_fdata >= Post_99] = Post_50
+
+    PostOP_save = nib.Nifti1Image(PostOP_Final_skullstriped_image_for_THR_fdata,PostOP_Final_skullstriped_image_for_THR.affine,PostOP_Final_skullstriped_image_for_THR.header)
+    Write_image(PostOP_save, RemoveHyper+"/Post_Final_skullstriped_image_Manual_remove_hyper.nii.gz")
+
+
+
+    end = time.time()
+    recorded_time=end-start
+    print(recorded_time)
+    Time_keeping = Add_section_time(Time_keeping, 'RemoveHyper', recorded_time)
+
+    Finish_writes()
+
+    Emit_event("stage_end", stage="preparation", output_folder=Output_Folder, seconds=round(time.time() - stage_start, 3))
+
+    Region_atlases = {"SynthSeg": PreOP_Sseg_image, "Lobe": PreOP_ATLAS_DIL_FILTER}
+
+    return PreOP_Data_image, Post_op_N4Bias, Region_atlases, Time_keeping
+
+# ========================================
+### REGISTRATION ---
+
+# Step 6, align the post-op image to the pre-op image
+# Initial_transform is a rigid transform (.mat) to start from, e.g. that of the preview (see RAMP_preview.py), the rigid
+# stage is then skipped and only the b-spline SyN is run
+# Registration_qc is what to do when the registration fails its check (off, warn, fail or retry, see RAMP_qc.py)
+# Strategies are the registration strategies to run (see RAMP_strategies.py), more than one are run at the same time with
+# Threads split between them and the best is used, only reg_br if None
+def Run_registration(Output_Folder, Time_keeping=None, Initial_transform=None, Registration_qc="off", Strategies=None, Threads=None):
+
+    stage_start = time.time()
+    Emit_event("stage_start", stage="registration", output_folder=Output_Folder)
+
+    if Time_keeping is None:
+        Time_keeping = New_time_keeping()
+
+    Start_writer()
+
+    # ===========================================
+    # REGISTRATION - THIS MAY TAKE A MOMENT
+    # ===========================================
+
+    # This is for the bash script - these variables will be consistent across all mask creation runs
+    # "---- Registration - rigid + deformable b-spline syn"
+
+    start = time.time()
+
+    Do_Registration=os.path.join(Output_Folder, "S9_Registration")
+
+    reg_br=os.path.join(Do_Registration, "reg_br")
+    reg_None_resected=os.path.join(Do_Registration, "reg_None_resected")
+    reg_None_resected_then_resected=os.path.join(Do_Registration, "reg_None_resected_then_resected")
+    reg_br_then_resected=os.path.join(Do_Registration, "reg_br_then_resected")
+
+    if not os.path.exists(Do_Registration):
+        os.makedirs(reg_br)
+        os.makedirs(reg_None_resected)
+        os.makedirs(reg_None_resected_then_resected)
+        os.makedirs(reg_br_then_resected)
+
+    The_strategies = Strategies or Default_strategies
+
+    if len(The_strategies) == 1:
+        The_inputs = Load_strategy_inputs(Output_Folder, Masks=any(Registration_strategies[The_strategies[0]]))
+
+        # reg_br is the folder of the registration that is used from here on
+        reg_br = Strategy_folder(Output_Folder, The_strategies[0])
+        antsRegistrationSyN_br = Register_strategy(The_strategies[0], The_inputs, reg_br, Initial_transform=Initial_transform, Threads=Threads)
+        # antsRegistrationSyN.image_write(Do_Registration+"/PostOP_ventricles.nii.gz",ri=True)
+
+        Write_image(antsRegistrationSyN_br['warpedmovout'], reg_br+"/warpedmovout.nii.gz")
+        Write_image(antsRegistrationSyN_br['warpedfixout'], reg_br+"/warpedfixout.nii.gz")
+
+        Write_selected_strategy(Output_Folder, The_strategies[0])
+    else:
+        reg_br = Run_strategies(Output_Folder, The_strategies, Threads=Threads, Initial_transform=Initial_transform)
+
+    end = time.time()
+    recorded_time=end-start
+    print(recorded_time)
+    Time_keeping = Add_section_time(Time_keeping, 'Regs', recorded_time)
+
+    # Check the registration before the cavity stage spends its time on it
+    if Registration_qc != "off":
+
+        start = time.time()
+
+        Wait_for_writes(reg_br+"/warpedmovout.nii.gz")
+        The_qc = Check_registration(Output_Folder)
+
+        if not The_qc["passed"] and Registration_qc == "retry":
+            print("> Registering again with " + Retry_transform)
+
+            # The chosen strategy again, with its masks and from the same initial transform as the first attempt, with the
+            # ITK threads of this process. Into its own folder so the first attempt is kept
+            Check_registration_threads(Threads)
+
+            The_selected, _ = Selected_strategy(Output_Folder)
+            reg_br = Retry_folder(Output_Folder, The_selected)
+            if not os.path.exists(reg_br):
+                os.makedirs(reg_br)
+
+            The_retry_inputs = Load_strategy_inputs(Output_Folder, Masks=any(Registration_strategies[The_selected]))
+
+            retry_start = time.time()
+            antsRegistrationSyN_br = Register_strategy(The_selected, The_retry_inputs, reg_br, Initial_transform=Initial_transform, Threads=Threads, Retry=True)
+            Write_image(antsRegistrationSyN_br['warpedmovout'], reg_br+"/warpedmovout.nii.gz")
+            Write_image(antsRegistrationSyN_br['warpedfixout'], reg_br+"/warpedfixout.nii.gz")
+
+            # The retry is the registration that is used from here on
+            Write_selected_strategy(Output_Folder, The_selected, retry=True)
+            Add_retry_row(Output_Folder, dict(Strategy=os.path.basename(reg_br), Time_SEC=time.time() - retry_start, Error=None, **Strategy_measures(The_retry_inputs, antsRegistrationSyN_br, reg_br)))
+
+            Wait_for_writes(reg_br+"/warpedmovout.nii.gz")
+            The_qc = Check_registration(Output_Folder, attempt=2)
+
+        end = time.time()
+        recorded_time=end-start
+        Time_keeping = Add_section_time(Time_keeping, 'Regs_QC', recorded_time)
+
+        if not The_qc["passed"] and Registration_qc in ["fail", "retry"]:
+            raise RuntimeError("The registration failed its check (" + ", ".join(The_qc["failed"]) + "), see " + Do_Registration + "/Registration_QC.json")
+
+    Finish_writes()
+
+    Emit_event("stage_end", stage="registration", output_folder=Output_Folder, seconds=round(time.time() - stage_start, 3))
+
+    return Time_keeping
+
+# ========================================
+### CREATION ---
+
+# Steps 7 to 14 (see RAMP_cavity.py) and the final outputs in the orig and PRE resolution
+# PreOP_Data_image is the pre-op input, either the image returned by Run_preparation or the path to the file (or DICOM folder)
+# Candidates is a list of (Hemisphere, Lobe) to try in place of the S6 feild maps, the best one is kept (see RAMP_hypothesis.py)
+# PostOP_N4bias_image is the N4 bias corrected post-op orig image returned by Run_preparation, if it is not given it is
+# read from S1_N4bias (the post-op input itself is not needed again)
+# Cavity_parameters changes the cavity parameters (see RAMP_cavity.py), Roi is a mask on the orig grid the resection is
+# looked for in (e.g. the dilated preview mask, see RAMP_preview.py), both are only used without Candidates
+# Region_atlases are the atlases returned by Run_preparation, those not given are read from the output folder
+def Run_cavity(Output_Folder, PreOP_Data_image, Time_keeping=None, Validate_narrow_band=False, Candidates=None, PostOP_N4bias_image=None, Cavity_parameters=None, Roi=None, Region_atlases=None):
+
+    stage_start = time.time()
+    Emit_event("stage_start", stage="cavity", output_folder=Output_Folder)
+
+    if Time_keeping is None:
+        Time_keeping = New_time_keeping()
+
+    Start_writer()
+
+    if isinstance(PreOP_Data_image, str):
+        PreOP_Data_image = Read_input_image(PreOP_Data_image)
+
+    # ===========================================
+    # Load what the mask creation needs
+    # ===========================================
+
+    start = time.time()
+
+    # The mask creation step only needs what has been written into the output folder so far (see RAMP_cavity.py)
+    if Candidates is None:
+        Cavity_inputs = Load_cavity_inputs(Output_Folder)
+
+        if Roi is not None:
+            Restrict_to_roi(Cavity_inputs, Roi)
+
+        PreOP_RemoveHyper = Cavity_inputs["PreOP_RemoveHyper"]
+        antsRegistrationSyN_br_transformlist = Cavity_inputs["antsRegistrationSyN_br_transformlist"]
+    else:
+        # RAMP_hypothesis.py loads its own
+        PreOP_RemoveHyper = ants.image_read(os.path.join(Output_Folder, "S8_RemoveHyper")+"/Pre_Final_skullstriped_image_Manual_remove_hyper.nii.gz")
+        reg_br=Registration_folder(Output_Folder)
+        antsRegistrationSyN_br_transformlist = [reg_br+"/br_1Warp.nii.gz" , reg_br+"/br_0GenericAffine.mat"]
+
+    # ===========================================
+    # make folders for making the resection masks
+    # ===========================================
+
+    Do_Resection_Mask=os.path.join(Output_Folder, "S10_Make_Resection_Mask")
+    Do_Resection_Mask_br=os.path.join(Do_Resection_Mask, "reg_br")
+    Do_Resection_Mask_reg_None_resected=os.path.join(Do_Resection_Mask, "reg_None_resected")
+    Do_Resection_Mask_reg_None_resected_then_resected=os.path.join(Do_Resection_Mask, "reg_None_resected_then_resected")
+    Do_Resection_Mask_reg_br_then_resected=os.path.join(Do_Resection_Mask, "reg_br_then_resected")
+
+    if not os.path.exists(Do_Resection_Mask):
+        os.makedirs(Do_Resection_Mask)
+        os.makedirs(Do_Resection_Mask_br)
+        os.makedirs(Do_Resection_Mask_reg_None_resected)
+        os.makedirs(Do_Resection_Mask_reg_None_resected_then_resected)
+        os.makedirs(Do_Resection_Mask_reg_br_then_resected)
+
+    The_Resection_Mask=os.path.join(Output_Folder, "S11_The_Resection_Mask")
+    The_Resection_Mask_br=os.path.join(The_Resection_Mask, "reg_br")
+    The_Resection_Mask_reg_None_resected=os.path.join(The_Resection_Mask, "reg_None_resected")
+    The_Resection_Mask_reg_None_resected_then_resected=os.path.join(The_Resection_Mask, "reg_None_resected_then_resected")
+    The_Resection_Mask_reg_br_then_resected=os.path.join(The_Resection_Mask, "reg_br_then_resected")
+
+    if not os.path.exists(The_Resection_Mask):
+        os.makedirs(The_Resection_Mask)
+        os.makedirs(The_Resection_Mask_br)
+        os.makedirs(The_Resection_Mask_reg_None_resected)
+        os.makedirs(The_Resection_Mask_reg_None_resected_then_resected)
+        os.makedirs(The_Resection_Mask_reg_br_then_resected)
+
+
+    Do_Resection_Mask_v2=os.path.join(Output_Folder, "S10_attempt2")
+    Do_Resection_Mask_br=os.path.join(Do_Resection_Mask_v2, "reg_br")
+    if not os.path.exists(Do_Resection_Mask_v2):
+        os.makedirs(Do_Resection_Mask_v2)
+        os.makedirs(Do_Resection_Mask_br)
+
+    # ===========================================
+    # Resection_Mask br
+    # ===========================================
+
+    if Candidates is None:
+        The_final_mask = Make_resection_mask(Cavity_inputs, Do_Resection_Mask_br, Cavity_parameters, Validate_narrow_band=Validate_narrow_band)
+    else:
+        The_best = Run_hypotheses(Output_Folder, Candidates, top=2, workers=max(1, min(2, (os.cpu_count() or 1) // 2)))
+
+        if The_best is None:
+            raise RuntimeError("None of the hemisphere / lobe candidates gave a resection mask")
+
+        # Keep the feild maps of the chosen hemisphere and lobe in S6 so the output folder matches the mask
+        Lobe_of_resection=os.path.join(Output_Folder, "S6_Lobe_of_resection")
+        for name in ["PreOP_feildResection", "PostOP_feildResection", "PreOP_NONE_feildResection", "PostOP_NONE_feildResection"]:
+            shutil.copyfile(os.path.join(os.path.dirname(The_best["Mask"]), name + ".nii.gz"), Lobe_of_resection + "/" + name + ".nii.gz")
+
+        print("> Hemisphere and lobe of resection --> " + The_best["Hemisphere"] + " " + The_best["Lobe"])
+
+        The_final_mask = ants.image_read(The_best["Mask"])
+
+    end = time.time()
+    recorded_time=end-start
+    print(recorded_time)
+    Time_keeping = Add_section_time(Time_keeping, 'Resection_mask', recorded_time)
+
+    start = time.time()
+
+    The_resection_mask_Final=os.path.join(Output_Folder, "RAMPS_Resection_Mask_Output")
+    if not os.path.exists(The_resection_mask_Final):
+        os.makedirs(The_resection_mask_Final)
+
+    N4Bias_folder=os.path.join(Output_Folder, "S1_N4bias")
+    PreOP_N4Bias_folder=os.path.join(N4Bias_folder,'Pre_op')
+    PostOP_N4Bias_folder=os.path.join(N4Bias_folder,'Post_op')
+
+    Write_image(The_final_mask, The_resection_mask_Final+"/RAMP_The_resection_mask_in_ORIG.nii.gz")
+
+    # The SynthSeg parcellation and the lobe atlas are on the orig grid too (see RAMP_regions.py)
+    The_region_volumes = Write_region_volumes(Output_Folder, The_final_mask, Region_atlases)
+    The_resected_lobes = The_region_volumes[(The_region_volumes["Atlas"] == "Lobe") & (The_region_volumes["Resected_voxels"] > 0)]
+    print("> Resection by lobe --> " + ", ".join(The_resected_lobes["Region"] + " " + The_resected_lobes["Resected_mm3"].astype(str) + " mm3 (" + The_resected_lobes["Percent_resected"].astype(str) + " %)"), flush=True)
+
+    # The orig images are the inputs resampled onto the fake orig grid (resample_image_to_target, no change in physical
+    # space), so going back from orig to the pre-op grid or from the post-op input to orig is only a change of grid and
+    # each output is interpolated once, from its source straight onto its grid
+    # - the mask, a label image, with multiLabel from orig onto the pre-op grid
+    # - the post-op images, intensities, with linear through the registration (multiLabel is for labels and is far slower),
+    #   both from the N4 bias corrected post-op orig so the two have the same intensities
+    The_final_mask_Pre_resolution=ants.resample_image_to_target(The_final_mask, PreOP_Data_image, interp_type='multiLabel')
+    Write_image(The_final_mask_Pre_resolution, The_resection_mask_Final+"/RAMP_The_resection_mask_in_PRE.nii.gz")
+
+    if PostOP_N4bias_image is None:
+        PostOP_image = ants.image_read(PostOP_N4Bias_folder+"/Orig_N4bias.nii.gz")
+    else:
+        PostOP_image = PostOP_N4bias_image
+
+    PostOP_op_to_PreOP = ants.apply_transforms(fixed=PreOP_RemoveHyper, moving=PostOP_image, transformlist=antsRegistrationSyN_br_transformlist, interpolator='linear')
+    Write_image(PostOP_op_to_PreOP, The_resection_mask_Final+"/PostOp_Image_in_ORIG.nii.gz")
+
+    PostOP_op_to_PreOP_Pre_resolution = ants.apply_transforms(fixed=PreOP_Data_image, moving=PostOP_image, transformlist=antsRegistrationSyN_br_transformlist, interpolator='linear')
+    Write_image(PostOP_op_to_PreOP_Pre_resolution, The_resection_mask_Final+"/PostOp_Image_in_PRE.nii.gz")
+
+
+    PreOP_image = ants.image_read(PreOP_N4Bias_folder+"/Orig_N4bias.nii.gz")
+    Write_image(PreOP_image, The_resection_mask_Final+"/PreOp_Image_in_ORIG.nii.gz")
+
+    Write_image(PreOP_Data_image, The_resection_mask_Final+"/PreOp_Image_in_PRE.nii.gz")
+
+    # The outputs are only complete once every image of the stage is on disk and reads back
+    Finish_writes()
+
+    end = time.time()
+    recorded_time=end-start
+    print(recorded_time)
+    Time_keeping = Add_section_time(Time_keeping, 'Outputs', recorded_time)
+
+    Emit_event("stage_end", stage="cavity", output_folder=Output_Folder, seconds=round(time.time() - stage_start, 3))
+
+    return Time_keeping
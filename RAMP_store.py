@@ -0,0 +1,430 @@
+# ========================================
+# RAMPS - Cohort mask store
+# Resection Automated Mask in Pre-operative Space
+#
+# One HDF5 file for a whole cohort, so group analyses read the masks (and a table of their bounding boxes and volumes)
+# from one file instead of opening and decompressing every case's RAMP_The_resection_mask_in_ORIG.nii.gz
+#
+#   python RAMP_store.py append <Store.h5> <RAMPS output folder> [<RAMPS output folder> ...] [--ids ID ...]
+#   python RAMP_store.py append <Store.h5> --manifest <Manifest.csv>   (the RAMP_scheduler.py / RAMP_queue.py manifest)
+#   python RAMP_store.py overlap <Store.h5> --box 40:60,30:50,20:40 [--output overlap.csv]
+#   python RAMP_store.py lobes <Store.h5> [--output lobes.csv]
+#   python RAMP_store.py list <Store.h5>
+# RAMP.py --store <Store.h5> (and RAMP_scheduler.py --store) appends each case when it finishes
+#
+# The ORIG masks of a cohort are all on the fake orig grid, so a box of voxels means the same place in every case
+#
+# The layout
+# - cases/<ID>/mask : the mask cropped to its bounding box, chunked and gzip compressed, either bit-packed (np.packbits
+#   of the flattened box, attrs shape) or one uint8 per voxel (--packing, fixed when the store is made)
+# - index/<column> : one row per case, all the queries need before (or instead of) reading a mask
+#   ID, Hemisphere, Lobe, Voxels, Voxel_mm3, Bbox (start and stop voxel of each axis), Grid_shape, Affine,
+#   Lobe_voxels (mask voxels in each of Lobe_regions, from the case's S5_Lobe_template atlas, -1 if it was missing)
+#
+# HDF5 files cannot take two writers at once, appends wait on <Store.h5>.lock so workers can share a store. Appending a
+# case that is already in the store replaces it
+# ========================================
+
+### Imports ---
+
+import argparse
+import os
+import os.path
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+Store_packings = ["bits", "uint8"]
+
+# The labels of the dilated lobe atlas (see RAMP_stages.py), with its NO_GO label (the ventricles, cerebellum and brain
+# stem), Outside is the part of the mask not in any of them. Also the lobe rows of the volume by region (RAMP_regions.py)
+Lobe_regions = {
+    11: "Left_Frontal", 12: "Left_Parietal", 13: "Left_Temporal", 14: "Left_Occipital", 15: "Left_Insula", 16: "Left_Sub_Cortical",
+    21: "Right_Frontal", 22: "Right_Parietal", 23: "Right_Temporal", 24: "Right_Occipital", 25: "Right_Insula", 26: "Right_Sub_Cortical",
+    50: "No_Go",
+    0: "Outside",
+}
+
+Store_chunk = 32
+
+# ========================================
+### Reading a case ---
+
+def Case_mask_file(Output_Folder):
+
+    return os.path.join(Output_Folder, "RAMPS_Resection_Mask_Output", "RAMP_The_resection_mask_in_ORIG.nii.gz")
+
+def Case_atlas_file(Output_Folder):
+
+    return os.path.join(Output_Folder, "S5_Lobe_template", "Pre_op", "Dilation", "PreOP_ATLAS_DIL_FILTER.nii.gz")
+
+# The hemisphere and lobe of a case, the best hypothesis when it was run with auto (see RAMP_hypothesis.py)
+def Case_hemisphere_lobe(Output_Folder, Hemisphere="", Lobe=""):
+
+    Ranking_csv = os.path.join(Output_Folder, "S13_Hypotheses", "Hypothesis_ranking.csv")
+
+    if (not Hemisphere or not Lobe or str(Hemisphere).upper() == "AUTO" or str(Lobe).upper() == "AUTO") and os.path.isfile(Ranking_csv):
+        import pandas as pd
+        The_ranking = pd.read_csv(Ranking_csv)
+        The_best = The_ranking[The_ranking["Best"] == True]
+        if len(The_best):
+            Hemisphere, Lobe = str(The_best["Candidate"].iloc[0]).split("_", 1)
+
+    return str(Hemisphere or "").upper(), str(Lobe or "").upper()
+
+# Everything the store keeps of one case, read from its output folder
+def Read_case(Output_Folder, ID, Hemisphere="", Lobe=""):
+
+    import nibabel as nib
+
+    The_mask_file = Case_mask_file(Output_Folder)
+    if not os.path.isfile(The_mask_file):
+        raise ValueError("No ORIG mask found for " + str(ID) + " : " + The_mask_file)
+
+    The_image = nib.load(The_mask_file)
+    The_mask = np.asanyarray(The_image.dataobj) > 0
+
+    if The_mask.ndim != 3:
+        raise ValueError("The ORIG mask of " + str(ID) + " is not 3D : " + str(The_mask.shape))
+
+    The_voxels = np.nonzero(The_mask)
+    if len(The_voxels[0]):
+        The_bbox = np.array([[int(c.min()), int(c.max()) + 1] for c in The_voxels], dtype=np.int32)
+    else:
+        The_bbox = np.zeros((3, 2), dtype=np.int32)
+
+    The_box = tuple(slice(start, stop) for start, stop in The_bbox)
+
+    # The lobe atlas is on the same grid, only the voxels in the box are needed
+    The_lobe_voxels = np.full(len(Lobe_regions), -1, dtype=np.int64)
+    The_atlas_file = Case_atlas_file(Output_Folder)
+    if os.path.isfile(The_atlas_file):
+        The_atlas = nib.load(The_atlas_file)
+        if The_atlas.shape[:3] == The_mask.shape:
+            The_labels = np.rint(np.asanyarray(The_atlas.dataobj[The_box])[The_mask[The_box]]).astype(np.int64)
+            The_counts = np.bincount(The_labels, minlength=max(Lobe_regions) + 1)
+            The_lobe_voxels = np.array([The_counts[label] if label < len(The_counts) else 0 for label in Lobe_regions], dtype=np.int64)
+            The_lobe_voxels[list(Lobe_regions).index(0)] += int(The_counts[[label for label in range(len(The_counts)) if label not in Lobe_regions]].sum())
+
+    Hemisphere, Lobe = Case_hemisphere_lobe(Output_Folder, Hemisphere, Lobe)
+
+    return {
+        "ID": str(ID),
+        "Hemisphere": Hemisphere,
+        "Lobe": Lobe,
+        "Mask": The_mask[The_box],
+        "Voxels": int(len(The_voxels[0])),
+        "Voxel_mm3": float(abs(np.linalg.det(The_image.affine[:3, :3]))),
+        "Bbox": The_bbox,
+        "Grid_shape": np.array(The_mask.shape, dtype=np.int32),
+        "Affine": np.asarray(The_image.affine, dtype=np.float64),
+        "Lobe_voxels": The_lobe_voxels,
+    }
+
+# ========================================
+### Writing ---
+
+@contextmanager
+def Store_lock(Store_file):
+
+    import fcntl
+
+    with open(Store_file + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+Index_columns = {
+    "ID": ((), "str"),
+    "Hemisphere": ((), "str"),
+    "Lobe": ((), "str"),
+    "Voxels": ((), np.int64),
+    "Voxel_mm3": ((), np.float64),
+    "Bbox": ((3, 2), np.int32),
+    "Grid_shape": ((3,), np.int32),
+    "Affine": ((4, 4), np.float64),
+    "Lobe_voxels": ((len(Lobe_regions),), np.int64),
+    "Appended": ((), np.float64),
+}
+
+def Open_store(Store_file, mode="r", packing="bits"):
+
+    import h5py
+
+    The_store = h5py.File(Store_file, mode)
+
+    if mode != "r" and "index" not in The_store:
+
+        if packing not in Store_packings:
+            raise ValueError("Unknown packing " + str(packing) + ", must be one of " + ", ".join(Store_packings))
+
+        The_store.attrs["packing"] = packing
+        The_store.attrs["space"] = "ORIG"
+        The_store.create_group("cases")
+        The_index = The_store.create_group("index")
+
+        for column, (shape, dtype) in Index_columns.items():
+            if dtype == "str":
+                dtype = h5py.string_dtype()
+            The_index.create_dataset(column, shape=(0,) + shape, maxshape=(None,) + shape, dtype=dtype, chunks=(256,) + shape)
+
+        The_index["Lobe_voxels"].attrs["labels"] = list(Lobe_regions)
+        The_index["Lobe_voxels"].attrs["names"] = list(Lobe_regions.values())
+
+    if "index" not in The_store:
+        raise ValueError("Not a RAMPS store : " + Store_file)
+
+    return The_store
+
+def Store_ids(The_store):
+
+    return [ID.decode() if isinstance(ID, bytes) else str(ID) for ID in The_store["index/ID"][:]]
+
+def Append_case(The_store, The_case):
+
+    The_index = The_store["index"]
+    The_ids = Store_ids(The_store)
+    ID = The_case["ID"]
+
+    if ID in The_ids:
+        row = The_ids.index(ID)
+        del The_store["cases"][ID]
+    else:
+        row = len(The_ids)
+        for column in Index_columns:
+            The_index[column].resize(row + 1, axis=0)
+
+    # A store made before a label was added to Lobe_regions keeps its own columns, the new label counts as Outside there
+    The_labels = [int(label) for label in The_index["Lobe_voxels"].attrs["labels"]]
+    if The_labels != list(Lobe_regions):
+        The_counts = dict(zip(Lobe_regions, The_case["Lobe_voxels"].tolist()))
+        The_lobe_voxels = np.array([The_counts.get(label, 0) for label in The_labels], dtype=np.int64)
+        if The_lobe_voxels[The_labels.index(0)] >= 0:
+            The_lobe_voxels[The_labels.index(0)] += sum(count for label, count in The_counts.items() if label not in The_labels)
+        The_case = dict(The_case, Lobe_voxels=The_lobe_voxels)
+
+    The_case = dict(The_case, Appended=time.time())
+    for column in Index_columns:
+        The_index[column][row] = The_case[column]
+
+    The_mask = The_case["Mask"]
+    if The_store.attrs["packing"] == "bits":
+        The_data = np.packbits(The_mask.ravel())
+        chunks = (min(max(len(The_data), 1), Store_chunk ** 3 // 8),)
+    else:
+        The_data = The_mask.astype(np.uint8)
+        chunks = tuple(min(max(size, 1), Store_chunk) for size in The_data.shape)
+
+    The_group = The_store["cases"].create_group(ID)
+    The_dataset = The_group.create_dataset("mask", data=The_data, chunks=chunks if The_data.size else None, compression="gzip", compression_opts=4, shuffle=False)
+    The_dataset.attrs["shape"] = The_mask.shape
+
+# Append the cases, each a dict with Output_Folder, ID and optionally Hemisphere and Lobe
+# Every case is read before the store is locked, so the lock is only held while writing
+def Append_cases(Store_file, The_cases, packing="bits"):
+
+    The_read = []
+    for Case in The_cases:
+        The_read.append(Read_case(Case["Output_Folder"], Case["ID"], Case.get("Hemisphere", ""), Case.get("Lobe", "")))
+
+    with Store_lock(Store_file):
+        with Open_store(Store_file, "a", packing) as The_store:
+            for The_case in The_read:
+                Append_case(The_store, The_case)
+                print("> Stored " + The_case["ID"] + " --> " + str(The_case["Voxels"]) + " voxels, box " + " x ".join(str(stop - start) for start, stop in The_case["Bbox"]))
+
+    return len(The_read)
+
+# ========================================
+### Queries ---
+
+# The cropped mask of one case, as a bool array the shape of its bounding box
+def Read_case_box(The_store, ID):
+
+    The_dataset = The_store["cases"][ID]["mask"]
+    shape = tuple(int(size) for size in The_dataset.attrs["shape"])
+
+    if The_store.attrs["packing"] == "bits":
+        return np.unpackbits(The_dataset[:], count=int(np.prod(shape))).reshape(shape).astype(bool)
+
+    return The_dataset[...].astype(bool)
+
+# The mask of one case on its whole grid, and its affine
+def Read_case_mask(Store_file, ID):
+
+    with Open_store(Store_file) as The_store:
+
+        The_ids = Store_ids(The_store)
+        if ID not in The_ids:
+            raise ValueError("No case " + str(ID) + " in " + Store_file)
+
+        row = The_ids.index(ID)
+        The_mask = np.zeros(tuple(The_store["index/Grid_shape"][row]), dtype=bool)
+        The_box = tuple(slice(start, stop) for start, stop in The_store["index/Bbox"][row])
+        The_mask[The_box] = Read_case_box(The_store, ID)
+
+        return The_mask, The_store["index/Affine"][row]
+
+def Read_index(Store_file):
+
+    import pandas as pd
+
+    with Open_store(Store_file) as The_store:
+        The_index = The_store["index"]
+        The_table = pd.DataFrame({"ID": Store_ids(The_store)})
+        for column in ["Hemisphere", "Lobe"]:
+            The_table[column] = [value.decode() if isinstance(value, bytes) else str(value) for value in The_index[column][:]]
+        The_table["Voxels"] = The_index["Voxels"][:]
+        The_table["Volume_mm3"] = The_index["Voxels"][:] * The_index["Voxel_mm3"][:]
+        The_bbox = The_index["Bbox"][:]
+        for axis in range(3):
+            The_table["Bbox_" + "xyz"[axis]] = [str(start) + ":" + str(stop) for start, stop in The_bbox[:, axis]]
+
+    return The_table
+
+# "40:60,30:50,20:40" -> [[40, 60], [30, 50], [20, 40]], the stop is not in the box (as a python slice)
+def Parse_box(box):
+
+    The_box = []
+    for axis in str(box).split(","):
+        start, stop = axis.split(":")
+        The_box.append([int(start), int(stop)])
+
+    if len(The_box) != 3 or any(stop <= start for start, stop in The_box):
+        raise ValueError("The box must be start:stop for each of the 3 axes, e.g. 40:60,30:50,20:40")
+
+    return np.array(The_box, dtype=np.int64)
+
+# The cases with at least min_voxels mask voxels inside the box, only the cases whose bounding box meets the box are read
+def Cases_overlapping(Store_file, The_box, min_voxels=1):
+
+    import pandas as pd
+
+    The_box = np.asarray(The_box, dtype=np.int64)
+    The_rows = []
+
+    with Open_store(Store_file) as The_store:
+
+        The_ids = Store_ids(The_store)
+        The_bboxes = The_store["index/Bbox"][:].astype(np.int64)
+        The_voxel_mm3 = The_store["index/Voxel_mm3"][:]
+
+        The_start = np.maximum(The_bboxes[:, :, 0], The_box[:, 0])
+        The_stop = np.minimum(The_bboxes[:, :, 1], The_box[:, 1])
+        The_meeting = np.nonzero(np.all(The_stop > The_start, axis=1))[0]
+
+        for row in The_meeting:
+
+            ID = The_ids[row]
+            The_part = tuple(slice(start - offset, stop - offset) for start, stop, offset in zip(The_start[row], The_stop[row], The_bboxes[row, :, 0]))
+
+            if The_store.attrs["packing"] == "bits":
+                overlap = int(Read_case_box(The_store, ID)[The_part].sum())
+            else:
+                # Only the chunks under the box are read
+                overlap = int(np.count_nonzero(The_store["cases"][ID]["mask"][The_part]))
+
+            if overlap >= min_voxels:
+                The_rows.append({"ID": ID, "Overlap_voxels": overlap, "Overlap_mm3": overlap * float(The_voxel_mm3[row])})
+
+    return pd.DataFrame(The_rows, columns=["ID", "Overlap_voxels", "Overlap_mm3"])
+
+# The volume (mm3) of every case's mask in each lobe region, nan where the case had no lobe atlas
+def Volume_by_lobe(Store_file):
+
+    The_table = Read_index(Store_file)
+
+    with Open_store(Store_file) as The_store:
+        The_lobe_voxels = The_store["index/Lobe_voxels"][:].astype(np.float64)
+        The_names = [str(name.decode() if isinstance(name, bytes) else name) for name in The_store["index/Lobe_voxels"].attrs["names"]]
+        The_voxel_mm3 = The_store["index/Voxel_mm3"][:]
+
+    The_lobe_voxels[The_lobe_voxels < 0] = np.nan
+
+    for column, name in enumerate(The_names):
+        The_table[name + "_mm3"] = The_lobe_voxels[:, column] * The_voxel_mm3
+
+    return The_table.drop(columns=["Bbox_x", "Bbox_y", "Bbox_z"])
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="RAMP_store.py", description="A cohort store of RAMPS masks for group queries")
+    The_commands = parser.add_subparsers(dest="command", required=True)
+
+    Append_parser = The_commands.add_parser("append", help="add RAMPS output folders to the store (a case already in it is replaced)")
+    Append_parser.add_argument("Store", help="the HDF5 store, made if it does not exist")
+    Append_parser.add_argument("Output_Folders", nargs="*", help="RAMPS output folders")
+    Append_parser.add_argument("--ids", nargs="*", default=None, help="the ID of each output folder (default the folder name)")
+    Append_parser.add_argument("--manifest", default=None, help="csv with the columns ID, Output_Folder (and optionally Hemisphere, Lobe)")
+    Append_parser.add_argument("--packing", default="bits", choices=Store_packings, help="how the masks of a new store are kept, bits (smallest) or uint8 (box queries only read the chunks they need)")
+
+    Overlap_parser = The_commands.add_parser("overlap", help="the cases whose mask is inside a box of voxels")
+    Overlap_parser.add_argument("Store")
+    Overlap_parser.add_argument("--box", required=True, help="start:stop voxels of each axis, e.g. 40:60,30:50,20:40")
+    Overlap_parser.add_argument("--min_voxels", type=int, default=1, help="voxels of the mask that have to be in the box (default 1)")
+    Overlap_parser.add_argument("--output", default=None, help="also write the result to this csv")
+
+    Lobes_parser = The_commands.add_parser("lobes", help="the volume of every mask in each lobe")
+    Lobes_parser.add_argument("Store")
+    Lobes_parser.add_argument("--output", default=None, help="also write the result to this csv")
+
+    List_parser = The_commands.add_parser("list", help="the cases in the store with their volumes and bounding boxes")
+    List_parser.add_argument("Store")
+
+    RAMPS_arguments = parser.parse_args()
+
+    start = time.time()
+
+    try:
+        if RAMPS_arguments.command == "append":
+
+            The_cases = []
+            if RAMPS_arguments.manifest is not None:
+                import pandas as pd
+                if not os.path.isfile(RAMPS_arguments.manifest):
+                    print("Error - This file is not detected : " + RAMPS_arguments.manifest)
+                    sys.exit(1)
+                The_cases += pd.read_csv(RAMPS_arguments.manifest, dtype=str, keep_default_na=False).to_dict("records")
+
+            The_ids = RAMPS_arguments.ids or [os.path.basename(os.path.normpath(Output_Folder)) for Output_Folder in RAMPS_arguments.Output_Folders]
+            if len(The_ids) != len(RAMPS_arguments.Output_Folders):
+                print("Error - Give one ID for each output folder")
+                sys.exit(1)
+            The_cases += [{"ID": ID, "Output_Folder": Output_Folder} for ID, Output_Folder in zip(The_ids, RAMPS_arguments.Output_Folders)]
+
+            if not The_cases:
+                print("Error - No output folders or manifest given")
+                sys.exit(1)
+
+            stored = Append_cases(RAMPS_arguments.Store, The_cases, RAMPS_arguments.packing)
+            print("> Stored " + str(stored) + " cases in " + str(round(time.time() - start, 2)) + " sec --> " + RAMPS_arguments.Store)
+            sys.exit(0)
+
+        if not os.path.isfile(RAMPS_arguments.Store):
+            print("Error - This file is not detected : " + RAMPS_arguments.Store)
+            sys.exit(1)
+
+        if RAMPS_arguments.command == "overlap":
+            The_table = Cases_overlapping(RAMPS_arguments.Store, Parse_box(RAMPS_arguments.box), RAMPS_arguments.min_voxels)
+        elif RAMPS_arguments.command == "lobes":
+            The_table = Volume_by_lobe(RAMPS_arguments.Store)
+        else:
+            The_table = Read_index(RAMPS_arguments.Store)
+
+    except ValueError as e:
+        print("Error - " + str(e))
+        sys.exit(1)
+
+    print(The_table.to_string(index=False))
+    print("")
+    print("> " + str(len(The_table)) + " cases in " + str(round(time.time() - start, 3)) + " sec")
+
+    if getattr(RAMPS_arguments, "output", None) is not None:
+        The_table.to_csv(RAMPS_arguments.output, index=False)
@@ -0,0 +1,353 @@
+# ========================================
+# RAMPS - Registration strategies
+# Resection Automated Mask in Pre-operative Space
+#
+# The post-op brain sags into the cavity, and a registration driven by the whole brain can pull the tissue around the
+# resection out of place. S9_Registration has a folder for each way of registering the post-op image, depending on
+# whether the rigid and the b-spline SyN stages see the whole brain or only the lobes that were not resected (the S6
+# PreOP_NONE_feildResection / PostOP_NONE_feildResection maps as the fixed and moving masks)
+# - reg_br : whole brain for both, what RAMPS has always run
+# - reg_None_resected : not resected lobes for both
+# - reg_None_resected_then_resected : rigid on the not resected lobes, then the SyN on the whole brain
+# - reg_br_then_resected : rigid on the whole brain, then the SyN on the not resected lobes
+# Every folder ends up with the files of reg_br (br_0GenericAffine.mat, br_1Warp.nii.gz, br_1InverseWarp.nii.gz,
+# warpedmovout.nii.gz, warpedfixout.nii.gz)
+#
+# RAMP.py --registration_strategies (e.g. all, or reg_br,reg_None_resected) runs each one in its own process at the same
+# time, with the --threads split between them (ITK only reads its number of threads when a process starts). Each is
+# scored by the correlation of the pre-op and the registered post-op image over the lobes that were not resected (as
+# the registration check, see RAMP_qc.py), a warp that has folded (Jacobian determinant <= 0) is only taken if they all
+# have, and the best is used by the cavity stage
+# - S9_Registration/Registration_strategies.csv : each strategy with its measures
+# - S9_Registration/Registration_strategy.json : the one that was chosen, read by Registration_folder, and whether its
+#   retry (see RAMP_qc.py, written to <strategy>_retry so the first attempt is kept) is the registration that is used
+#
+#   python RAMP_strategies.py <Output_Folder> <strategy> [--initial_transform <.mat>] [--threads N]
+# runs one strategy and writes its measures to <strategy folder>/Strategy.json (this is what each process runs)
+# ========================================
+
+### Imports ---
+
+import argparse
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import time
+
+from RAMP_events import Emit_event, Heartbeat
+
+# Whether the (rigid, b-spline SyN) stages are masked to the lobes that were not resected
+Registration_strategies = {
+    "reg_br": (False, False),
+    "reg_None_resected": (True, True),
+    "reg_None_resected_then_resected": (True, False),
+    "reg_br_then_resected": (False, True),
+}
+
+Default_strategies = ["reg_br"]
+
+# The ants transforms of a registration : (the whole registration in one, its rigid stage on its own, the deformable stage
+# that goes on from the rigid one). The retry of a registration that failed its check (see RAMP_qc.py) adds an affine
+# stage and uses a full SyN rather than the b-spline SyN
+Strategy_transforms = {
+    "first": ("antsRegistrationSyN[br]", "antsRegistrationSyN[r]", "antsRegistrationSyN[bo]"),
+    "retry": ("antsRegistrationSyN[s]", "antsRegistrationSyN[a]", "antsRegistrationSyN[so]"),
+}
+
+# all, or a comma separated list of the names above, e.g. "reg_br,reg_None_resected"
+def Parse_strategies(text):
+
+    if str(text).strip().lower() == "all":
+        return list(Registration_strategies)
+
+    The_strategies = []
+    for name in str(text).split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in Registration_strategies:
+            raise ValueError("Unknown registration strategy " + name + ", must be all or any of " + ", ".join(Registration_strategies))
+        if name not in The_strategies:
+            The_strategies.append(name)
+
+    if not The_strategies:
+        raise ValueError("No registration strategy given")
+
+    return The_strategies
+
+# ========================================
+### Folders ---
+
+def Strategy_folder(Output_Folder, name):
+
+    return os.path.join(Output_Folder, "S9_Registration", name)
+
+# The retry of a strategy, next to it
+def Retry_folder(Output_Folder, name):
+
+    return Strategy_folder(Output_Folder, name + "_retry")
+
+# The strategy that was chosen and whether its retry is used, reg_br (first attempt) unless another was written
+def Selected_strategy(Output_Folder):
+
+    try:
+        with open(os.path.join(Output_Folder, "S9_Registration", "Registration_strategy.json")) as f:
+            The_selected = json.load(f)
+    except (OSError, ValueError):
+        The_selected = {}
+
+    name = The_selected.get("selected", "reg_br")
+    if name not in Registration_strategies:
+        name = "reg_br"
+
+    return name, bool(The_selected.get("retry", False))
+
+# The registration the cavity stage uses, reg_br unless another strategy (or a retry) was chosen
+def Registration_folder(Output_Folder):
+
+    name, retry = Selected_strategy(Output_Folder)
+
+    Folder = Retry_folder(Output_Folder, name) if retry else Strategy_folder(Output_Folder, name)
+
+    if not os.path.isfile(os.path.join(Folder, "br_1Warp.nii.gz")):
+        Folder = Strategy_folder(Output_Folder, "reg_br")
+
+    return Folder
+
+# ========================================
+### Registering ---
+
+# Masks is False when only reg_br is run, it does not need the S6 maps
+def Load_strategy_inputs(Output_Folder, Masks=True):
+
+    import ants
+
+    RemoveHyper=os.path.join(Output_Folder, "S8_RemoveHyper")
+    Lobe_of_resection=os.path.join(Output_Folder, "S6_Lobe_of_resection")
+
+    The_inputs = {
+        "fixed": ants.image_read(RemoveHyper+"/Pre_Final_skullstriped_image_Manual_remove_hyper.nii.gz"),
+        "moving": ants.image_read(RemoveHyper+"/Post_Final_skullstriped_image_Manual_remove_hyper.nii.gz"),
+        "fixed_mask": None,
+        "moving_mask": None,
+    }
+
+    # Only there once the preparation stage has run with a hemisphere and lobe
+    if Masks and os.path.isfile(Lobe_of_resection+"/PreOP_NONE_feildResection.nii.gz") and os.path.isfile(Lobe_of_resection+"/PostOP_NONE_feildResection.nii.gz"):
+        The_inputs["fixed_mask"] = ants.image_read(Lobe_of_resection+"/PreOP_NONE_feildResection.nii.gz")
+        The_inputs["moving_mask"] = ants.image_read(Lobe_of_resection+"/PostOP_NONE_feildResection.nii.gz")
+
+    return The_inputs
+
+# ANTsPy has no thread argument (it takes n and ignores it), a registration uses the ITK threads of its process, which
+# ITK reads once from the environment (RAMP.py, Init_stage_worker and Run_strategies set it before ants is loaded)
+def Check_registration_threads(Threads):
+
+    if Threads is not None and os.environ.get("ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS") != str(Threads):
+        print("> This process was not started with " + str(Threads) + " ITK threads, the registration uses " + os.environ.get("ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS", "the ITK default"), flush=True)
+
+# Register with one strategy into Folder, returns the ants.registration result
+# Initial_transform is a rigid transform (.mat) to start from in place of a whole brain rigid stage (see RAMP_preview.py)
+# Threads is the number of threads the registration should have (see Check_registration_threads)
+# Retry registers with the retry transforms (see Strategy_transforms), started from Initial_transform rather than
+# skipping the linear stages, with the same masks as the first attempt
+def Register_strategy(name, The_inputs, Folder, Initial_transform=None, Threads=None, Retry=False):
+
+    from RAMP_events import Registration_with_events
+
+    Check_registration_threads(Threads)
+
+    rigid_masked, syn_masked = Registration_strategies[name]
+
+    if (rigid_masked or syn_masked) and The_inputs["fixed_mask"] is None:
+        raise ValueError("The " + name + " registration needs the S6 feild maps of the lobe of resection")
+
+    The_masks = {"mask": The_inputs["fixed_mask"], "moving_mask": The_inputs["moving_mask"]}
+
+    fixed, moving = The_inputs["fixed"], The_inputs["moving"]
+
+    The_whole, The_rigid, The_deformable = Strategy_transforms["retry" if Retry else "first"]
+    The_start = {"initial_transform": [Initial_transform]} if Retry and Initial_transform is not None else {}
+
+    if rigid_masked == syn_masked and (Initial_transform is None or rigid_masked or Retry):
+        return Registration_with_events(fixed=fixed, moving=moving, type_of_transform = The_whole, outprefix=Folder+"/br_", **The_start, **(The_masks if syn_masked else {}))
+
+    if Initial_transform is None or rigid_masked or Retry:
+        Registration_with_events(fixed=fixed, moving=moving, type_of_transform = The_rigid, outprefix=Folder+"/rigid_", **The_start, **(The_masks if rigid_masked else {}))
+        Initial_transform = Folder+"/rigid_0GenericAffine.mat"
+
+    The_registration = Registration_with_events(fixed=fixed, moving=moving, type_of_transform = The_deformable, initial_transform=[Initial_transform], outprefix=Folder+"/br_", **(The_masks if syn_masked else {}))
+
+    # antsRegistration collapses the initial transform into br_0GenericAffine.mat, the names stay those of [br]
+    if not os.path.isfile(Folder+"/br_0GenericAffine.mat"):
+        shutil.copyfile(Initial_transform, Folder+"/br_0GenericAffine.mat")
+
+    return The_registration
+
+# How well the registered post-op image lines up with the pre-op over the lobes that were not resected
+def Strategy_measures(The_inputs, The_registration, Folder):
+
+    import ants
+    from RAMP_qc import Correlation
+
+    The_pre = The_inputs["fixed"].numpy()
+    The_region = (The_pre > 0) & (The_registration["warpedmovout"].numpy() > 0)
+    if The_inputs["fixed_mask"] is not None:
+        The_region &= The_inputs["fixed_mask"].numpy() > 0
+
+    The_jacobian = ants.create_jacobian_determinant_image(The_inputs["fixed"], Folder+"/br_1Warp.nii.gz").numpy()[The_pre > 0]
+
+    return {
+        "Correlation": Correlation(The_pre, The_registration["warpedmovout"].numpy(), The_region),
+        "Jacobian_min": float(The_jacobian.min()) if The_jacobian.size else 1.0,
+        "Folded_voxels": int((The_jacobian <= 0).sum()),
+    }
+
+# ========================================
+### Choosing ---
+
+# Run The_strategies at the same time, each in its own process with its share of Threads, and choose the best
+# Returns the folder of the chosen one
+def Run_strategies(Output_Folder, The_strategies, Threads=None, Initial_transform=None):
+
+    import pandas as pd
+
+    start = time.time()
+
+    Do_Registration=os.path.join(Output_Folder, "S9_Registration")
+
+    threads = max(1, (Threads or os.cpu_count() or 1) // len(The_strategies))
+
+    print("> Registration strategies --> " + ", ".join(The_strategies) + " at the same time, " + str(threads) + " threads each", flush=True)
+
+    The_processes = {}
+    for name in The_strategies:
+
+        Folder = Strategy_folder(Output_Folder, name)
+        if not os.path.exists(Folder):
+            os.makedirs(Folder)
+
+        # Left by an earlier run, a strategy without one has failed
+        if os.path.isfile(Folder+"/Strategy.json"):
+            os.remove(Folder+"/Strategy.json")
+
+        The_environment = dict(os.environ, ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS=str(threads), OMP_NUM_THREADS=str(threads))
+
+        The_command = [sys.executable, os.path.abspath(__file__), Output_Folder, name, "--threads", str(threads)]
+        if Initial_transform is not None:
+            The_command += ["--initial_transform", Initial_transform]
+
+        with open(Folder+"/RAMP_registration.log", "w") as log:
+            The_processes[name] = subprocess.Popen(The_command, env=The_environment, stdout=log, stderr=subprocess.STDOUT)
+
+    with Heartbeat("registration"):
+        for name in The_strategies:
+            The_processes[name].wait()
+
+    The_rows = []
+    for name in The_strategies:
+
+        Folder = Strategy_folder(Output_Folder, name)
+
+        try:
+            with open(Folder+"/Strategy.json") as f:
+                The_row = json.load(f)
+        except (OSError, ValueError):
+            The_row = {"Strategy": name, "Error": "failed (exit code " + str(The_processes[name].returncode) + "), see " + Folder + "/RAMP_registration.log"}
+
+        The_rows.append(The_row)
+
+        if The_row.get("Error"):
+            print("> " + name + " --> " + The_row["Error"], flush=True)
+        else:
+            print("> " + name + " --> correlation " + str(round(The_row["Correlation"], 4)) + ", jacobian min " + str(round(The_row["Jacobian_min"], 3)) + " in " + str(round(The_row["Time_SEC"])) + " sec", flush=True)
+
+    The_done = [The_row for The_row in The_rows if not The_row.get("Error")]
+
+    if not The_done:
+        raise RuntimeError("None of the registration strategies finished, see the RAMP_registration.log in " + Do_Registration)
+
+    # A warp that has folded is only taken when they all have
+    The_unfolded = [The_row for The_row in The_done if The_row["Folded_voxels"] == 0] or The_done
+    The_best = max(The_unfolded, key=lambda The_row: The_row["Correlation"])
+
+    for The_row in The_rows:
+        The_row["Selected"] = The_row is The_best
+
+    pd.DataFrame(The_rows, columns=["Strategy", "Correlation", "Jacobian_min", "Folded_voxels", "Time_SEC", "Error", "Selected"]).to_csv(Do_Registration+"/Registration_strategies.csv", index=False)
+    Write_selected_strategy(Output_Folder, The_best["Strategy"])
+
+    print("> Registration strategy chosen --> " + The_best["Strategy"] + " (correlation " + str(round(The_best["Correlation"], 4)) + ") in " + str(round(time.time() - start)) + " sec", flush=True)
+    Emit_event("registration_strategy", output_folder=Output_Folder, selected=The_best["Strategy"], correlations={The_row["Strategy"]: round(The_row["Correlation"], 4) for The_row in The_done}, failed=[The_row["Strategy"] for The_row in The_rows if The_row.get("Error")])
+
+    return Strategy_folder(Output_Folder, The_best["Strategy"])
+
+# folder is the transform set the cavity stage uses
+def Write_selected_strategy(Output_Folder, name, retry=False):
+
+    The_folder = Retry_folder(Output_Folder, name) if retry else Strategy_folder(Output_Folder, name)
+
+    with open(os.path.join(Output_Folder, "S9_Registration", "Registration_strategy.json"), "w") as f:
+        json.dump({"selected": name, "retry": retry, "folder": os.path.basename(The_folder)}, f, indent=1)
+
+# Add the retry of the chosen strategy to Registration_strategies.csv (when more than one strategy was run) as the one
+# that is used
+def Add_retry_row(Output_Folder, The_row):
+
+    import pandas as pd
+
+    The_csv = os.path.join(Output_Folder, "S9_Registration", "Registration_strategies.csv")
+    if not os.path.isfile(The_csv):
+        return
+
+    The_rows = pd.read_csv(The_csv)
+    The_rows = The_rows[~The_rows["Strategy"].astype(str).str.endswith("_retry")]
+    The_rows["Selected"] = False
+
+    pd.concat([The_rows, pd.DataFrame([dict(The_row, Selected=True)])], ignore_index=True)[list(The_rows.columns)].to_csv(The_csv, index=False)
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="RAMP_strategies.py", description="Run one RAMPS registration strategy on an output folder that has been through the preparation stage")
+    parser.add_argument("Output_Folder", help="a RAMPS output folder that has been through the preparation stage")
+    parser.add_argument("Strategy", choices=list(Registration_strategies), help="the registration strategy")
+    parser.add_argument("--initial_transform", default=None, help="a rigid transform (.mat) to start from in place of the whole brain rigid stage")
+    parser.add_argument("--threads", type=int, default=None, help="the ITK threads the registration should have, set ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS to it (Run_strategies does)")
+
+    RAMPS_arguments = parser.parse_args()
+
+    if not os.path.isdir(os.path.join(RAMPS_arguments.Output_Folder, "S8_RemoveHyper")):
+        print("Error - The output folder has not been through the preparation stage : " + RAMPS_arguments.Output_Folder)
+        sys.exit(1)
+
+    start = time.time()
+
+    Folder = Strategy_folder(RAMPS_arguments.Output_Folder, RAMPS_arguments.Strategy)
+    if not os.path.exists(Folder):
+        os.makedirs(Folder)
+
+    The_inputs = Load_strategy_inputs(RAMPS_arguments.Output_Folder)
+
+    try:
+        The_registration = Register_strategy(RAMPS_arguments.Strategy, The_inputs, Folder, Initial_transform=RAMPS_arguments.initial_transform, Threads=RAMPS_arguments.threads)
+    except ValueError as e:
+        print("Error - " + str(e))
+        sys.exit(1)
+
+    The_registration["warpedmovout"].image_write(Folder+"/warpedmovout.nii.gz", ri=True)
+    The_registration["warpedfixout"].image_write(Folder+"/warpedfixout.nii.gz", ri=True)
+
+    The_row = {"Strategy": RAMPS_arguments.Strategy, "Error": ""}
+    The_row.update(Strategy_measures(The_inputs, The_registration, Folder))
+    The_row["Time_SEC"] = round(time.time() - start, 3)
+
+    with open(Folder+"/Strategy.json", "w") as f:
+        json.dump(The_row, f, indent=1)
+
+    print("> " + RAMPS_arguments.Strategy + " --> correlation " + str(round(The_row["Correlation"], 4)) + " in " + str(round(The_row["Time_SEC"])) + " sec")
@@ -0,0 +1,168 @@
+# ========================================
+# RAMPS - Parameter sweep
+# Resection Automated Mask in Pre-operative Space
+#
+# Re-runs the cavity classification (steps 7 to 14, see RAMP_cavity.py) on an output folder that RAMP.py has already
+# finished, once for every setting in a parameter grid. The registration and preparation outputs are loaded once and
+# the settings are run in parallel worker processes.
+#
+# Outputs (in <Output_Folder>/S12_Parameter_sweep)
+# - setting_XXX/RAMP_The_resection_mask_in_ORIG.nii.gz : the mask for each setting (the intermediates are kept next to it)
+# - Sweep_settings.csv : the parameters of each setting with the mask volume and how long it took
+# - Sweep_agreement_map.nii.gz : the fraction of settings that include each voxel (a voxelwise probability map)
+# ========================================
+
+### Imports ---
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os.path
+import sys
+import time
+
+# ========================================
+### Inputs ---
+
+parser = argparse.ArgumentParser(prog="RAMP_sweep.py", description="Run the RAMPS cavity stage over a grid of parameters on a finished RAMPS output folder")
+parser.add_argument("Output_Folder", help="a RAMPS output folder that has been through the registration step")
+parser.add_argument("Sweep_grid", help="json file, either {parameter: [values]} (every combination is run) or a list of {parameter: value} settings")
+parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="number of settings run at the same time")
+parser.add_argument("--threads", type=int, default=1, help="ITK threads for each worker")
+
+# Turn the grid file into a list of settings
+def Read_sweep_grid(Sweep_grid):
+
+    with open(Sweep_grid) as f:
+        The_grid = json.load(f)
+
+    if isinstance(The_grid, dict):
+        keys = list(The_grid)
+        values = [v if isinstance(v, list) else [v] for v in The_grid.values()]
+        return [dict(zip(keys, setting)) for setting in itertools.product(*values)]
+
+    return list(The_grid)
+
+# ========================================
+### Workers ---
+
+# Loaded once in the main process, with fork the workers share it, otherwise each worker loads its own copy
+Sweep_inputs = None
+Sweep_folder = None
+
+def Init_worker(Output_Folder, Folder):
+
+    global Sweep_inputs, Sweep_folder
+
+    from RAMP_cavity import Load_cavity_inputs
+
+    Sweep_folder = Folder
+
+    if Sweep_inputs is None:
+        Sweep_inputs = Load_cavity_inputs(Output_Folder)
+
+def Run_setting(Job):
+
+    from RAMP_cavity import Make_resection_mask
+
+    index, Cavity_parameters = Job
+
+    Setting_folder = os.path.join(Sweep_folder, "setting_%03d" % index)
+
+    start = time.time()
+
+    try:
+        The_final_mask = Make_resection_mask(Sweep_inputs, Setting_folder, Cavity_parameters)
+    except Exception as e:
+        return index, None, 0, time.time() - start, repr(e)
+
+    The_mask_path = Setting_folder + "/RAMP_The_resection_mask_in_ORIG.nii.gz"
+    The_final_mask.image_write(The_mask_path, ri=True)
+
+    return index, The_mask_path, int(The_final_mask.numpy().sum()), time.time() - start, ""
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    RAMPS_arguments = parser.parse_args()
+
+    Output_Folder = RAMPS_arguments.Output_Folder
+
+    if not os.path.isdir(os.path.join(Output_Folder, "S9_Registration", "reg_br")):
+        print("Error - No registration found in : " + Output_Folder + " (run RAMP.py first)")
+        sys.exit(1)
+
+    if not os.path.isfile(RAMPS_arguments.Sweep_grid):
+        print("Error - This file is not detected : " + RAMPS_arguments.Sweep_grid)
+        sys.exit(1)
+
+    # ITK reads its thread count the first time it is used, so this has to be set before ants is imported
+    os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(RAMPS_arguments.threads)
+
+    import nibabel as nib
+    import numpy as np
+    import pandas as pd
+    from RAMP_cavity import Load_cavity_inputs, Get_cavity_parameters
+
+    The_settings = Read_sweep_grid(RAMPS_arguments.Sweep_grid)
+
+    try:
+        The_settings = [Get_cavity_parameters(setting) for setting in The_settings]
+    except ValueError as e:
+        print("Error - " + str(e))
+        sys.exit(1)
+
+    print("> RAMPS parameter sweep --> " + str(len(The_settings)) + " settings on " + str(RAMPS_arguments.workers) + " workers")
+
+    Sweep_folder = os.path.join(Output_Folder, "S12_Parameter_sweep")
+    if not os.path.exists(Sweep_folder):
+        os.makedirs(Sweep_folder)
+
+    # Fork lets every worker share the images loaded here, where fork is not available each worker loads them itself
+    if "fork" in multiprocessing.get_all_start_methods():
+        Sweep_inputs = Load_cavity_inputs(Output_Folder)
+        The_context = multiprocessing.get_context("fork")
+    else:
+        The_context = multiprocessing.get_context("spawn")
+
+    The_agreement = None
+    The_reference = None
+    The_results = []
+
+    with The_context.Pool(RAMPS_arguments.workers, initializer=Init_worker, initargs=(Output_Folder, Sweep_folder)) as pool:
+
+        for index, The_mask_path, voxels, recorded_time, error in pool.imap_unordered(Run_setting, enumerate(The_settings)):
+
+            The_results.append(dict(Setting=index, **The_settings[index], Voxels=voxels, Time_SEC=recorded_time, Mask=The_mask_path, Error=error))
+
+            if The_mask_path is None:
+                print("> setting " + str(index) + " failed --> " + error)
+                continue
+
+            print("> setting " + str(index) + " done --> " + str(voxels) + " voxels in " + str(round(recorded_time)) + " sec")
+
+            # Add this mask to the agreement map as the settings finish
+            The_mask = nib.load(The_mask_path)
+            if The_agreement is None:
+                The_agreement = np.zeros(The_mask.shape)
+                The_reference = The_mask
+            The_agreement += np.asanyarray(The_mask.dataobj) > 0
+
+    The_results = pd.DataFrame(The_results).sort_values("Setting")
+    The_results.to_csv(Sweep_folder + "/Sweep_settings.csv", index=False)
+
+    The_finished = int(np.sum(The_results["Mask"].notna()))
+
+    if The_finished == 0:
+        print("Error - None of the settings finished")
+        sys.exit(1)
+
+    The_agreement = The_agreement / The_finished
+    The_agreement_save = nib.Nifti1Image(The_agreement.astype(np.float32), The_reference.affine, The_reference.header)
+    The_agreement_save.set_data_dtype(np.float32)
+    nib.save(The_agreement_save, Sweep_folder + "/Sweep_agreement_map.nii.gz")
+
+    print("> RAMPS parameter sweep completed --> " + Sweep_folder)
@@ -0,0 +1,249 @@
+# ========================================
+# RAMPS - Template space frequency maps
+# Resection Automated Mask in Pre-operative Space
+#
+# Puts the resection masks of a cohort of finished RAMPS output folders into a common template space and counts, for
+# every template voxel, how many cases had it resected
+#
+#   python RAMP_template.py <Manifest.csv> <Template.nii.gz> <Output_prefix> --workers 4 --threads 2
+#
+# The manifest is a csv with the columns ID, Output_Folder (the RAMP_scheduler.py / RAMP_queue.py manifest works)
+#
+# For each case (in parallel worker processes)
+# - the skull stripped pre-op image in orig space (S4_Skull_strip, or PreOp_Image_in_ORIG if it is not there) is
+#   registered to the template once, the transforms are cached in <Output_Folder>/S9_Template_registration/<template>/
+#   with Template_registration.json, and are used again while the template and --transform stay the same
+# - RAMP_The_resection_mask_in_ORIG.nii.gz is warped into the template (linear, then >= 0.5) and kept in the same folder
+#   as RAMP_The_resection_mask_in_TEMPLATE.nii.gz, which is also used again until the mask changes
+# Each warped mask is added to the count as it comes back (only its bounding box is sent back from the worker), so only
+# one template sized map is held whatever the size of the cohort
+#
+# Outputs
+# - <Output_prefix>_frequency.nii.gz : the number of cases resected at each voxel
+# - <Output_prefix>_proportion.nii.gz : the same divided by the number of cases that were warped
+# - <Output_prefix>_cases.csv : each case with its volume in template space, the time it took and what was reused
+# ========================================
+
+### Imports ---
+
+import argparse
+import hashlib
+import json
+import os
+import os.path
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+Default_transform = "SyN"
+
+# ========================================
+### Inputs ---
+
+parser = argparse.ArgumentParser(prog="RAMP_template.py", description="Warp the RAMPS masks of a cohort into a template and make a resection frequency map")
+parser.add_argument("Manifest", help="csv with the columns ID, Output_Folder")
+parser.add_argument("Template", help="the template image (skull stripped, e.g. MNI152 brain)")
+parser.add_argument("Output_prefix", help="the frequency map is written to <Output_prefix>_frequency.nii.gz")
+parser.add_argument("--transform", default=Default_transform, help="ANTsPy type_of_transform of the registration to the template (default " + Default_transform + ")")
+parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="number of cases registered at the same time")
+parser.add_argument("--threads", type=int, default=1, help="ITK threads for each worker")
+parser.add_argument("--redo", action="store_true", help="register and warp every case again, even if it is cached")
+
+# ========================================
+### Template registration cache ---
+
+# Short enough for a folder name, changes when the template does
+def Template_key(Template_file):
+
+    The_hash = hashlib.sha1()
+    with open(Template_file, "rb") as template:
+        for block in iter(lambda: template.read(1 << 20), b""):
+            The_hash.update(block)
+
+    name = os.path.basename(Template_file).split(".")[0]
+
+    return name + "_" + The_hash.hexdigest()[:10]
+
+def Template_folder(Output_Folder, key):
+
+    return os.path.join(Output_Folder, "S9_Template_registration", key)
+
+def Case_moving_image(Output_Folder):
+
+    for The_image in [os.path.join(Output_Folder, "S4_Skull_strip", "Pre_op", "Final_skullstriped_image.nii.gz"), os.path.join(Output_Folder, "RAMPS_Resection_Mask_Output", "PreOp_Image_in_ORIG.nii.gz")]:
+        if os.path.isfile(The_image):
+            return The_image
+
+    return None
+
+# The cached registration of a case, or None if there is none for this template and transform
+def Read_template_registration(Folder, key, transform):
+
+    try:
+        with open(os.path.join(Folder, "Template_registration.json")) as f:
+            The_registration = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if The_registration.get("template_key") != key or The_registration.get("transform") != transform:
+        return None
+
+    for name in The_registration["fwdtransforms"] + The_registration["invtransforms"]:
+        if not os.path.isfile(os.path.join(Folder, name)):
+            return None
+
+    return The_registration
+
+# ========================================
+### Workers ---
+
+Worker_template = None
+
+def Init_template_worker(Template_file, threads):
+
+    global Worker_template
+
+    # ITK reads the number of threads to use the first time it is used
+    os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(threads)
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+    import ants
+
+    Worker_template = ants.image_read(Template_file)
+
+# Register (or reuse) and warp one case, returns the bounding box of the warped mask and the mask inside it
+def Warp_case(Case, key, transform, redo=False):
+
+    import ants
+    import numpy as np
+
+    ID, Output_Folder = str(Case["ID"]), Case["Output_Folder"]
+    The_result = {"ID": ID, "Output_Folder": Output_Folder, "Registered": False, "Warped": False, "Error": ""}
+
+    start = time.time()
+
+    The_mask_file = os.path.join(Output_Folder, "RAMPS_Resection_Mask_Output", "RAMP_The_resection_mask_in_ORIG.nii.gz")
+    The_moving_file = Case_moving_image(Output_Folder)
+
+    if not os.path.isfile(The_mask_file) or The_moving_file is None:
+        The_result["Error"] = "No ORIG mask or pre-op orig image in " + Output_Folder
+        return The_result, None, None
+
+    Folder = Template_folder(Output_Folder, key)
+    os.makedirs(Folder, exist_ok=True)
+
+    The_registration = None if redo else Read_template_registration(Folder, key, transform)
+
+    if The_registration is None:
+
+        The_moving = ants.image_read(The_moving_file)
+        The_ants = ants.registration(fixed=Worker_template, moving=The_moving, type_of_transform=transform, outprefix=os.path.join(Folder, "tmpl_"))
+
+        The_registration = {
+            "template_key": key,
+            "transform": transform,
+            "moving": The_moving_file,
+            "fwdtransforms": [os.path.basename(name) for name in The_ants["fwdtransforms"]],
+            "invtransforms": [os.path.basename(name) for name in The_ants["invtransforms"]],
+            "seconds": round(time.time() - start, 3),
+        }
+        with open(os.path.join(Folder, "Template_registration.json"), "w") as f:
+            json.dump(The_registration, f, indent=1)
+
+        The_result["Registered"] = True
+
+    The_warped_file = os.path.join(Folder, "RAMP_The_resection_mask_in_TEMPLATE.nii.gz")
+
+    if The_result["Registered"] or not os.path.isfile(The_warped_file) or os.path.getmtime(The_warped_file) < os.path.getmtime(The_mask_file):
+
+        The_mask = ants.image_read(The_mask_file)
+        The_warped = ants.apply_transforms(fixed=Worker_template, moving=The_mask, transformlist=[os.path.join(Folder, name) for name in The_registration["fwdtransforms"]], interpolator="linear")
+        The_warped = ants.threshold_image(The_warped, 0.5, 1e9)
+        The_warped.image_write(The_warped_file, ri=True)
+
+        The_result["Warped"] = True
+
+    The_warped = ants.image_read(The_warped_file).numpy() > 0
+
+    The_result["Template_voxels"] = int(The_warped.sum())
+    The_result["Time_SEC"] = time.time() - start
+
+    if not The_result["Template_voxels"]:
+        return The_result, None, None
+
+    The_bbox = [(int(c.min()), int(c.max()) + 1) for c in np.nonzero(The_warped)]
+
+    return The_result, The_bbox, The_warped[tuple(slice(start, stop) for start, stop in The_bbox)]
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    RAMPS_arguments = parser.parse_args()
+
+    for path in [RAMPS_arguments.Manifest, RAMPS_arguments.Template]:
+        if not os.path.isfile(path):
+            print("Error - This file is not detected : " + path)
+            sys.exit(1)
+
+    import pandas as pd
+
+    Manifest = pd.read_csv(RAMPS_arguments.Manifest, dtype=str)
+
+    for column in ["ID", "Output_Folder"]:
+        if column not in Manifest.columns:
+            print("Error - The manifest is missing the column " + column)
+            sys.exit(1)
+
+    os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(RAMPS_arguments.threads)
+
+    import ants
+    import numpy as np
+
+    The_template = ants.image_read(RAMPS_arguments.Template)
+    key = Template_key(RAMPS_arguments.Template)
+
+    The_cases = Manifest.to_dict("records")
+
+    print("> RAMPS template maps --> " + str(len(The_cases)) + " cases into " + RAMPS_arguments.Template + " (" + key + ") on " + str(RAMPS_arguments.workers) + " workers x " + str(RAMPS_arguments.threads) + " threads")
+
+    The_frequency = np.zeros(The_template.shape, dtype=np.uint16)
+    The_results = []
+
+    start = time.time()
+
+    with ProcessPoolExecutor(max_workers=RAMPS_arguments.workers, initializer=Init_template_worker, initargs=(RAMPS_arguments.Template, RAMPS_arguments.threads)) as pool:
+
+        The_futures = {pool.submit(Warp_case, Case, key, RAMPS_arguments.transform, RAMPS_arguments.redo): Case for Case in The_cases}
+
+        for future in as_completed(The_futures):
+
+            try:
+                The_result, The_bbox, The_box_mask = future.result()
+            except Exception as e:
+                The_result, The_bbox, The_box_mask = {"ID": str(The_futures[future]["ID"]), "Error": repr(e)}, None, None
+
+            # Added as it arrives, the warped masks are never all held at once
+            if The_bbox is not None:
+                The_frequency[tuple(slice(start, stop) for start, stop in The_bbox)] += The_box_mask
+
+            The_results.append(The_result)
+
+            if The_result["Error"]:
+                print("> " + The_result["ID"] + " failed --> " + The_result["Error"], flush=True)
+            else:
+                print("> " + The_result["ID"] + " --> " + str(The_result["Template_voxels"]) + " template voxels in " + str(round(The_result["Time_SEC"], 1)) + " sec" + ("" if The_result["Registered"] else " (cached registration)"), flush=True)
+
+    # Back in manifest order
+    The_order = [str(Case["ID"]) for Case in The_cases]
+    The_table = pd.DataFrame(sorted(The_results, key=lambda The_result: The_order.index(The_result["ID"])))
+    The_warped_cases = int((The_table["Error"] == "").sum())
+
+    The_template.new_image_like(The_frequency.astype(np.float32)).image_write(RAMPS_arguments.Output_prefix + "_frequency.nii.gz", ri=True)
+    The_template.new_image_like((The_frequency / max(The_warped_cases, 1)).astype(np.float32)).image_write(RAMPS_arguments.Output_prefix + "_proportion.nii.gz", ri=True)
+    The_table.to_csv(RAMPS_arguments.Output_prefix + "_cases.csv", index=False)
+
+    print("")
+    print("> RAMPS template maps completed --> " + str(The_warped_cases) + " of " + str(len(The_cases)) + " cases in " + str(round(time.time() - start)) + " sec, most cases at one voxel " + str(int(The_frequency.max())))
+    print("> " + RAMPS_arguments.Output_prefix + "_frequency.nii.gz")
@@ -0,0 +1,146 @@
+# ========================================
+# RAMPS - External tools
+# Resection Automated Mask in Pre-operative Space
+#
+# mri_synthstrip and SynthSeg run as their own processes. Run_tool starts one and keeps an eye on it
+# - its output goes to a log file next to what it writes
+# - it is stopped (with everything it started) once it has run for longer than its timeout
+# - it has failed if it does not exit with 0 or any of the files it should write is missing, it is then run again up to
+#   its number of retries, and a RuntimeError is raised (naming the log) if the last attempt fails too
+# - its threads are set through the environment (OMP, ITK and TensorFlow) and its memory is capped with an rlimit on
+#   its data (RLIMIT_DATA, the memory it writes to, not the address space TensorFlow reserves and never uses), set from
+#   here once it has started (Linux) as the writer threads (see RAMP_writer.py) make preexec_fn unsafe
+# Every attempt is added to <Output_Folder>/RAMP_Tools.csv (when it started, tool, attempt, exit code, seconds, timed out,
+# missing outputs, log) and sent as a tool_end event, so a batch run can tell which tool failed and why
+#
+# Tool_settings are the defaults for each tool, --tool_timeout / --tool_retries / --tool_memory_gb of RAMP.py and
+# RAMP_scheduler.py change them for every tool (Configure_tools)
+# ========================================
+
+### Imports ---
+
+import csv
+import os
+import os.path
+import signal
+import subprocess
+import time
+
+from RAMP_events import Emit_event
+
+# timeout (sec, None for no limit), retries (attempts after the first), memory_gb (data, None for no limit)
+Tool_settings = {
+    "mri_synthstrip": {"timeout": 1800, "retries": 1, "memory_gb": None},
+    "SynthSeg": {"timeout": 7200, "retries": 1, "memory_gb": None},
+}
+
+Tool_status_columns = ["Started", "Tool", "Attempt", "Exit_code", "Time_SEC", "Timed_out", "Missing_outputs", "Log"]
+
+# Change a setting for every tool, the ones left as None stay as they are
+def Configure_tools(timeout=None, retries=None, memory_gb=None):
+
+    for The_settings in Tool_settings.values():
+        for key, value in [("timeout", timeout), ("retries", retries), ("memory_gb", memory_gb)]:
+            if value is not None:
+                The_settings[key] = value
+
+def Tool_environment(threads=None):
+
+    The_environment = dict(os.environ)
+
+    if threads is not None:
+        for name in ["OMP_NUM_THREADS", "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS", "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"]:
+            The_environment[name] = str(threads)
+
+    return The_environment
+
+# Cap the data of a tool that has just started, what it starts from then on gets the same cap
+def Limit_memory(pid, memory_gb):
+
+    import resource
+
+    if not hasattr(resource, "prlimit"):
+        print("> The tool memory cap needs Linux, the tool runs without it", flush=True)
+        return
+
+    limit = int(memory_gb * 1024 ** 3)
+
+    try:
+        resource.prlimit(pid, resource.RLIMIT_DATA, (limit, limit))
+    except ProcessLookupError:
+        # It has already finished
+        pass
+
+# ========================================
+### Running ---
+
+# Run the command of tool (a key of Tool_settings) until it writes all of Outputs, see the top of this file
+def Run_tool(tool, The_command, Log_file, Outputs=(), threads=None, Output_Folder=None):
+
+    The_settings = Tool_settings[tool]
+
+    for attempt in range(1, The_settings["retries"] + 2):
+
+        # Nothing left from an attempt that stopped part way
+        for output in Outputs:
+            if os.path.isfile(output):
+                os.remove(output)
+
+        start = time.time()
+        timed_out = False
+
+        with open(Log_file, "w" if attempt == 1 else "a") as log:
+
+            log.write("> " + tool + " attempt " + str(attempt) + " : " + " ".join(The_command) + "\n")
+            log.flush()
+
+            # A session of its own, so a timeout stops everything the tool has started
+            The_process = subprocess.Popen(The_command, stdout=log, stderr=subprocess.STDOUT, env=Tool_environment(threads), start_new_session=True)
+
+            if The_settings["memory_gb"]:
+                Limit_memory(The_process.pid, The_settings["memory_gb"])
+
+            try:
+                The_process.wait(timeout=The_settings["timeout"])
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                os.killpg(The_process.pid, signal.SIGKILL)
+                The_process.wait()
+                log.write("> " + tool + " stopped after " + str(The_settings["timeout"]) + " sec\n")
+
+        The_missing = [output for output in Outputs if not os.path.isfile(output)]
+
+        The_row = {
+            "Started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start)),
+            "Tool": tool,
+            "Attempt": attempt,
+            "Exit_code": The_process.returncode,
+            "Time_SEC": round(time.time() - start, 3),
+            "Timed_out": timed_out,
+            "Missing_outputs": " ".join(os.path.basename(output) for output in The_missing),
+            "Log": Log_file,
+        }
+
+        if Output_Folder is not None:
+            Write_tool_status(Output_Folder, The_row)
+
+        Emit_event("tool_end", tool=tool, attempt=attempt, exit_code=The_process.returncode, seconds=The_row["Time_SEC"], timed_out=timed_out, missing_outputs=The_row["Missing_outputs"], log=Log_file)
+
+        if The_process.returncode == 0 and not The_missing:
+            return
+
+        reason = "timed out after " + str(The_settings["timeout"]) + " sec" if timed_out else "exit code " + str(The_process.returncode) + ("" if not The_missing else ", did not write " + The_row["Missing_outputs"])
+        print("> " + tool + " attempt " + str(attempt) + " failed --> " + reason + ", see " + Log_file, flush=True)
+
+    raise RuntimeError(tool + " failed (" + reason + ")" + (" on all " + str(attempt) + " attempts" if attempt > 1 else "") + ", see " + Log_file)
+
+def Write_tool_status(Output_Folder, The_row):
+
+    The_status_file = os.path.join(Output_Folder, "RAMP_Tools.csv")
+    new = not os.path.isfile(The_status_file)
+
+    with open(The_status_file, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=Tool_status_columns)
+        if new:
+            writer.writeheader()
+        writer.writerow(The_row)
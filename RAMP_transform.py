@@ -0,0 +1,194 @@
+# ========================================
+# RAMPS - Mapping between pre-op and post-op space
+# Resection Automated Mask in Pre-operative Space
+#
+# The registration of a case (S9_Registration, the folder chosen by Registration_folder, see RAMP_strategies.py) takes
+# the post-op image (moving) onto the pre-op image (fixed). Its transforms are read once here and used for any number of
+# images, label maps and point sets, in either direction, without registering again
+# - to_pre_op : post-op images onto the pre-op grid (br_1Warp, br_0GenericAffine), e.g. a post-op CT
+# - to_post_op : pre-op images onto the post-op grid (br_0GenericAffine inverted, br_1InverseWarp), e.g. the resection
+#   mask to show on the post-op image
+# Images are interpolated linearly and label maps with nearest neighbour (the transforms in memory cannot use genericLabel,
+# and multiLabel takes 40 times longer for about the same mask). Points go the other way through the transforms (a
+# point of the pre-op image is moved by the transforms that pull the post-op image onto it), Case_transforms keeps both
+#
+# Points are csv files with the columns x, y, z in mm (LPS, as ANTs and ITK, --ras for RAS as in Slicer / FreeSurfer),
+# any other columns (e.g. the name of each electrode contact) are kept
+#
+#   python RAMP_transform.py <Output_Folder> to_post_op --resection_mask --images a.nii.gz --points contacts.csv
+#   python RAMP_transform.py <Output_Folder> to_pre_op --label_maps b.nii.gz --reference <pre-op input>
+#
+# The grid is that of --reference, by default the image of the other side on the orig grid (S1_N4bias/<side>/Orig_N4bias
+# .nii.gz, as RAMP_The_resection_mask_in_ORIG.nii.gz), the input image of that side gives its own grid. Everything is
+# written to --output_folder (default <Output_Folder>/RAMPS_Transformed) with _in_PreOP / _in_PostOP added to its name
+# ========================================
+
+### Imports ---
+
+import argparse
+import os
+import os.path
+import sys
+import time
+
+from RAMP_strategies import Registration_folder
+
+Directions = ["to_pre_op", "to_post_op"]
+
+Direction_suffix = {"to_pre_op": "_in_PreOP", "to_post_op": "_in_PostOP"}
+
+def Default_reference_file(Output_Folder, direction):
+
+    return os.path.join(Output_Folder, "S1_N4bias", "Pre_op" if direction == "to_pre_op" else "Post_op", "Orig_N4bias.nii.gz")
+
+def Transformed_file(Output_Folder, filename, direction):
+
+    name = os.path.basename(filename)
+    for extension in [".nii.gz", ".nii", ".nrrd", ".mha", ".mhd", ".csv"]:
+        if name.endswith(extension):
+            return os.path.join(Output_Folder, name[:-len(extension)] + Direction_suffix[direction] + extension)
+
+    return os.path.join(Output_Folder, name + Direction_suffix[direction])
+
+# ========================================
+### Transforms ---
+
+# The transforms of a case, read once, for images and points in each direction
+def Case_transforms(Output_Folder):
+
+    import ants
+
+    reg_br = Registration_folder(Output_Folder)
+
+    for name in ["br_0GenericAffine.mat", "br_1Warp.nii.gz", "br_1InverseWarp.nii.gz"]:
+        if not os.path.isfile(os.path.join(reg_br, name)):
+            raise ValueError("The registration of " + Output_Folder + " is missing " + os.path.join(reg_br, name))
+
+    The_affine = ants.read_transform(os.path.join(reg_br, "br_0GenericAffine.mat"))
+    The_warp = ants.transform_from_displacement_field(ants.image_read(os.path.join(reg_br, "br_1Warp.nii.gz")))
+    The_inverse_warp = ants.transform_from_displacement_field(ants.image_read(os.path.join(reg_br, "br_1InverseWarp.nii.gz")))
+
+    # The same order as the transformlist of ants.apply_transforms
+    The_forward = ants.compose_ants_transforms([The_warp, The_affine])
+    The_inverse = ants.compose_ants_transforms([The_affine.invert(), The_inverse_warp])
+
+    return {
+        "folder": reg_br,
+        "images": {"to_pre_op": The_forward, "to_post_op": The_inverse},
+        "points": {"to_pre_op": The_inverse, "to_post_op": The_forward},
+    }
+
+# The_image (an ANTsImage) onto The_reference in the other space
+def Map_image(The_transforms, The_image, direction, The_reference, Label_map=False):
+
+    if The_image.dimension != 3 or The_image.components != 1:
+        raise ValueError("Only 3D images with one component can be mapped")
+
+    return The_transforms["images"][direction].apply_to_image(The_image, The_reference, interpolation="nearestneighbor" if Label_map else "linear")
+
+# The x, y, z columns of The_points (a DataFrame, in mm) in the other space, the other columns are kept
+def Map_points(The_transforms, The_points, direction, ras=False):
+
+    import numpy as np
+
+    for column in ["x", "y", "z"]:
+        if column not in The_points.columns:
+            raise ValueError("The points are missing the column " + column)
+
+    The_coordinates = The_points[["x", "y", "z"]].to_numpy(dtype=float)
+
+    # RAS to LPS and back
+    The_flip = np.array([-1.0, -1.0, 1.0]) if ras else np.ones(3)
+
+    The_transform = The_transforms["points"][direction]
+    The_mapped = np.array([The_transform.apply_to_point(tuple(point * The_flip)) for point in The_coordinates]).reshape(-1, 3) * The_flip
+
+    The_points = The_points.copy()
+    The_points[["x", "y", "z"]] = The_mapped
+
+    return The_points
+
+# ========================================
+### Run ---
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(prog="RAMP_transform.py", description="Map images, label maps and points between the pre-op and post-op space of a RAMPS case with its registration")
+    parser.add_argument("Output_Folder", help="RAMPS output folder of the case (its registration has run)")
+    parser.add_argument("Direction", choices=Directions, help="to_pre_op (post-op files onto the pre-op) or to_post_op (pre-op files onto the post-op)")
+    parser.add_argument("--images", nargs="+", default=[], help="images, interpolated linearly")
+    parser.add_argument("--label_maps", nargs="+", default=[], help="label maps / masks, interpolated with nearest neighbour")
+    parser.add_argument("--points", nargs="+", default=[], help="csv files with the columns x, y, z (mm)")
+    parser.add_argument("--resection_mask", action="store_true", help="add RAMP_The_resection_mask_in_ORIG.nii.gz of the case to the label maps")
+    parser.add_argument("--ras", action="store_true", help="the points are RAS (Slicer / FreeSurfer) rather than LPS (ANTs / ITK)")
+    parser.add_argument("--reference", default=None, help="image whose grid the images are written on (default the image of the other side on the orig grid)")
+    parser.add_argument("--output_folder", default=None, help="where to write them (default <Output_Folder>/RAMPS_Transformed)")
+
+    RAMPS_arguments = parser.parse_args()
+
+    Output_Folder = RAMPS_arguments.Output_Folder
+    direction = RAMPS_arguments.Direction
+
+    The_label_maps = list(RAMPS_arguments.label_maps)
+    if RAMPS_arguments.resection_mask:
+        The_label_maps.append(os.path.join(Output_Folder, "RAMPS_Resection_Mask_Output", "RAMP_The_resection_mask_in_ORIG.nii.gz"))
+
+    The_images = RAMPS_arguments.images + The_label_maps
+
+    if not The_images and not RAMPS_arguments.points:
+        print("Error - Nothing to map, give --images, --label_maps, --points or --resection_mask")
+        sys.exit(1)
+
+    Reference_file = RAMPS_arguments.reference or Default_reference_file(Output_Folder, direction)
+
+    for filename in The_images + RAMPS_arguments.points + ([Reference_file] if The_images else []):
+        if not os.path.exists(filename):
+            print("Error - This file is not detected : " + filename)
+            sys.exit(1)
+
+    import pandas as pd
+
+    from RAMP_images import Read_input_image
+
+    start = time.time()
+
+    try:
+        The_transforms = Case_transforms(Output_Folder)
+    except ValueError as e:
+        print("Error - " + str(e))
+        sys.exit(1)
+
+    print("> Registration --> " + The_transforms["folder"], flush=True)
+
+    Transformed_folder = RAMPS_arguments.output_folder or os.path.join(Output_Folder, "RAMPS_Transformed")
+    if not os.path.exists(Transformed_folder):
+        os.makedirs(Transformed_folder)
+
+    if The_images:
+        The_reference = Read_input_image(Reference_file)
+
+    for filename in The_images:
+
+        Label_map = filename in The_label_maps
+
+        try:
+            The_mapped = Map_image(The_transforms, Read_input_image(filename), direction, The_reference, Label_map=Label_map)
+        except ValueError as e:
+            print("Error - " + filename + " : " + str(e))
+            sys.exit(1)
+
+        The_mapped.image_write(Transformed_file(Transformed_folder, filename, direction), ri=True)
+        print("> " + ("Label map " if Label_map else "Image ") + filename + " --> " + Transformed_file(Transformed_folder, filename, direction), flush=True)
+
+    for filename in RAMPS_arguments.points:
+
+        try:
+            The_mapped = Map_points(The_transforms, pd.read_csv(filename), direction, ras=RAMPS_arguments.ras)
+        except ValueError as e:
+            print("Error - " + filename + " : " + str(e))
+            sys.exit(1)
+
+        The_mapped.to_csv(Transformed_file(Transformed_folder, filename, direction), index=False)
+        print("> " + str(len(The_mapped)) + " points " + filename + " --> " + Transformed_file(Transformed_folder, filename, direction), flush=True)
+
+    print("> Mapped " + str(len(The_images) + len(RAMPS_arguments.points)) + " files " + direction + " in " + str(round(time.time() - start, 1)) + " sec")
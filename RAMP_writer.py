@@ -0,0 +1,168 @@
+# ========================================
+# RAMPS - Background image writer
+# Resection Automated Mask in Pre-operative Space
+#
+# Every output image of a stage is a gzipped NIfTI, and gzip of a 256 x 256 x 256 volume on one core holds up the stage
+# each time (well over a hundred times a run). Between Start_writer and Finish_writes, Write_image only takes a copy of
+# the image and the writing is done on a small pool of threads while the stage carries on
+# - Write_image(The_image, filename) : an ANTsImage or a nibabel image, written as image_write(..., ri=True) / nib.save
+#   would, straight away when no writer is running (e.g. in the RAMP_hypothesis.py / RAMP_sweep.py workers)
+# - Wait_for_writes(filename, ...) : wait for these files (all of them if none are given), before a file that was just
+#   written is read back or handed to SynthStrip / SynthSeg
+# - Finish_writes() : wait for every write, check each file (the NIfTI header reads back with the right shape) and stop
+#   the writer, a write that failed is raised here
+#
+# The images are written with nibabel, whose gzip (zlib) lets go of the GIL while it compresses, ITK (image_write) holds
+# it, so the copies are turned into nibabel images in the same space (ANTs LPS to NIfTI RAS, qform and sform code 1 as
+# ITK writes them). Each file is written to a temporary name and moved into place once it is complete
+# At most Writer_max_pending copies are held at once, Write_image waits for a free place when they are all taken
+# ========================================
+
+### Imports ---
+
+import os
+import os.path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+Writer_threads = 2
+Writer_max_pending = 8
+
+The_writer = None
+
+# A worker process forked while the writer was running has a copy of The_writer but none of its threads
+def Writer_running():
+
+    return The_writer is not None and The_writer["pid"] == os.getpid()
+
+# ========================================
+### Snapshots ---
+
+# A nibabel image of The_image that does not change if The_image does
+def Snapshot(The_image):
+
+    import nibabel as nib
+    import numpy as np
+
+    if isinstance(The_image, nib.Nifti1Image):
+        The_copy = nib.Nifti1Image(np.array(np.asanyarray(The_image.dataobj)), The_image.affine, The_image.header.copy())
+        return The_copy
+
+    # An ANTsImage, numpy() is already a copy
+    The_data = The_image.numpy()
+
+    The_affine = np.eye(4)
+    The_affine[:3, :3] = np.asarray(The_image.direction) * np.asarray(The_image.spacing)
+    The_affine[:3, 3] = The_image.origin
+    # LPS to RAS
+    The_affine[:2, :] *= -1
+
+    The_copy = nib.Nifti1Image(The_data, The_affine)
+    The_copy.set_qform(The_affine, code=1)
+    The_copy.set_sform(The_affine, code=1)
+    The_copy.header.set_xyzt_units("mm", "sec")
+
+    return The_copy
+
+def Save_snapshot(The_copy, filename):
+
+    import nibabel as nib
+
+    # The temporary name keeps the .nii.gz ending so nibabel compresses it
+    The_temporary = os.path.join(os.path.dirname(filename) or ".", ".writing_" + str(threading.get_ident()) + "_" + os.path.basename(filename))
+
+    nib.save(The_copy, The_temporary)
+
+    # Check it reads back before it takes the place of the file
+    if nib.load(The_temporary).shape != The_copy.shape:
+        raise OSError("The image written to " + filename + " does not read back")
+
+    os.replace(The_temporary, filename)
+
+# ========================================
+### Writer ---
+
+def Start_writer(threads=None, max_pending=None):
+
+    global The_writer
+
+    # One left running by a stage that raised, its writes went with that stage
+    if Writer_running():
+        try:
+            Finish_writes()
+        except Exception:
+            The_writer = None
+
+    The_writer = {
+        "pid": os.getpid(),
+        "pool": ThreadPoolExecutor(max_workers=threads or Writer_threads, thread_name_prefix="RAMPS_writer"),
+        "places": threading.BoundedSemaphore(max_pending or Writer_max_pending),
+        "pending": {},
+        "written": 0,
+        "waited": 0.0,
+    }
+
+def Write_image(The_image, filename):
+
+    if not Writer_running():
+        if hasattr(The_image, "image_write"):
+            The_image.image_write(filename, ri=True)
+        else:
+            import nibabel as nib
+            nib.save(The_image, filename)
+        return
+
+    # A file written twice, the second must land last
+    Wait_for_writes(filename)
+
+    start = time.time()
+    The_writer["places"].acquire()
+    The_writer["waited"] += time.time() - start
+
+    try:
+        The_copy = Snapshot(The_image)
+        future = The_writer["pool"].submit(Save_snapshot, The_copy, filename)
+    except BaseException:
+        The_writer["places"].release()
+        raise
+
+    future.add_done_callback(lambda _: The_writer["places"].release())
+    The_writer["pending"][os.path.abspath(filename)] = future
+
+def Wait_for_writes(*filenames):
+
+    if not Writer_running():
+        return
+
+    if filenames:
+        The_keys = [os.path.abspath(filename) for filename in filenames]
+    else:
+        The_keys = list(The_writer["pending"])
+
+    for key in The_keys:
+        future = The_writer["pending"].pop(key, None)
+        if future is not None:
+            start = time.time()
+            future.result()
+            The_writer["waited"] += time.time() - start
+            The_writer["written"] += 1
+
+# Wait for everything, check it and stop, returns the number of files written and the time the stage spent waiting
+def Finish_writes():
+
+    global The_writer
+
+    if not Writer_running():
+        return 0, 0.0
+
+    try:
+        Wait_for_writes()
+    finally:
+        The_writer["pool"].shutdown(wait=True)
+        written, waited = The_writer["written"], The_writer["waited"]
+        The_writer = None
+
+    print("> " + str(written) + " images written in the background, " + str(round(waited, 1)) + " sec spent waiting for them", flush=True)
+
+    return written, waited
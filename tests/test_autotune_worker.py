@@ -0,0 +1,23 @@
+# An autotune benchmark worker (RAMP_autotune.py) runs the benchmark once for each go, and stops as soon as it is told
+
+import io
+import json
+
+import pytest
+
+import RAMP_autotune
+
+@pytest.mark.parametrize("The_messages, runs", [("go\nstop\n", 1), ("stop\n", 0), ("", 0), ("go\ngo\nstop\ngo\n", 2)])
+def test_worker_checks_for_stop(monkeypatch, capsys, The_messages, runs):
+
+    The_runs = []
+    monkeypatch.setattr(RAMP_autotune, "Prepare_benchmark", lambda *arguments: lambda: The_runs.append(1))
+    monkeypatch.setattr("sys.stdin", io.StringIO(The_messages))
+
+    RAMP_autotune.Benchmark_worker("n4", "grid.nii.gz", 1, 0)
+
+    The_lines = capsys.readouterr().out.splitlines()
+
+    assert len(The_runs) == runs
+    assert The_lines[0] == "ready"
+    assert [sorted(json.loads(line)) for line in The_lines[1:]] == [["base_mb", "end", "memory_mb", "start"]] * runs
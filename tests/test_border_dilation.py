@@ -0,0 +1,59 @@
+# The step 13 narrow band boundary dilation must give the same result as the full volume version
+
+import numpy as np
+import pytest
+
+from RAMP_cavity import Full_volume_border_dilation, Narrow_band_border_dilation
+
+def Check_same(The_base_data, The_border_data, Max_distance=3):
+
+    The_full = Full_volume_border_dilation(The_base_data, The_border_data, Max_distance)
+    The_narrow = Narrow_band_border_dilation(The_base_data, The_border_data, Max_distance)
+
+    assert np.array_equal(The_narrow, The_full)
+
+# The nearest border voxel of part of the box is outside the box of the first margin
+def test_border_outside_the_box():
+
+    The_base_data = np.zeros((100, 20, 20))
+    The_base_data[20:51, 5:15, 5:15] = 1
+
+    The_border_data = np.zeros_like(The_base_data)
+    The_border_data[52, 10, 10] = 1
+    The_border_data[9, 10, 10] = 1
+
+    Check_same(The_base_data, The_border_data)
+    assert np.count_nonzero(Narrow_band_border_dilation(The_base_data, The_border_data)) == 3024
+
+def test_no_border_in_the_box():
+
+    The_base_data = np.zeros((80, 20, 20))
+    The_base_data[5:10, 5:10, 5:10] = 1
+
+    The_border_data = np.zeros_like(The_base_data)
+    The_border_data[70, 10, 10] = 1
+
+    Check_same(The_base_data, The_border_data)
+
+def test_empty():
+
+    The_base_data = np.zeros((20, 20, 20))
+    The_border_data = np.zeros_like(The_base_data)
+    The_border_data[3, 3, 3] = 1
+
+    assert not Narrow_band_border_dilation(The_base_data, The_border_data).any()
+
+@pytest.mark.parametrize("seed", range(100))
+def test_random(seed):
+
+    rng = np.random.default_rng(seed)
+
+    shape = tuple(int(n) for n in rng.integers(15, 45, 3))
+    The_base_data = np.zeros(shape)
+    The_border_data = np.zeros(shape)
+
+    start = [int(rng.integers(0, n - 3)) for n in shape]
+    The_base_data[tuple(slice(s, s + int(rng.integers(1, 8))) for s in start)] = 1
+    The_border_data[rng.random(shape) < rng.choice([0.0005, 0.003, 0.02])] = 1
+
+    Check_same(The_base_data, The_border_data, float(rng.choice([2, 3, 4.5])))
@@ -0,0 +1,115 @@
+# RAMP.py has to start quickly, the whole command (the interpreter and every import, not just what --check times from
+# Start_time) is timed here, and the heavy libraries must only be imported once the inputs have been checked
+# The input checks are run on tiny images with a copy of RAMPS set up as it would be (a fake FREESURFER_HOME and
+# SynthSeg) under tmp_path
+
+import glob
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import time
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+Location_of_repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Wall clock seconds for python RAMP.py --help, from starting the interpreter to its exit
+Startup_budget_seconds = 3.0
+
+# Wall clock seconds for the input checks to pass or fail, the same budget as --help
+Check_budget_seconds = 3.0
+
+# The same as Check_heavy_modules in RAMP.py
+Heavy_modules = ["ants", "pandas", "scipy.ndimage", "tensorflow", "torch"]
+
+def Run_timed(The_arguments, Location=Location_of_repository, env=None):
+
+    start = time.time()
+    The_result = subprocess.run([sys.executable, "-X", "importtime", os.path.join(Location, "RAMP.py")] + The_arguments, cwd=Location, capture_output=True, text=True, env=env)
+
+    return The_result, time.time() - start
+
+# The modules the interpreter imported, from the -X importtime lines on stderr ("import time: self | cumulative | name")
+def Imported_modules(stderr):
+
+    return set(line.split("|")[-1].strip() for line in stderr.splitlines() if line.startswith("import time:") and line.count("|") == 2)
+
+def test_help_is_quick():
+
+    The_result, seconds = Run_timed(["--help"])
+
+    assert The_result.returncode == 0
+    assert "usage" in The_result.stdout
+    assert seconds < Startup_budget_seconds
+
+def test_help_does_not_import_heavy_modules():
+
+    The_result, _ = Run_timed(["--help"])
+
+    The_modules = Imported_modules(The_result.stderr)
+
+    assert "argparse" in The_modules
+    assert not [module for module in Heavy_modules if module in The_modules]
+
+# ========================================
+### Input checks ---
+
+# A copy of RAMPS with the tools it checks for, two tiny images and an output folder
+@pytest.fixture
+def The_setup(tmp_path):
+
+    Location = tmp_path / "RAMPS"
+    Location.mkdir()
+    for filename in glob.glob(os.path.join(Location_of_repository, "RAMP*.py")) + [os.path.join(Location_of_repository, "fakesurfer_orig.nii.gz")]:
+        shutil.copy(filename, Location)
+
+    Synthseg = Location / "Place_SynthSeg_here" / "SynthSeg" / "scripts" / "commands"
+    Synthseg.mkdir(parents=True)
+    (Synthseg / "SynthSeg_predict.py").write_text("")
+
+    Freesurfer = tmp_path / "freesurfer"
+    (Freesurfer / "python" / "scripts").mkdir(parents=True)
+    (Freesurfer / "python" / "scripts" / "mri_synthstrip").write_text("")
+
+    for name in ["pre", "post"]:
+        nib.save(nib.Nifti1Image(np.random.default_rng(0).random((8, 8, 8), dtype=np.float32), np.eye(4)), str(tmp_path / (name + ".nii.gz")))
+
+    (tmp_path / "bad.nii.gz").write_bytes(b"not an image")
+    (tmp_path / "output").mkdir()
+
+    return {"Location": str(Location), "Folder": tmp_path, "env": dict(os.environ, FREESURFER_HOME=str(Freesurfer))}
+
+def Run_check(The_setup, pre, post, *options):
+
+    Folder = The_setup["Folder"]
+
+    return Run_timed([str(Folder / pre), str(Folder / post), str(Folder / "output"), "P1", "L", "T"] + list(options), Location=The_setup["Location"], env=The_setup["env"])
+
+def test_check_passes_quickly(The_setup):
+
+    The_result, seconds = Run_check(The_setup, "pre.nii.gz", "post.nii.gz", "--check")
+
+    assert The_result.returncode == 0, The_result.stdout
+    assert "All the inputs look good" in The_result.stdout
+    assert seconds < Check_budget_seconds
+    assert not [module for module in Heavy_modules if module in Imported_modules(The_result.stderr)]
+
+@pytest.mark.parametrize("pre, post, options", [
+    ("bad.nii.gz", "post.nii.gz", []),
+    ("pre.nii.gz", "missing.nii.gz", []),
+    ("pre.nii.gz", "bad.nii.gz", ["--check"]),
+    ("pre.nii.gz", "post.nii.gz", ["--n4_iterations", "0x"]),
+])
+def test_bad_inputs_fail_quickly(The_setup, pre, post, options):
+
+    The_result, seconds = Run_check(The_setup, pre, post, *options)
+
+    assert The_result.returncode == 1
+    assert "Error" in The_result.stdout
+    assert seconds < Check_budget_seconds
+    # Nothing heavy (ants, TensorFlow) has been loaded by the time the inputs are found to be bad
+    assert not [module for module in Heavy_modules if module in Imported_modules(The_result.stderr)]
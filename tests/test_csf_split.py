@@ -0,0 +1,85 @@
+# Step 9 CSF split in NumPy (RAMP_cavity.py), the exact two class threshold, the two Gaussian fit that goes on from it
+# and the CSF being the darker class
+
+import numpy as np
+import pytest
+
+from RAMP_cavity import Numpy_csf_split, Two_class_gaussian, Two_class_threshold
+
+# The sum of squares about the class means of a split at threshold
+def Split_sse(The_values, threshold):
+
+    return sum(((The_class - The_class.mean()) ** 2).sum() for The_class in [The_values[The_values < threshold], The_values[The_values >= threshold]])
+
+# Every cut between two different sorted values, the smallest sum of squares
+def Brute_force_sse(The_values):
+
+    The_sorted = np.sort(The_values)
+    The_cuts = [(low + high) / 2 for low, high in zip(The_sorted[:-1], The_sorted[1:]) if low != high]
+
+    return min(Split_sse(The_values, cut) for cut in The_cuts)
+
+@pytest.mark.parametrize("seed", range(40))
+def test_threshold_is_the_best_cut(seed):
+
+    The_random = np.random.default_rng(seed)
+    n = int(The_random.integers(2, 200))
+    # Rounded on some seeds so there are ties
+    The_values = The_random.normal(0, 1, n) * The_random.uniform(0.1, 100) + The_random.uniform(-50, 50)
+    if seed % 2:
+        The_values = np.round(The_values)
+    if len(np.unique(The_values)) < 2:
+        The_values[0] += 1
+
+    threshold = Two_class_threshold(The_values)
+
+    assert threshold is not None
+    # Between two values, so it splits the values the same way as the cut it was made from
+    assert not np.any(The_values == threshold)
+    assert Split_sse(The_values, threshold) == pytest.approx(Brute_force_sse(The_values), rel=1e-9, abs=1e-9)
+
+@pytest.mark.parametrize("The_values", [[], [3.0], [5.0] * 10, np.zeros(100)])
+def test_threshold_of_constant_or_empty(The_values):
+
+    assert Two_class_threshold(The_values) is None
+
+def test_gaussian_finds_the_two_means():
+
+    The_random = np.random.default_rng(0)
+    The_low = The_random.normal(20, 3, 4000)
+    The_high = The_random.normal(80, 10, 6000)
+    The_values = np.concatenate([The_low, The_high])
+
+    The_probability = Two_class_gaussian(The_values, Two_class_threshold(The_values))
+
+    The_is_high = The_probability >= 0.5
+    assert The_values[~The_is_high].mean() == pytest.approx(20, abs=0.5)
+    assert The_values[The_is_high].mean() == pytest.approx(80, abs=0.5)
+    assert The_is_high[:4000].mean() < 0.01
+    assert The_is_high[4000:].mean() > 0.99
+
+@pytest.mark.parametrize("method", ["kmeans", "gaussian"])
+def test_csf_is_the_darker_class(method):
+
+    The_random = np.random.default_rng(1)
+    The_post_op = np.zeros((20, 20, 20))
+    The_cavity = np.zeros(The_post_op.shape, dtype=bool)
+    The_cavity[2:18, 2:18, 2:18] = True
+
+    # Dark CSF in the lower half of the cavity, bright tissue in the upper half
+    The_dark = The_cavity.copy()
+    The_dark[:, :, 10:] = False
+    The_post_op[The_dark] = The_random.normal(10, 1, The_dark.sum())
+    The_post_op[The_cavity & ~The_dark] = The_random.normal(60, 5, (The_cavity & ~The_dark).sum())
+
+    The_csf = Numpy_csf_split(The_post_op, The_cavity, method=method)
+
+    assert np.array_equal(The_csf, The_dark)
+
+def test_csf_of_a_cavity_that_cannot_be_split():
+
+    The_post_op = np.full((5, 5, 5), 7.0)
+    The_cavity = np.zeros(The_post_op.shape, dtype=bool)
+    The_cavity[1:4, 1:4, 1:4] = True
+
+    assert np.array_equal(Numpy_csf_split(The_post_op, The_cavity), The_cavity)
@@ -0,0 +1,70 @@
+# The mask voxels in each lobe region, the same labels in the store (RAMP_store.py) and the volume by region (RAMP_regions.py)
+
+import os
+
+import h5py
+import nibabel as nib
+import numpy as np
+
+from RAMP_regions import Write_region_volumes
+from RAMP_store import Append_case, Case_atlas_file, Case_mask_file, Lobe_regions, Open_store, Read_case
+
+def Make_case(Output_Folder):
+
+    The_atlas = np.zeros((6, 6, 6), dtype=np.float32)
+    The_atlas[:2] = 11
+    The_atlas[2:4] = 50
+    The_atlas[4] = 7
+
+    The_mask = np.zeros((6, 6, 6), dtype=np.uint8)
+    The_mask[1:6, 0, 0] = 1
+
+    for The_file, The_data in [(Case_atlas_file(Output_Folder), The_atlas), (Case_mask_file(Output_Folder), The_mask)]:
+        os.makedirs(os.path.dirname(The_file), exist_ok=True)
+        nib.save(nib.Nifti1Image(The_data, np.eye(4)), The_file)
+
+def test_no_go_is_its_own_region(tmp_path):
+
+    Make_case(str(tmp_path))
+
+    The_case = Read_case(str(tmp_path), "A")
+    The_counts = dict(zip(Lobe_regions.values(), The_case["Lobe_voxels"].tolist()))
+
+    # Label 7 is not a lobe, it is outside them
+    assert (The_counts["Left_Frontal"], The_counts["No_Go"], The_counts["Outside"]) == (1, 2, 2)
+
+    The_table = Write_region_volumes(str(tmp_path))
+    The_lobes = The_table[The_table["Atlas"] == "Lobe"].set_index("Region")["Resected_voxels"]
+
+    for name in ["Left_Frontal", "No_Go"]:
+        assert The_lobes[name] == The_counts[name]
+
+def test_older_store_keeps_its_columns(tmp_path):
+
+    Make_case(str(tmp_path))
+    Store_file = str(tmp_path / "Store.h5")
+
+    # A store made when No_Go was counted as Outside
+    with Open_store(Store_file, "a") as The_store:
+        The_labels = [label for label in Lobe_regions if label != 50]
+        del The_store["index/Lobe_voxels"]
+        The_store["index"].create_dataset("Lobe_voxels", shape=(0, len(The_labels)), maxshape=(None, len(The_labels)), dtype=np.int64, chunks=(256, len(The_labels)))
+        The_store["index/Lobe_voxels"].attrs["labels"] = The_labels
+        The_store["index/Lobe_voxels"].attrs["names"] = [Lobe_regions[label] for label in The_labels]
+        Append_case(The_store, Read_case(str(tmp_path), "A"))
+
+    with h5py.File(Store_file, "r") as The_store:
+        The_counts = dict(zip(The_labels, The_store["index/Lobe_voxels"][0].tolist()))
+
+    assert (The_counts[11], The_counts[0]) == (1, 4)
+
+def test_atlases_in_memory(tmp_path):
+
+    Make_case(str(tmp_path))
+    The_from_files = Write_region_volumes(str(tmp_path))
+
+    The_atlases = {"Lobe": nib.load(Case_atlas_file(str(tmp_path))).get_fdata()}
+    os.remove(Case_atlas_file(str(tmp_path)))
+
+    # The Lobe rows are the same without the file, SynthSeg (neither in memory nor on disk) is left out in both
+    assert Write_region_volumes(str(tmp_path), The_atlases=The_atlases).equals(The_from_files)
@@ -0,0 +1,29 @@
+# The N4 settings of a case, from the command line with the N4_* manifest columns / job keys on top (RAMP_n4.py)
+
+import math
+
+import pytest
+
+from RAMP_n4 import N4_presets, Case_n4_settings, Make_n4_settings
+
+def test_no_columns_is_the_command_line():
+
+    assert Case_n4_settings({"ID": "A"}) == N4_presets["default"]
+    assert Case_n4_settings({"ID": "A"}, "fast", shrink_factor=3) == Make_n4_settings("fast", shrink_factor=3)
+
+def test_columns_change_the_command_line():
+
+    The_settings = Case_n4_settings({"N4_preset": "thorough", "N4_shrink": "3", "N4_iterations": "20x10", "N4_spline_distance": "150", "N4_mask": "none"}, "fast", shrink_factor=8)
+
+    assert The_settings == dict(N4_presets["thorough"], shrink_factor=3, iterations=[20, 10], spline_distance=150.0, mask=None)
+
+def test_empty_cells_keep_the_command_line():
+
+    # An empty cell of a manifest read with dtype=str is NaN
+    assert Case_n4_settings({"N4_preset": math.nan, "N4_shrink": "", "N4_mask": None}, "fast", shrink_factor=3) == Make_n4_settings("fast", shrink_factor=3)
+
+@pytest.mark.parametrize("The_case", [{"N4_preset": "quick"}, {"N4_shrink": "two"}, {"N4_shrink": "0"}, {"N4_mask": "brain"}])
+def test_bad_columns(The_case):
+
+    with pytest.raises(ValueError):
+        Case_n4_settings(The_case)
@@ -0,0 +1,93 @@
+# The shared folder queue with several worker processes on dummy jobs: every case runs once, a failing case is tried
+# --max_attempts times, a stale claim is taken back, and nothing is left in claims/ or clock/
+
+import os
+import os.path
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from RAMP_queue import RAMPS_queue
+
+Location_of_repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Writes a line to the record, waits a little so the workers overlap, and fails for the IDs that start with fail
+Dummy_job = """
+import sys, os, time
+with open(sys.argv[2], "a") as f:
+    f.write(sys.argv[1] + "\\n")
+time.sleep(0.2)
+sys.exit(1 if sys.argv[1].startswith("fail") else 0)
+"""
+
+def Run_queue(tmp_path, The_IDs, workers=4, stale_after=600):
+
+    Job_file = tmp_path / "dummy_job.py"
+    Job_file.write_text(Dummy_job)
+
+    Manifest_file = tmp_path / "manifest.csv"
+    pd.DataFrame({"ID": The_IDs}).to_csv(Manifest_file, index=False)
+
+    Queue_folder = tmp_path / "queue"
+    Record_file = tmp_path / "record.txt"
+
+    The_result = subprocess.run([sys.executable, os.path.join(Location_of_repository, "RAMP_queue.py"), str(Manifest_file), str(Queue_folder),
+                                 "--workers", str(workers), "--max_attempts", "2", "--poll", "0.1", "--heartbeat", "0.2", "--stale_after", str(stale_after),
+                                 "--command", "{python} " + str(Job_file) + " {ID} " + str(Record_file)], capture_output=True, text=True, timeout=120)
+
+    assert The_result.returncode == 0, The_result.stdout + The_result.stderr
+
+    The_runs = Record_file.read_text().split() if Record_file.exists() else []
+
+    return Queue_folder, The_runs, The_result.stdout
+
+def test_concurrent_workers(tmp_path):
+
+    The_IDs = ["case_" + str(i) for i in range(12)] + ["fail_0", "fail_1"]
+
+    Queue_folder, The_runs, _ = Run_queue(tmp_path, The_IDs)
+
+    for ID in The_IDs:
+        if ID.startswith("fail"):
+            assert The_runs.count(ID) == 2
+            assert os.path.isfile(Queue_folder / "failed" / (ID + ".failed"))
+            assert not os.path.isfile(Queue_folder / "done" / (ID + ".done"))
+        else:
+            # The O_EXCL claim lets only one worker run it
+            assert The_runs.count(ID) == 1
+            assert os.path.isfile(Queue_folder / "done" / (ID + ".done"))
+
+    assert os.listdir(Queue_folder / "claims") == []
+    assert os.listdir(Queue_folder / "clock") == []
+
+    # Running again finds nothing left to do
+    Queue_folder, The_runs_again, _ = Run_queue(tmp_path, The_IDs)
+    assert len(The_runs_again) == len(The_runs)
+
+def test_stale_claim_is_taken_back(tmp_path):
+
+    Queue_folder = tmp_path / "queue"
+    The_queue = RAMPS_queue(str(Queue_folder), stale_after=5)
+
+    # A node that died while running case_0, its claim has not been touched for a minute
+    claim = The_queue.Path("claims", "case_0.claim")
+    assert The_queue.Create(claim, "dead_node.1")
+    os.utime(claim, (time.time() - 60, time.time() - 60))
+
+    # A claim that is still fresh is left alone
+    fresh = The_queue.Path("claims", "case_1.claim")
+    assert The_queue.Create(fresh, "live_node.1")
+    assert The_queue.Claim("case_1", 2) is None
+    assert The_queue.Read(fresh) == "live_node.1"
+    os.remove(fresh)
+    The_queue.Close()
+
+    Queue_folder, The_runs, stdout = Run_queue(tmp_path, ["case_0", "case_1"], workers=2, stale_after=5)
+
+    assert "taking back the stale claim on case_0 from dead_node.1" in stdout
+    assert sorted(The_runs) == ["case_0", "case_1"]
+    assert os.path.isfile(Queue_folder / "done" / "case_0.done")
+    assert os.listdir(Queue_folder / "claims") == []
+    assert os.listdir(Queue_folder / "clock") == []
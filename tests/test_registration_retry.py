@@ -0,0 +1,85 @@
+# The retry of a registration that failed its check (RAMP_qc.py): the same masks as the chosen strategy, its own folder,
+# and a record of which registration is used (RAMP_strategies.py)
+
+import os
+
+import pandas as pd
+import pytest
+
+import RAMP_events
+from RAMP_strategies import Add_retry_row, Register_strategy, Registration_folder, Retry_folder, Selected_strategy, Strategy_folder, Strategy_transforms, Write_selected_strategy
+
+def Make_registration(Output_Folder, name):
+
+    Folder = Strategy_folder(str(Output_Folder), name)
+    os.makedirs(Folder, exist_ok=True)
+    open(os.path.join(Folder, "br_1Warp.nii.gz"), "w").close()
+    return Folder
+
+def test_registration_folder_follows_the_retry(tmp_path):
+
+    Make_registration(tmp_path, "reg_br")
+    Make_registration(tmp_path, "reg_None_resected")
+
+    Write_selected_strategy(str(tmp_path), "reg_None_resected")
+    assert Selected_strategy(str(tmp_path)) == ("reg_None_resected", False)
+    assert Registration_folder(str(tmp_path)) == Strategy_folder(str(tmp_path), "reg_None_resected")
+
+    # The retry has not written its warp yet
+    Write_selected_strategy(str(tmp_path), "reg_None_resected", retry=True)
+    assert Registration_folder(str(tmp_path)) == Strategy_folder(str(tmp_path), "reg_br")
+
+    Make_registration(tmp_path, "reg_None_resected_retry")
+    assert Selected_strategy(str(tmp_path)) == ("reg_None_resected", True)
+    assert Registration_folder(str(tmp_path)) == Retry_folder(str(tmp_path), "reg_None_resected")
+
+def test_retry_row_is_selected(tmp_path):
+
+    Make_registration(tmp_path, "reg_br")
+    The_csv = os.path.join(str(tmp_path), "S9_Registration", "Registration_strategies.csv")
+    pd.DataFrame([
+        {"Strategy": "reg_br", "Correlation": 0.9, "Jacobian_min": 0.2, "Folded_voxels": 0, "Time_SEC": 10.0, "Error": None, "Selected": True},
+        {"Strategy": "reg_None_resected", "Correlation": 0.8, "Jacobian_min": 0.1, "Folded_voxels": 0, "Time_SEC": 12.0, "Error": None, "Selected": False},
+    ]).to_csv(The_csv, index=False)
+
+    # A second retry replaces the row of the first
+    for correlation in [0.91, 0.95]:
+        Add_retry_row(str(tmp_path), {"Strategy": "reg_br_retry", "Correlation": correlation, "Jacobian_min": 0.3, "Folded_voxels": 0, "Time_SEC": 20.0, "Error": None})
+
+    The_rows = pd.read_csv(The_csv)
+    assert list(The_rows["Strategy"]) == ["reg_br", "reg_None_resected", "reg_br_retry"]
+    assert list(The_rows["Selected"]) == [False, False, True]
+    assert The_rows["Correlation"].iloc[-1] == 0.95
+
+def test_no_csv_with_one_strategy(tmp_path):
+
+    Make_registration(tmp_path, "reg_br")
+    Add_retry_row(str(tmp_path), {"Strategy": "reg_br_retry"})
+
+    assert not os.path.exists(os.path.join(str(tmp_path), "S9_Registration", "Registration_strategies.csv"))
+
+@pytest.mark.parametrize("name", ["reg_br", "reg_None_resected", "reg_None_resected_then_resected", "reg_br_then_resected"])
+@pytest.mark.parametrize("Initial_transform", [None, "initial.mat"])
+def test_retry_keeps_the_masks(monkeypatch, tmp_path, name, Initial_transform):
+
+    The_calls = []
+    monkeypatch.setattr(RAMP_events, "Registration_with_events", lambda **The_arguments: The_calls.append(The_arguments) or {})
+
+    Folder = str(tmp_path)
+    open(os.path.join(Folder, "br_0GenericAffine.mat"), "w").close()
+    The_inputs = {"fixed": "pre", "moving": "post", "fixed_mask": "pre_mask", "moving_mask": "post_mask"}
+
+    Register_strategy(name, The_inputs, Folder, Initial_transform=Initial_transform, Retry=True)
+
+    # Every call with the retry transforms, each stage masked as in the first attempt
+    First = {"reg_br": False, "reg_None_resected": True, "reg_None_resected_then_resected": True, "reg_br_then_resected": False}[name]
+    Last = {"reg_br": False, "reg_None_resected": True, "reg_None_resected_then_resected": False, "reg_br_then_resected": True}[name]
+
+    assert all(The_call["type_of_transform"] in Strategy_transforms["retry"] for The_call in The_calls)
+    assert ("mask" in The_calls[0]) == First and ("moving_mask" in The_calls[0]) == First
+    assert ("mask" in The_calls[-1]) == Last
+
+    # Started from the initial transform, never skipping the linear stages
+    assert The_calls[0]["type_of_transform"] != Strategy_transforms["retry"][2]
+    if Initial_transform is not None:
+        assert The_calls[0]["initial_transform"] == [Initial_transform]
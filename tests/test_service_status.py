@@ -0,0 +1,24 @@
+# The status of the jobs of the service (RAMP_service.py) is a copy, the worker threads change the jobs while it is sent
+
+import threading
+import types
+
+from RAMP_service import RAMPS_service
+
+def test_status_is_a_deep_copy():
+
+    The_service = types.SimpleNamespace(lock=threading.Lock(), The_jobs={
+        "A": {"ID": "A", "State": "running", "Stages": {"preparation": {"State": "running"}}, "Case": {"N4_settings": {"iterations": [50, 50]}}},
+    })
+
+    The_all = RAMPS_service.Status(The_service)
+    The_one = RAMPS_service.Status(The_service, "A")
+
+    The_service.The_jobs["A"]["Stages"]["preparation"]["State"] = "done"
+    The_service.The_jobs["A"]["Case"]["N4_settings"]["iterations"].append(30)
+
+    for The_status in [The_all[0], The_one]:
+        assert The_status["Stages"]["preparation"]["State"] == "running"
+        assert The_status["Case"]["N4_settings"]["iterations"] == [50, 50]
+
+    assert RAMPS_service.Status(The_service, "B") is None
@@ -0,0 +1,53 @@
+# Reading the stdout of a tool (fd 1) for its events while other threads print (RAMP_events.py)
+
+import os
+import threading
+
+import RAMP_events
+from RAMP_events import Print_output, Read_tool_output
+
+def test_tool_output_is_read(capfd):
+
+    The_lines = []
+
+    with Read_tool_output(The_lines.append):
+        os.write(1, b"Iteration 1\nIteration 2\n")
+
+    print("after", flush=True)
+
+    assert The_lines == ["Iteration 1\n", "Iteration 2\n"]
+    assert capfd.readouterr().out == "after\n"
+
+def test_other_threads_are_not_read(capfd, monkeypatch):
+
+    monkeypatch.setattr(RAMP_events, "Output_wait_seconds", 0.1)
+
+    The_lines = []
+    The_other_lines = []
+    reading = threading.Event()
+    done = threading.Event()
+
+    def Other_thread():
+
+        reading.wait()
+        # A second tool while fd 1 is taken runs without being read
+        with Read_tool_output(The_other_lines.append):
+            pass
+        done.set()
+        # Waits for fd 1 to come back rather than going into the tool output
+        Print_output("> from another thread")
+
+    The_thread = threading.Thread(target=Other_thread)
+    The_thread.start()
+
+    with Read_tool_output(The_lines.append):
+        reading.set()
+        os.write(1, b"tool line\n")
+        assert done.wait(timeout=10)
+        os.write(1, b"tool line\n")
+
+    The_thread.join()
+
+    assert The_lines == ["tool line\n", "tool line\n"]
+    assert The_other_lines == []
+    assert capfd.readouterr().out == "> from another thread\n"
@@ -0,0 +1,61 @@
+# Running an external tool under a memory cap while the background writer threads are running (RAMP_tools.py)
+
+import os
+import sys
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+import RAMP_tools
+from RAMP_tools import Run_tool
+from RAMP_writer import Finish_writes, Start_writer, Write_image
+
+# Waits so the cap is in place, then writes to 600 MB and writes its output
+The_tool = "import sys, time; time.sleep(1); The_memory = bytearray(600 * 1024 ** 2); open(sys.argv[1], 'w').write('done')"
+
+@pytest.fixture
+def The_writer(tmp_path):
+
+    Start_writer()
+
+    # Keep the writer threads busy while the tool starts
+    The_image = nib.Nifti1Image(np.random.default_rng(0).random((96, 96, 96), dtype=np.float32), np.eye(4))
+    for index in range(4):
+        Write_image(The_image, str(tmp_path / ("image_" + str(index) + ".nii.gz")))
+
+    yield
+
+    Finish_writes()
+
+@pytest.fixture
+def The_settings(monkeypatch):
+
+    The_settings = {"timeout": 60, "retries": 0, "memory_gb": None}
+    monkeypatch.setitem(RAMP_tools.Tool_settings, "test_tool", The_settings)
+
+    return The_settings
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="the memory cap needs Linux")
+def test_tool_over_its_cap_fails(tmp_path, The_writer, The_settings):
+
+    The_settings["memory_gb"] = 0.25
+    The_output = str(tmp_path / "output.txt")
+
+    with pytest.raises(RuntimeError):
+        Run_tool("test_tool", [sys.executable, "-c", The_tool, The_output], str(tmp_path / "tool.log"), Outputs=[The_output])
+
+    assert "MemoryError" in open(tmp_path / "tool.log").read()
+
+# Reserves 4 GB of address space it never uses (prot 0, as TensorFlow does), then writes to 200 MB
+The_reserving_tool = "import mmap, sys, time; time.sleep(1); The_reserved = mmap.mmap(-1, 4 * 1024 ** 3, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS, prot=0); The_memory = bytearray(200 * 1024 ** 2); open(sys.argv[1], 'w').write('done')"
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="the memory cap needs Linux")
+def test_reserved_address_space_is_not_capped(tmp_path, The_writer, The_settings):
+
+    The_settings["memory_gb"] = 1.0
+    The_output = str(tmp_path / "output.txt")
+
+    Run_tool("test_tool", [sys.executable, "-c", The_reserving_tool, The_output], str(tmp_path / "tool.log"), Outputs=[The_output])
+
+    assert os.path.isfile(The_output)